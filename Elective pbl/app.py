@@ -1,201 +1,447 @@
-from flask import Flask, render_template, request, jsonify
-from blockchain import Blockchain
-from hasher import hash_data
-import re
-import json
-import os
-app = Flask(__name__, template_folder='.', static_folder='.', static_url_path='')
-USERS_FILE = "users.json"
-
-def load_users():
-    default_admins = {
-        "gov": {"password": "secure_gov", "role": "admin", "org": "Ministry of Electronics"},
-        "bank": {"password": "secure_bank", "role": "admin", "org": "Reserve Bank"},
-        "ngo": {"password": "secure_ngo", "role": "admin", "org": "Civil Society"}
-    }
-
-    if not os.path.exists(USERS_FILE):
-        save_users(default_admins)
-        return default_admins
-    
-    try:
-        with open(USERS_FILE, 'r') as f:
-            data = json.load(f)
-            for admin, details in default_admins.items():
-                if admin not in data:
-                    data[admin] = details
-            return data
-    except:
-        return default_admins
-
-def save_users(data):
-    try:
-        with open(USERS_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-    except Exception as e:
-        print(f"Error saving DB: {e}")
-
-users = load_users()
-save_users(users) 
-my_blockchain = Blockchain()
-
-def validate_id_number(id_number):
-    return bool(re.match(r"^\d{12}$", id_number))
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-
-@app.route('/login', methods=['POST'])
-def login():
-    data = request.json
-    username = data.get('username')
-    password = data.get('password')
-    role_attempt = data.get('role')
-
-    global users
-    users = load_users()
-
-    if username in users and users[username]['password'] == password:
-        user_role = users[username]['role']
-        
-        if role_attempt != user_role:
-             return jsonify({"status": "error", "message": f"Access Denied: You cannot login as {role_attempt}"}), 403
-
-        user_data = {
-            "username": username,
-            "role": user_role,
-            "aadhar": users[username].get('aadhar'),
-            "status": users[username].get('status', 'none')
-        }
-        
-        if user_role == 'admin':
-            user_data['org'] = users[username].get('org', 'Unknown')
-            
-        return jsonify({"status": "success", "user": user_data})
-    
-    return jsonify({"status": "error", "message": "Invalid Credentials"}), 401
-
-@app.route('/signup', methods=['POST'])
-def signup():
-    data = request.json
-    username = data.get('username')
-    password = data.get('password')
-    
-    global users
-    users = load_users() 
-    
-    if username in users:
-        return jsonify({"status": "error", "message": "User already exists"}), 400
-        
-    users[username] = {
-        "password": password, 
-        "role": "user", 
-        "aadhar": None, 
-        "status": "none",
-        "application_data": None 
-    }
-    save_users(users)
-    
-    return jsonify({"status": "success", "message": "Account created! Please login."})
-
-
-
-@app.route('/register_aadhar', methods=['POST'])
-def register_aadhar():
-   
-    if my_blockchain.is_chain_valid() != -1:
-         return jsonify({"status": "error", "message": "SYSTEM HALTED: Blockchain compromised."}), 503
-
-    data = request.json
-    username = data.get('username')
-    id_number = data.get('id_number')
-
-    if not validate_id_number(id_number):
-        return jsonify({"status": "error", "message": "Invalid Aadhar. Must be 12 digits."}), 400
-
-    global users
-    users = load_users()
-
-    if users[username].get('aadhar'):
-        return jsonify({"status": "error", "message": "You already have a registered ID."}), 409
-
-    
-    id_hash = hash_data(id_number)
-    if my_blockchain.verify_identity(id_hash):
-        return jsonify({"status": "error", "message": "This ID is already on the blockchain."}), 409
-
-    
-    users[username]['status'] = 'pending'
-    users[username]['application_data'] = {
-        "id_number": id_number,
-        "hash": id_hash,
-        "timestamp": str(my_blockchain.get_last_block()['timestamp']) 
-    }
-    save_users(users)
-    
-    return jsonify({"status": "success", "message": "Application Saved. Waiting for Admin."})
-
-
-
-@app.route('/get_pending', methods=['GET'])
-def get_pending():
-    global users
-    users = load_users()
-    
-    
-    pending_list = []
-    for uname, udata in users.items():
-        if udata.get('status') == 'pending' and udata.get('application_data'):
-            pending_list.append({
-                "username": uname,
-                "id_number": udata['application_data']['id_number'],
-                "hash": udata['application_data']['hash']
-            })
-            
-    return jsonify(pending_list)
-
-@app.route('/approve_request', methods=['POST'])
-def approve_request():
-    if my_blockchain.is_chain_valid() != -1:
-         return jsonify({"status": "error", "message": "System compromised. Approvals disabled."}), 503
-
-    data = request.json
-    username = data.get('username')
-    
-    global users
-    users = load_users()
-    
-    user = users.get(username)
-    if not user or user['status'] != 'pending':
-        return jsonify({"status": "error", "message": "Request invalid or not found"}), 404
-
-    
-    app_data = user['application_data']
-    my_blockchain.add_block(app_data['hash'])
-    
-    
-    users[username]['aadhar'] = app_data['id_number']
-    users[username]['status'] = 'approved'
-    users[username]['application_data'] = None 
-    save_users(users)
-
-    return jsonify({"status": "success", "message": "Identity Minted to Blockchain."})
-
-@app.route('/chain_data', methods=['GET'])
-def chain_data():
-    validity = my_blockchain.is_chain_valid()
-    return jsonify({
-        "chain": my_blockchain.blockchain,
-        "is_valid": validity == -1,
-        "tampered_block_index": validity if validity != -1 else None
-    })
-
-@app.route('/repair', methods=['POST'])
-def repair():
-    my_blockchain.repair_chain()
-    return jsonify({"status": "success", "message": "Blockchain Repaired."})
-
-if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+from auth import (DUMMY_HASH, CredentialCache, SessionSigner, hash_password,
+                  load_secret, needs_rehash, verify_password)
+from blockchain import Blockchain
+from chain_writer import ChainWriter
+from event_feed import ChangeFeed
+from hasher import hash_data
+from replication import read_blocks, read_headers
+from user_store import UserStore
+import functools
+import json
+import logging
+import metrics
+import re
+import threading
+import time
+app = Flask(__name__, template_folder='.', static_folder='.', static_url_path='')
+USERS_FILE = "users.json"
+USERS_DB = "users.db"
+SESSION_KEY_FILE = "session.key"
+# Most usernames one /approve_requests call may approve
+MAX_APPROVAL_BATCH = 1000
+
+DEFAULT_ADMINS = {
+    "gov": {"password": "secure_gov", "role": "admin", "org": "Ministry of Electronics"},
+    "bank": {"password": "secure_bank", "role": "admin", "org": "Reserve Bank"},
+    "ngo": {"password": "secure_ngo", "role": "admin", "org": "Civil Society"}
+}
+
+users = UserStore(USERS_DB, legacy_file=USERS_FILE)
+for admin_name, admin in DEFAULT_ADMINS.items():
+    # Only hash the passwords of admins that still have to be created
+    if users.get(admin_name) is None:
+        users.create(admin_name, dict(admin, password=hash_password(admin['password'])))
+# Logins read users from here instead of the database every time
+credentials = CredentialCache(users)
+# Signs the session tokens handed out by /login
+sessions = SessionSigner(load_secret(SESSION_KEY_FILE))
+my_blockchain = Blockchain()
+# All appends go through this single writer thread; request
+# threads only read the chain (see Blockchain.snapshot).
+chain_writer = ChainWriter(my_blockchain)
+# Pushes new applications and blocks to admin dashboards (/events)
+change_feed = ChangeFeed(my_blockchain, users)
+
+# Held while POST /audit runs; a second audit is turned away meanwhile
+audit_running = threading.Lock()
+
+metrics.CHAIN_BLOCKS.set_function(lambda: len(my_blockchain.blockchain))
+metrics.CHAIN_IDENTITIES.set_function(lambda: len(my_blockchain.identity_index))
+metrics.EVENT_STREAM_CLIENTS.set_function(lambda: change_feed.clients)
+
+@app.before_request
+def start_timer():
+    if metrics.enabled:
+        g.request_start = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    # Labelled by route pattern (e.g. /identity_proof/<identity_hash>),
+    # not the raw path, so every identity doesn't get its own series
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route=route,
+                                             method=request.method, status=response.status_code)
+    return response
+
+@app.before_request
+def sync_chain():
+    # Other server workers may have appended to the shared chain file.
+    # This is a single stat() call unless the file actually changed.
+    my_blockchain.sync_from_storage()
+
+def validate_id_number(id_number):
+    return bool(re.match(r"^\d{12}$", id_number))
+
+def require_session(role=None, token_in_query=False):
+    """
+    Decorator for routes that need a logged-in user. Checks the session
+    token from the Authorization header (no disk access) and puts its
+    payload in g.session.
+
+    Args:
+        role (str): Role the user must have (e.g. 'admin'), or None.
+        token_in_query (bool): Also accept the token as ?token=<token>,
+            for clients that can't set headers (EventSource).
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            header = request.headers.get('Authorization', '')
+            token = header[len('Bearer '):] if header.startswith('Bearer ') else None
+            if token is None and token_in_query:
+                token = request.args.get('token')
+            session = sessions.verify(token)
+            if session is None:
+                return jsonify({"status": "error", "message": "Session expired. Please log in again."}), 401
+            if role is not None and session['role'] != role:
+                return jsonify({"status": "error", "message": "Access Denied."}), 403
+            g.session = session
+            return view(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+
+@app.route('/login', methods=['POST'])
+def login():
+    data = request.json
+    username = data.get('username')
+    password = data.get('password')
+    role_attempt = data.get('role')
+
+    user = credentials.get(username)
+    # Unknown users are checked against a dummy hash, so both
+    # cases take the same time
+    stored = user['password'] if user else DUMMY_HASH
+
+    if verify_password(password, stored) and user:
+        if needs_rehash(stored):
+            # Plaintext from before hashing, or old hash settings
+            users.update(username, password=hash_password(password))
+            credentials.invalidate(username)
+        user_role = user['role']
+        
+        if role_attempt != user_role:
+             return jsonify({"status": "error", "message": f"Access Denied: You cannot login as {role_attempt}"}), 403
+
+        user_data = {
+            "username": username,
+            "role": user_role,
+            "aadhar": user.get('aadhar'),
+            "status": user.get('status', 'none')
+        }
+        
+        if user_role == 'admin':
+            user_data['org'] = user.get('org', 'Unknown')
+            
+        # Sent back with later requests instead of the password
+        token = sessions.issue(username, user_role)
+        return jsonify({"status": "success", "user": user_data, "token": token})
+    
+    return jsonify({"status": "error", "message": "Invalid Credentials"}), 401
+
+@app.route('/signup', methods=['POST'])
+def signup():
+    data = request.json
+    username = data.get('username')
+    password = data.get('password')
+    
+    if not username or not isinstance(password, str) or not password:
+        return jsonify({"status": "error", "message": "Username and password are required."}), 400
+
+    created = users.create(username, {
+        "password": hash_password(password), 
+        "role": "user", 
+        "aadhar": None, 
+        "status": "none",
+        "application_data": None 
+    })
+    if not created:
+        return jsonify({"status": "error", "message": "User already exists"}), 400
+    credentials.invalidate(username)
+    
+    return jsonify({"status": "success", "message": "Account created! Please login."})
+
+
+
+@app.route('/register_aadhar', methods=['POST'])
+@require_session()
+def register_aadhar():
+   
+    if my_blockchain.is_chain_valid() != -1:
+         return jsonify({"status": "error", "message": "SYSTEM HALTED: Blockchain compromised."}), 503
+
+    data = request.json
+    # Users can only apply for themselves
+    username = g.session['sub']
+    id_number = data.get('id_number')
+
+    if not validate_id_number(id_number):
+        return jsonify({"status": "error", "message": "Invalid Aadhar. Must be 12 digits."}), 400
+
+    user = users.get(username)
+    if not user:
+        return jsonify({"status": "error", "message": "User not found"}), 404
+
+    if user.get('aadhar'):
+        return jsonify({"status": "error", "message": "You already have a registered ID."}), 409
+
+    
+    id_hash = hash_data(id_number)
+    if my_blockchain.verify_identity(id_hash):
+        metrics.DUPLICATES_REJECTED.inc()
+        return jsonify({"status": "error", "message": "This ID is already on the blockchain."}), 409
+
+    
+    users.update(username, status='pending', application_data={
+        "id_number": id_number,
+        "hash": id_hash,
+        "timestamp": str(my_blockchain.get_last_block()['timestamp']) 
+    })
+    credentials.invalidate(username)
+    change_feed.notify()
+    
+    return jsonify({"status": "success", "message": "Application Saved. Waiting for Admin."})
+
+
+
+@app.route('/get_pending', methods=['GET'])
+@require_session('admin')
+def get_pending():
+    # Paginated: ?limit=<n>&after=<cursor>. The cursor for the next
+    # page is returned in the X-Next-Cursor header. Pages hold 1 to
+    # 1000 applications (SQLite would read a negative limit as none).
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    after = request.args.get('after', 0, type=int)
+
+    pending_list, next_cursor = users.list_pending(limit=limit, after=after)
+
+    response = jsonify(pending_list)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+@app.route('/approve_request', methods=['POST'])
+@require_session('admin')
+def approve_request():
+    if my_blockchain.is_chain_valid() != -1:
+         return jsonify({"status": "error", "message": "System compromised. Approvals disabled."}), 503
+
+    data = request.json
+    username = data.get('username')
+    
+    user = users.get(username)
+    if not user or user['status'] != 'pending':
+        return jsonify({"status": "error", "message": "Request invalid or not found"}), 404
+
+    
+    app_data = user['application_data']
+    try:
+        block = chain_writer.add_block(app_data['hash'])
+    except OSError:
+        # The block was rolled back, so the request stays pending
+        return jsonify({"status": "error", "message": "Could not save the block. Please try again."}), 503
+    if not block:
+        return jsonify({"status": "error", "message": "This ID is already on the blockchain."}), 409
+    
+    
+    users.update(username, aadhar=app_data['id_number'], status='approved', application_data=None)
+    credentials.invalidate(username)
+    change_feed.notify()
+
+    return jsonify({"status": "success", "message": "Identity Minted to Blockchain."})
+
+@app.route('/approve_requests', methods=['POST'])
+@require_session('admin')
+def approve_requests():
+    # Bulk version of /approve_request: validates the chain once,
+    # mints every approved identity and saves chain and users once.
+    if my_blockchain.is_chain_valid() != -1:
+         return jsonify({"status": "error", "message": "System compromised. Approvals disabled."}), 503
+
+    data = request.json
+    usernames = data.get('usernames') if isinstance(data, dict) else None
+    if not isinstance(usernames, list) or not usernames or not all(isinstance(name, str) for name in usernames):
+        return jsonify({"status": "error", "message": "usernames must be a non-empty list of usernames."}), 400
+    if len(usernames) > MAX_APPROVAL_BATCH:
+        return jsonify({"status": "error",
+                        "message": f"At most {MAX_APPROVAL_BATCH} usernames can be approved at once."}), 413
+
+    pending_users = users.get_many(usernames)
+
+    results = []
+    to_mint = []
+    for username in usernames:
+        user = pending_users.get(username)
+        if not user or user['status'] != 'pending' or not user.get('application_data'):
+            results.append({"username": username, "status": "not_found"})
+            continue
+        result = {"username": username}
+        results.append(result)
+        to_mint.append((result, user['application_data']))
+
+    # The whole batch goes into one Merkle block
+    try:
+        block_results = chain_writer.add_blocks([app_data['hash'] for _, app_data in to_mint], merkle=True)
+    except OSError:
+        return jsonify({"status": "error", "message": "Could not save the block. Please try again."}), 503
+
+    approved = []
+    for (result, app_data), block_result in zip(to_mint, block_results):
+        result['status'] = 'approved' if block_result['status'] == 'added' else block_result['status']
+        if block_result['status'] == 'added':
+            result['block_index'] = block_result['index']
+            approved.append((result['username'], {
+                "aadhar": app_data['id_number'],
+                "status": 'approved',
+                "application_data": None
+            }))
+    users.update_many(approved)
+    credentials.invalidate(*(username for username, _ in approved))
+    change_feed.notify()
+
+    return jsonify({
+        "status": "success",
+        "message": f"{len(approved)} of {len(usernames)} identities minted to blockchain.",
+        "results": results
+    })
+
+@app.route('/events', methods=['GET'])
+@require_session('admin', token_in_query=True)
+def events():
+    # Server-sent events: new pending applications and new blocks, as
+    # they happen (see event_feed.py). Browsers reconnect on their own
+    # and resume from the Last-Event-ID header. EventSource can't send
+    # an Authorization header, so the dashboard passes ?token=.
+    stream = change_feed.stream(request.headers.get('Last-Event-ID'))
+    response = Response(stream_with_context(stream), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/chain_data', methods=['GET'])
+def chain_data():
+    # Cursor pagination: ?after=<block index>&limit=<n> returns the blocks
+    # that come after the given index. ?format=jsonl streams the blocks as
+    # JSON lines instead (for full downloads).
+    # At least one block per page, so next_after always moves forward
+    # (a limit of 0 would hand clients the same cursor back forever).
+    after = max(request.args.get('after', 0, type=int), 0)
+    limit = max(1, min(request.args.get('limit', 500, type=int), 5000))
+    output_format = 'jsonl' if request.args.get('format') == 'jsonl' else 'json'
+
+    # Only blocks appended since the last check get re-hashed here,
+    # so this is normally just the cached result.
+    validity = my_blockchain.is_chain_valid()
+
+    # Take one consistent view of the chain for this response
+    chain, length = my_blockchain.snapshot()
+    last_hash = chain[-1]['hash'] if length else ''
+
+    # Clients can send back the ETag to skip the download if nothing changed.
+    # It covers the request, too: another page of the same chain is a
+    # different response.
+    etag = f'"{length}-{last_hash[:16]}-{validity}-{after}-{limit}-{output_format}"'
+    if request.if_none_match and etag.strip('"') in request.if_none_match:
+        response = Response(status=304)
+        response.headers['ETag'] = etag
+        response.headers['X-Last-Index'] = str(length)
+        return response
+
+    if output_format == 'jsonl':
+        def stream_blocks():
+            for position in range(after, length):
+                yield json.dumps(chain[position].to_dict()) + "\n"
+        response = Response(stream_with_context(stream_blocks()), mimetype='application/x-ndjson')
+    else:
+        page = chain[after:min(after + limit, length)]
+        next_after = after + len(page) if after + len(page) < length else None
+        response = jsonify({
+            "chain": [block.to_dict() for block in page],
+            "length": length,
+            "identity_count": len(my_blockchain.identity_index),
+            "next_after": next_after,
+            # Hash of the block the client says it already has. If it doesn't
+            # match the client's copy, its cached blocks are stale.
+            "base_hash": chain[after - 1]['hash'] if 0 < after <= length else None,
+            "is_valid": validity == -1,
+            "tampered_block_index": validity if validity != -1 else None
+        })
+
+    response.headers['ETag'] = etag
+    response.headers['X-Last-Index'] = str(length)
+    return response
+
+@app.route('/audit', methods=['POST'])
+@require_session('admin')
+def audit():
+    # Full re-verification of every block, spread over all CPU cores.
+    # /chain_data keeps serving the cached result in the meantime.
+    if not audit_running.acquire(blocking=False):
+        return jsonify({"status": "error", "message": "An audit is already running."}), 409
+    try:
+        validity = my_blockchain.audit_chain()
+    finally:
+        audit_running.release()
+    return jsonify({
+        "is_valid": validity == -1,
+        "tampered_block_index": validity if validity != -1 else None
+    })
+
+@app.route('/identity_proof/<identity_hash>', methods=['GET'])
+def identity_proof(identity_hash):
+    # Inclusion proof for relying parties (see merkle.verify_proof)
+    proof = my_blockchain.get_inclusion_proof(identity_hash)
+    if proof is None:
+        return jsonify({"status": "error", "message": "Identity not found on the blockchain."}), 404
+    return jsonify({"status": "success", "proof": proof})
+
+@app.route('/sync/headers', methods=['GET'])
+def sync_headers():
+    # Replication (see replication.py): headers of the blocks after the
+    # first ?after=<n>, for followers to check before they download bodies
+    if my_blockchain.is_chain_valid() != -1:
+        return jsonify({"status": "error", "message": "SYSTEM HALTED: Blockchain compromised."}), 503
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', 1000, type=int)
+    return jsonify(read_headers(my_blockchain, after, limit))
+
+@app.route('/sync/blocks', methods=['GET'])
+def sync_blocks():
+    # Replication: full blocks after the first ?after=<n>
+    if my_blockchain.is_chain_valid() != -1:
+        return jsonify({"status": "error", "message": "SYSTEM HALTED: Blockchain compromised."}), 503
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', 1000, type=int)
+    return jsonify(read_blocks(my_blockchain, after, limit))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Prometheus text format, for scraping
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/repair', methods=['POST'])
+@require_session('admin')
+def repair():
+    report = my_blockchain.repair_chain()
+    if report['status'] == 'failed':
+        message = report.get('message', "Repair could not restore a valid chain.")
+        return jsonify({"status": "error", "message": message, "report": report}), 500
+    if report['status'] == 'intact':
+        return jsonify({"status": "success", "message": "Blockchain is intact. Nothing to repair.", "report": report})
+
+    # Dashboards holding the old blocks get a reset event
+    change_feed.notify()
+    message = (f"Blockchain Repaired from Block #{report['repaired_from']}: "
+               f"{report['restored_blocks']} restored, {report['relinked_blocks']} re-linked.")
+    return jsonify({"status": "success", "message": message, "report": report})
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    app.run(debug=True, port=5000, threaded=True)
\ No newline at end of file
@@ -0,0 +1,105 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from blockchain import calculate_hash, identities_match
+
+"""
+File: audit.py
+Description: Parallel full-chain audit. Re-hashing one block does not
+depend on any other block, and checking the 'previous_hash' links only
+compares neighbouring blocks, so the chain can be split into chunks that
+are verified in separate processes. The results are merged into the
+index of the first tampered block.
+"""
+
+# Below this many blocks, starting worker processes costs more than it saves
+MIN_PARALLEL_BLOCKS = 20000
+
+def verify_chunk(blocks, previous_hash, start):
+    """
+    Verifies a run of consecutive blocks. Runs in a worker process.
+
+    Args:
+        blocks (list): The blocks to check, in chain order.
+        previous_hash (str): Hash of the block just before the first one.
+        start (int): Chain position of the first block.
+
+    Returns:
+        int: Index of the first bad block in the run (its position + 1,
+             not its own 'index' field, which may be tampered), or -1.
+    """
+    for position, block in enumerate(blocks, start):
+        if (block['index'] != position + 1
+                or block['hash'] != calculate_hash(block)
+                or not identities_match(block)
+                or block['previous_hash'] != previous_hash):
+            return position + 1
+        previous_hash = block['hash']
+    return -1
+
+def parallel_audit(chain, workers=None, chunk_size=10000, progress=None, length=None):
+    """
+    Verifies every block after the Genesis Block using a process pool.
+    Only a few chunks are sliced out of the chain at a time, so a chain
+    whose old blocks live on disk (segments.SegmentedChain) is never
+    loaded into memory all at once.
+
+    Args:
+        chain (list): The full chain (Genesis Block first).
+        workers (int): Number of worker processes (default: CPU count).
+        chunk_size (int): Blocks handed to a worker at a time.
+        progress (callable): Called as progress(blocks_checked, total)
+            each time a chunk finishes.
+        length (int): Only check the first `length` blocks
+            (default: the whole chain).
+
+    Returns:
+        int: -1 if every block is valid, otherwise the index of the
+             first tampered block.
+    """
+    length = len(chain) if length is None else length
+    total = length - 1
+    workers = workers or os.cpu_count() or 1
+    if total <= 0:
+        return -1
+
+    # Small chains (or a single worker): just check in this process
+    if workers == 1 or total < MIN_PARALLEL_BLOCKS:
+        for start in range(1, length, chunk_size):
+            result = verify_chunk(chain[start:min(start + chunk_size, length)], chain[start - 1]['hash'], start)
+            if result != -1:
+                return result
+            if progress:
+                progress(min(start + chunk_size - 1, total), total)
+        return -1
+
+    first_bad = -1
+    checked = 0
+    starts = iter(range(1, length, chunk_size))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+
+        def submit_next():
+            start = next(starts, None)
+            # Chunks after the first bad block no longer matter
+            if start is None or (first_bad != -1 and start > first_bad):
+                return
+            chunk = chain[start:min(start + chunk_size, length)]
+            futures[pool.submit(verify_chunk, chunk, chain[start - 1]['hash'], start)] = (start, len(chunk))
+
+        # Keep every worker busy, with one spare chunk each
+        for _ in range(workers * 2):
+            submit_next()
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, count = futures.pop(future)
+                result = future.result()
+                if result != -1 and (first_bad == -1 or result < first_bad):
+                    first_bad = result
+                checked += count
+                if progress:
+                    progress(min(checked, total), total)
+                submit_next()
+
+    return first_bad
@@ -0,0 +1,253 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+"""
+File: auth.py
+Description: Login support for app.py: salted password hashing, an
+in-memory cache of user credentials and signed session tokens.
+
+Passwords are stored as PBKDF2-SHA256 hashes with a random salt. After a
+successful login the client gets a session token, signed with a server
+secret, that it sends with every later request (Authorization: Bearer
+<token>). Checking a token is one HMAC, so routes that need a logged-in
+user don't read the database or hash a password again.
+"""
+
+# PBKDF2 rounds for new hashes, about 0.1 s per hash on one core. The
+# rounds are stored with every hash, so changing this only affects
+# passwords set (or logged in with) afterwards.
+PBKDF2_ITERATIONS = int(os.environ.get("IDV_PBKDF2_ITERATIONS", 200000))
+HASH_PREFIX = "pbkdf2_sha256"
+SALT_BYTES = 16
+
+# How long a session token stays valid, in seconds
+SESSION_TTL = 8 * 60 * 60
+
+# hashlib releases the GIL while hashing, so logins run in parallel. At
+# most one hash per core runs at a time; a burst of logins queues here
+# instead of taking the CPU from every other request thread.
+hashing_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+def pbkdf2(password, salt, iterations):
+    with hashing_slots, metrics.PASSWORD_HASH_SECONDS.time():
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+def hash_password(password, iterations=PBKDF2_ITERATIONS):
+    """
+    Hashes a password for storage.
+
+    Args:
+        password (str): The plaintext password.
+        iterations (int): PBKDF2 rounds.
+
+    Returns:
+        str: "pbkdf2_sha256$<rounds>$<salt hex>$<hash hex>"
+    """
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = pbkdf2(password, salt, iterations)
+    return f"{HASH_PREFIX}${iterations}${salt.hex()}${digest.hex()}"
+
+# Checked against when a username doesn't exist, so a login for an
+# unknown user takes as long as one with a wrong password
+DUMMY_HASH = f"{HASH_PREFIX}${PBKDF2_ITERATIONS}${'00' * SALT_BYTES}${'00' * 32}"
+
+def verify_password(password, stored):
+    """
+    Checks a password against its stored hash.
+
+    Accounts from before password hashing (users.json and old databases)
+    still hold the plaintext; those are compared directly, and
+    needs_rehash() tells the caller to store a hash instead.
+
+    Args:
+        password (str): The password given at login.
+        stored (str): The stored password hash.
+
+    Returns:
+        bool: True if the password is correct.
+    """
+    if not isinstance(password, str) or not isinstance(stored, str):
+        return False
+    parts = stored.split("$")
+    if len(parts) != 4 or parts[0] != HASH_PREFIX:
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    try:
+        iterations, salt, expected = int(parts[1]), bytes.fromhex(parts[2]), bytes.fromhex(parts[3])
+        digest = pbkdf2(password, salt, iterations)
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest, expected)
+
+def needs_rehash(stored):
+    """
+    Returns True if a stored password is plaintext or was hashed with
+    different settings than new passwords get.
+    """
+    parts = stored.split("$")
+    return len(parts) != 4 or parts[0] != HASH_PREFIX or parts[1] != str(PBKDF2_ITERATIONS)
+
+def encode_part(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode('ascii')
+
+def decode_part(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def load_secret(path):
+    """
+    Returns the key sessions are signed with. It is kept in a file, so
+    every server worker signs with the same key and sessions survive a
+    restart. The environment variable IDV_SESSION_SECRET overrides it.
+
+    Args:
+        path (str): The key file (created if missing).
+    """
+    configured = os.environ.get("IDV_SESSION_SECRET")
+    if configured:
+        return configured.encode('utf-8')
+    try:
+        # Only one worker may create the key; the others read it
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # It may still be being written by the worker that created it
+        for _ in range(50):
+            with open(path, 'rb') as f:
+                secret = f.read()
+            if secret:
+                return secret
+            time.sleep(0.01)
+        raise RuntimeError(f"Session key file {path} is empty.")
+    secret = secrets.token_hex(32).encode('ascii')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+        f.flush()
+        os.fsync(f.fileno())
+    return secret
+
+class SessionSigner:
+    """
+    Issues and checks signed session tokens.
+
+    A token is "<payload>.<signature>", both base64url: the payload is
+    JSON with the username ("sub"), the role and the expiry time ("exp"),
+    the signature is its HMAC-SHA256 under the server secret. Nothing is
+    stored on the server, so any worker can check any token.
+    """
+
+    def __init__(self, secret, ttl=SESSION_TTL):
+        """
+        Args:
+            secret (bytes): The signing key (see load_secret).
+            ttl (int): Seconds a token stays valid.
+        """
+        self.secret = secret
+        self.ttl = ttl
+
+    def sign(self, payload_part):
+        return hmac.new(self.secret, payload_part.encode('ascii'), hashlib.sha256).digest()
+
+    def issue(self, username, role):
+        """
+        Returns a new session token for a user who just logged in.
+        """
+        payload = {"sub": username, "role": role, "exp": int(time.time()) + self.ttl}
+        payload_part = encode_part(json.dumps(payload, separators=(",", ":")).encode('utf-8'))
+        return f"{payload_part}.{encode_part(self.sign(payload_part))}"
+
+    def verify(self, token):
+        """
+        Checks a session token.
+
+        Args:
+            token (str): The token sent by the client.
+
+        Returns:
+            dict: The payload (sub, role, exp), or None if the token is
+                  missing, forged, malformed or expired.
+        """
+        if not token or token.count(".") != 1:
+            return None
+        payload_part, signature_part = token.split(".")
+        try:
+            signature = decode_part(signature_part)
+            if not hmac.compare_digest(signature, self.sign(payload_part)):
+                return None
+            payload = json.loads(decode_part(payload_part))
+        except (ValueError, UnicodeError):
+            return None
+        if not isinstance(payload, dict) or not isinstance(payload.get("exp"), int) or payload["exp"] < time.time():
+            return None
+        return payload
+
+class CredentialCache:
+    """
+    Keeps recently used user records (password hash, role, status) in
+    memory, so logins don't query the user database every time.
+
+    This process drops an entry whenever it changes the user (signup,
+    application, approval; see invalidate). Changes made by other server
+    workers are picked up when the entry expires after max_age seconds.
+    """
+
+    def __init__(self, users, max_age=30.0, max_entries=10000):
+        """
+        Args:
+            users (UserStore): Where the records come from.
+            max_age (float): Seconds an entry is used before it is read again.
+            max_entries (int): Entries kept; the least recently used go first.
+        """
+        self.users = users
+        self.max_age = max_age
+        self.max_entries = max_entries
+        # username -> (time loaded, user record)
+        self.entries = OrderedDict()
+        # Bumped by invalidate(), so a record read from the database
+        # while it was being changed isn't cached
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get(self, username):
+        """
+        Returns a user record, from the cache if it is fresh enough.
+
+        Returns:
+            dict: The user record, or None if the user doesn't exist
+                  (unknown users aren't cached, so a signup on another
+                  worker is seen at once).
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(username)
+            if entry is not None and now - entry[0] < self.max_age:
+                self.entries.move_to_end(username)
+                metrics.CREDENTIAL_CACHE.inc(result="hit")
+                return entry[1]
+            version = self.version
+        metrics.CREDENTIAL_CACHE.inc(result="miss")
+
+        user = self.users.get(username)
+        if user is not None:
+            with self.lock:
+                if version != self.version:
+                    return user
+                self.entries[username] = (now, user)
+                self.entries.move_to_end(username)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return user
+
+    def invalidate(self, *usernames):
+        """
+        Drops users whose record was just changed.
+        """
+        with self.lock:
+            self.version += 1
+            for username in usernames:
+                self.entries.pop(username, None)
@@ -0,0 +1,236 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from auth import hash_password
+from blockchain import Blockchain
+from hasher import hash_data
+from storage import JsonLinesStorage
+
+"""
+File: benchmark.py
+Description: Reproducible benchmarks for the identity chain. Builds
+synthetic chains of growing size and measures how the core operations
+(append, validation, lookup, save, load) and the Flask routes behave as
+the chain grows. Results are written as JSON so runs from different
+versions can be compared.
+
+Usage: python benchmark.py --sizes 1000,10000,100000 --output results.json
+"""
+
+def synthetic_ids(count, seed):
+    """
+    Returns `count` distinct, reproducible 12-digit ID numbers.
+    """
+    rng = random.Random(seed)
+    return [str(n) for n in rng.sample(range(10**11, 10**12), count)]
+
+def summarize(samples):
+    """
+    Turns a list of per-operation timings (seconds) into statistics.
+    """
+    samples = sorted(samples)
+    count = len(samples)
+    total = sum(samples)
+    return {
+        "count": count,
+        "mean_ms": total / count * 1000,
+        "p50_ms": samples[count // 2] * 1000,
+        "p95_ms": samples[min(count - 1, int(count * 0.95))] * 1000,
+        "p99_ms": samples[min(count - 1, int(count * 0.99))] * 1000,
+        "max_ms": samples[-1] * 1000,
+        "ops_per_sec": count / total if total else None
+    }
+
+def time_each(operation, inputs):
+    """
+    Runs operation(x) for every x and returns the timing statistics.
+    """
+    samples = []
+    for item in inputs:
+        start = time.perf_counter()
+        operation(item)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def time_once(operation):
+    """
+    Runs operation() once and returns its duration in milliseconds.
+    """
+    start = time.perf_counter()
+    operation()
+    return (time.perf_counter() - start) * 1000
+
+def build_chain(directory, size, seed):
+    """
+    Creates a chain with `size` blocks (including the Genesis Block)
+    in the given directory.
+    """
+    storage_path = os.path.join(directory, "blockchain.jsonl")
+    chain = Blockchain(storage=JsonLinesStorage(storage_path))
+    hashes = [hash_data(id_number) for id_number in synthetic_ids(size - 1, seed)]
+    for start in range(0, len(hashes), 10000):
+        chain.add_blocks(hashes[start:start + 10000])
+    chain.storage.flush()
+    return chain, hashes
+
+def bench_chain(size, operations, seed):
+    """
+    Measures the core Blockchain operations on a chain of `size` blocks.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        build_start = time.perf_counter()
+        chain, hashes = build_chain(directory, size, seed)
+        results["build_s"] = time.perf_counter() - build_start
+
+        present = random.Random(seed + 1).sample(hashes, min(operations, len(hashes)))
+        missing = [hash_data(f"missing-{n}") for n in range(operations)]
+        new = [hash_data(f"new-{n}") for n in range(operations)]
+
+        results["verify_identity_hit"] = time_each(chain.verify_identity, present)
+        results["verify_identity_miss"] = time_each(chain.verify_identity, missing)
+        results["find_identity"] = time_each(chain.find_identity, present)
+
+        results["is_chain_valid_full_ms"] = time_once(lambda: chain.is_chain_valid(full=True))
+        results["is_chain_valid_incremental"] = time_each(lambda _: chain.is_chain_valid(), range(operations))
+
+        results["add_block"] = time_each(chain.add_block, new)
+        batch = [hash_data(f"batch-{n}") for n in range(operations)]
+        batch_ms = time_once(lambda: chain.add_blocks(batch))
+        results["add_blocks_batch"] = {
+            "count": operations,
+            "total_ms": batch_ms,
+            "ops_per_sec": operations / (batch_ms / 1000) if batch_ms else None
+        }
+
+        results["save_chain_ms"] = time_once(chain.save_chain)
+        chain.close()
+        storage_path = chain.storage_file
+        # The first load reads the whole log (and leaves a snapshot
+        # behind for large chains), the second starts from the snapshot
+        results["load_chain_ms"] = time_once(lambda: Blockchain(storage=JsonLinesStorage(storage_path)).close())
+        results["load_chain_snapshot_ms"] = time_once(lambda: Blockchain(storage=JsonLinesStorage(storage_path)).close())
+        results["storage_bytes"] = os.path.getsize(storage_path)
+    return results
+
+def bench_http(size, users, operations, seed):
+    """
+    Drives the Flask routes in app.py through Flask's test client, with a
+    chain of `size` blocks and `users` registered users, half of them
+    with a pending application.
+    """
+    # Flask is only needed for this part
+    if importlib.util.find_spec("flask") is None:
+        return {"skipped": "flask is not installed"}
+
+    results = {}
+    previous_directory = os.getcwd()
+    app_directory = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        # app.py keeps its data files in the working directory
+        os.chdir(directory)
+        try:
+            build_chain(directory, size, seed)
+            from user_store import UserStore
+            store = UserStore("users.db")
+            id_numbers = synthetic_ids(users, seed + 2)
+            # One hash shared by every synthetic user (hashing each
+            # password separately would take minutes)
+            password_hash = hash_password("pw")
+            with store.connection() as conn:
+                conn.executemany(
+                    "INSERT INTO users (username, password, role, status, application_data) VALUES (?, ?, 'user', ?, ?)",
+                    [(f"user{n}", password_hash,
+                      "pending" if n % 2 else "none",
+                      json.dumps({"id_number": id_numbers[n], "hash": hash_data(id_numbers[n]), "timestamp": ""}) if n % 2 else None)
+                     for n in range(users)]
+                )
+
+            sys.path.insert(0, app_directory)
+            import app as app_module
+            client = app_module.app.test_client()
+
+            names = [f"user{n}" for n in range(0, min(users, operations * 2), 2)]
+            pending = [f"user{n}" for n in range(1, min(users, operations * 2), 2)]
+            tokens = {}
+
+            def login(name):
+                response = client.post('/login', json={"username": name, "password": "pw", "role": "user"})
+                tokens[name] = response.get_json()['token']
+
+            def authorized(name):
+                return {"Authorization": f"Bearer {tokens[name]}"}
+
+            # The first login of each user reads the database, the
+            # second one takes the record from the credential cache. Both
+            # still check the password with the full PBKDF2 work factor,
+            # which is most of their time.
+            results["POST /login"] = time_each(login, names)
+            results["POST /login (cached record, includes password hashing)"] = time_each(login, names)
+            tokens["gov"] = client.post('/login', json={"username": "gov", "password": "secure_gov",
+                                                        "role": "admin"}).get_json()['token']
+            results["GET /chain_data?limit=1"] = time_each(
+                lambda _: client.get('/chain_data?limit=1'), range(operations))
+            results["GET /chain_data (first page)"] = time_each(
+                lambda _: client.get('/chain_data'), range(operations))
+            results["GET /get_pending"] = time_each(
+                lambda _: client.get('/get_pending', headers=authorized("gov")), range(operations))
+            new_ids = dict(zip(names, synthetic_ids(len(names), seed + 3)))
+            results["POST /register_aadhar"] = time_each(
+                lambda name: client.post('/register_aadhar', json={"id_number": new_ids[name]},
+                                         headers=authorized(name)), names)
+            results["POST /approve_request"] = time_each(
+                lambda name: client.post('/approve_request', json={"username": name},
+                                         headers=authorized("gov")), pending)
+        finally:
+            sys.modules.pop('app', None)
+            os.chdir(previous_directory)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the identity blockchain.")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma-separated chain sizes (e.g. 1000,10000,100000,1000000)")
+    parser.add_argument("--operations", type=int, default=200, help="operations timed per measurement")
+    parser.add_argument("--users", type=int, default=10000, help="synthetic users for the HTTP benchmark")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-http", action="store_true", help="only benchmark the Blockchain class")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the JSON results")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = {
+        "timestamp": str(datetime.now()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "results": {}
+    }
+
+    for size in sizes:
+        print(f"Benchmarking chain of {size} blocks...")
+        entry = {"chain": bench_chain(size, args.operations, args.seed)}
+        if not args.skip_http:
+            entry["http"] = bench_http(size, args.users, args.operations, args.seed)
+        report["results"][str(size)] = entry
+
+        chain_results = entry["chain"]
+        print(f"  add_block p50:          {chain_results['add_block']['p50_ms']:.3f} ms")
+        print(f"  verify_identity p50:    {chain_results['verify_identity_hit']['p50_ms']:.4f} ms")
+        print(f"  is_chain_valid (full):  {chain_results['is_chain_valid_full_ms']:.1f} ms")
+        print(f"  load_chain:             {chain_results['load_chain_ms']:.1f} ms")
+        print(f"  load_chain (snapshot):  {chain_results['load_chain_snapshot_ms']:.1f} ms")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,222 +1,1489 @@
-import hashlib
-import json
-from datetime import datetime
-from hasher import hash_data # Import our simple hash function
-
-"""
-File: blockchain.py
-Description: Defines the Block and Blockchain classes. This is the core
-engine of the identity system. It handles block creation, validation,
-and persistent storage.
-"""
-
-class Blockchain:
-    """
-    Manages the chain of blocks, including adding new blocks
-    and validating the integrity of the chain.
-    """
-    
-    def __init__(self):
-        """
-        Constructor for the Blockchain.
-        """
-        # --- This is the main list that holds all the blocks ---
-        # The error was caused by using "self.chain" instead of "self.blockchain"
-        self.blockchain = []
-        self.storage_file = "blockchain.json"
-        
-        # --- COMPLETES PENDING TASK: Persistent Storage ---
-        # Try to load the chain from the file on startup.
-        # If no file exists, create the Genesis Block.
-        self.load_chain()
-
-    def new_block(self, data, previous_hash):
-        """
-        Creates a new block to be added to the chain.
-        
-        Args:
-            data (str): The data to be stored (e.g., hashed Aadhaar).
-            previous_hash (str): The hash of the previous block in the chain.
-            
-        Returns:
-            dict: A new block object.
-        """
-        block = {
-            'index': len(self.blockchain) + 1,
-            'timestamp': str(datetime.now()),
-            'data': data,
-            'previous_hash': previous_hash,
-            'hash': None # The hash will be calculated next
-        }
-        
-        # Calculate the hash for this new block
-        block['hash'] = self.calculate_block_hash(block)
-        return block
-
-    def get_last_block(self):
-        """
-        Returns the last block in the chain.
-        """
-        return self.blockchain[-1]
-
-    def calculate_block_hash(self, block):
-        """
-        Calculates the SHA-256 hash of a given block.
-        
-        Args:
-            block (dict): The block to hash.
-            
-        Returns:
-            str: The calculated hash.
-        """
-        # We must make sure that the Dictionary is Ordered,
-        # or we'll have inconsistent hashes
-        
-        # Create a copy to avoid modifying the original block
-        block_to_hash = block.copy()
-        # Set hash to None for calculation, just like in new_block
-        block_to_hash['hash'] = None 
-        
-        block_string = json.dumps(block_to_hash, sort_keys=True).encode()
-        return hash_data(block_string.decode()) # Use our hasher utility
-
-    def create_genesis_block(self):
-        """
-        Creates the first block in the chain (Genesis Block).
-        """
-        genesis_block = self.new_block(
-            data="Genesis Block",
-            previous_hash="0"
-        )
-        self.blockchain = [genesis_block]
-        self.save_chain()
-
-    def add_block(self, new_data_hash):
-        """
-        Adds a new block to the chain.
-        """
-        # --- Duplicate Check (from report's pending tasks) ---
-        if self.verify_identity(new_data_hash):
-            print("\nError: This identity is already registered.")
-            return
-        
-        try:
-            # Get the previous block and its hash
-            last_block = self.get_last_block()
-            previous_hash = last_block['hash']
-            
-            # Create the new block
-            new_block = self.new_block(new_data_hash, previous_hash)
-            
-            # Add it to the chain and save
-            self.blockchain.append(new_block)
-            self.save_chain()
-            
-            print(f"\nSuccess: Block #{new_block['index']} (Identity: {new_data_hash[:10]}...) added to the chain.")
-            
-        except Exception as e:
-            print(f"\nError adding block: {e}")
-
-    def is_chain_valid(self):
-        """
-        Checks the integrity of the entire blockchain.
-        1. Checks if each block's stored hash matches its calculated hash.
-        2. Checks if each block's 'previous_hash' matches the hash
-           of the actual previous block.
-           
-        Returns:
-            bool: True if valid, False otherwise.
-        """
-        for i in range(1, len(self.blockchain)):
-            current_block = self.blockchain[i]
-            previous_block = self.blockchain[i-1]
-
-            # 1. Check if the block's hash is correct
-            # We re-calculate the hash from the block's content
-            recalculated_hash = self.calculate_block_hash(current_block)
-
-            if current_block['hash'] != recalculated_hash:
-                print(f"\nIntegrity FAILED: Block #{current_block['index']} hash is invalid.")
-                print(f"Stored:   {current_block['hash']}")
-                print(f"Recalc'd: {recalculated_hash}")
-                return False
-
-            # 2. Check if the previous_hash link is correct
-            if current_block['previous_hash'] != previous_block['hash']:
-                print(f"\nIntegrity FAILED: Block #{current_block['index']} 'previous_hash' does not match Block #{previous_block['index']} 'hash'.")
-                return False
-
-        print("\nBlockchain Integrity Check: PASS")
-        print("All blocks are valid and chain is secure.")
-        return True
-
-    def verify_identity(self, identity_hash):
-        """
-        Checks if a given hash already exists in the blockchain.
-        --- COMPLETES PENDING TASK: Duplicate Entry Prevention ---
-        
-        Args:
-            identity_hash (str): The hash to check for.
-            
-        Returns:
-            bool: True if hash exists, False otherwise.
-        """
-        # Start from 1 to skip the Genesis Block
-        # --- FIX was here: Use self.blockchain, not self.chain ---
-        for block in self.blockchain[1:]:
-            if block['data'] == identity_hash:
-                return True
-        return False
-
-    def print_chain(self):
-        """
-        Helper function to print the entire blockchain to the console.
-        """
-        if not self.blockchain:
-            print("The blockchain is empty.")
-            return
-            
-        for block in self.blockchain:
-            print(f"\nBlock {block['index']} " + "-"*30)
-            print(f"  Timestamp:     {block['timestamp']}")
-            print(f"  Data:          {block['data']}")
-            print(f"  Previous Hash: {block['previous_hash']}")
-            print(f"  Hash:          {block['hash']}")
-            print("-"*38)
-            
-    # --- Persistence Functions ---
-
-    def save_chain(self):
-        """
-        Saves the entire blockchain to the JSON file.
-        """
-        try:
-            with open(self.storage_file, 'w') as f:
-                json.dump(self.blockchain, f, indent=4)
-        except Exception as e:
-            print(f"\nCRITICAL: Failed to save blockchain to {self.storage_file}: {e}")
-
-    def load_chain(self):
-        """
-        Loads the blockchain from the JSON file.
-        If no file exists, it creates a new chain with a Genesis Block.
-        """
-        try:
-            with open(self.storage_file, 'r') as f:
-                self.blockchain = json.load(f)
-                if not self.blockchain:
-                    print("Blockchain file is empty. Creating Genesis Block.")
-                    self.create_genesis_block()
-                else:
-                    print(f"Blockchain with {len(self.blockchain)} blocks loaded from {self.storage_file}.")
-        except FileNotFoundError:
-            print(f"No file found at {self.storage_file}. Creating new blockchain with Genesis Block.")
-            self.create_genesis_block()
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON from {self.storage_file}. File might be corrupt.")
-            print("Creating new blockchain with Genesis Block.")
-            self.create_genesis_block()
-        except Exception as e:
-            print(f"An unexpected error occurred during loading: {e}")
-            self.create_genesis_block()
-
+import atexit
+import functools
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from hasher import hash_bytes # Import our hash utility
+from storage import read_legacy_json
+from segments import SegmentedChain, SegmentedStorage, SegmentError
+from merkle import merkle_root, merkle_proof
+from bloom import BloomFilter
+from snapshot import SnapshotChain, SnapshotIndex, open_snapshot, write_snapshot
+import metrics
+
+"""
+File: blockchain.py
+Description: Defines the Block and Blockchain classes. This is the core
+engine of the identity system. It handles block creation, validation,
+and persistent storage.
+
+Status messages go through the 'blockchain' logger instead of print(),
+so callers decide what to show (main.py prints from return values).
+"""
+
+logger = logging.getLogger(__name__)
+
+# Changes listed one by one in a repair report
+MAX_REPORTED_CHANGES = 100
+
+def is_plain_int(value):
+    """
+    Checks for an int that isn't a bool (True is an int in Python).
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+class Block:
+    """
+    One block of the chain. Uses __slots__ instead of a per-block dict,
+    which keeps resident blocks small, and caches the bytes its hash is
+    computed from. Old code can keep using block['field'] access.
+
+    Hashing format versions:
+        1: json.dumps of the block (with 'hash' set to None), sorted keys.
+           Used by every block written before version 2 existed, so
+           existing chains still verify.
+        2: Compact canonical bytes: a "IDV2" tag, the index as 8 bytes,
+           then timestamp, data and previous_hash, each UTF-8 encoded and
+           prefixed with its length (4 bytes, big-endian).
+    """
+
+    __slots__ = ('index', 'timestamp', 'data', 'previous_hash', 'hash',
+                 'identities', 'version', 'cached_hashing_bytes')
+
+    # Fields that go into the hash (changing them drops the cached bytes)
+    HASHED_FIELDS = ('index', 'timestamp', 'data', 'previous_hash', 'version')
+    CURRENT_VERSION = 2
+
+    def __init__(self, index, timestamp, data, previous_hash, hash=None,
+                 identities=None, version=CURRENT_VERSION):
+        self.index = index
+        self.timestamp = timestamp
+        self.data = data
+        self.previous_hash = previous_hash
+        self.hash = hash
+        self.identities = identities
+        self.version = version
+        self.cached_hashing_bytes = None
+
+    @classmethod
+    def from_dict(cls, block):
+        """
+        Builds a Block from its stored dict form. Blocks stored
+        without a 'version' key are version 1.
+        """
+        return cls(block['index'], block['timestamp'], block['data'],
+                   block['previous_hash'], block.get('hash'),
+                   block.get('identities'), block.get('version', 1))
+
+    def to_dict(self):
+        """
+        Returns the dict form used for storage and JSON responses.
+        Version 1 blocks keep exactly the keys they were stored with.
+        """
+        block = {
+            'index': self.index,
+            'timestamp': self.timestamp,
+            'data': self.data,
+            'previous_hash': self.previous_hash,
+            'hash': self.hash
+        }
+        if self.identities is not None:
+            block['identities'] = self.identities
+        if self.version != 1:
+            block['version'] = self.version
+        return block
+
+    def hashing_bytes(self):
+        """
+        Returns the canonical bytes this block's hash is computed from.
+        The result is cached until a hashed field is changed.
+        """
+        if self.cached_hashing_bytes is None:
+            # Like snapshot.encode_block, no type coercion: an index of
+            # "7" or True must not hash like 7, or a field's type could
+            # be changed without changing the hash
+            if not is_plain_int(self.version):
+                raise ValueError(f"Block version must be an integer, not {self.version!r}")
+            if self.version == 1:
+                # We must make sure that the Dictionary is Ordered,
+                # or we'll have inconsistent hashes. The identity list of
+                # a Merkle block is covered by its root in 'data'.
+                block_to_hash = {
+                    'index': self.index,
+                    'timestamp': self.timestamp,
+                    'data': self.data,
+                    'previous_hash': self.previous_hash,
+                    'hash': None
+                }
+                self.cached_hashing_bytes = json.dumps(block_to_hash, sort_keys=True).encode()
+            elif self.version == 2:
+                if not is_plain_int(self.index):
+                    raise ValueError(f"Block index must be an integer, not {self.index!r}")
+                parts = [b"IDV2", self.index.to_bytes(8, 'big')]
+                for field in (self.timestamp, self.data, self.previous_hash):
+                    if not isinstance(field, str):
+                        raise ValueError(f"Block field must be a string, not {field!r}")
+                    encoded = field.encode('utf-8')
+                    parts.append(len(encoded).to_bytes(4, 'big'))
+                    parts.append(encoded)
+                self.cached_hashing_bytes = b"".join(parts)
+            else:
+                raise ValueError(f"Unknown block version: {self.version}")
+        return self.cached_hashing_bytes
+
+    # --- dict-style access, so block['hash'] keeps working ---
+
+    def __getitem__(self, key):
+        if key not in self.__slots__ or key == 'cached_hashing_bytes':
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__ or key == 'cached_hashing_bytes':
+            raise KeyError(key)
+        setattr(self, key, value)
+        if key in self.HASHED_FIELDS:
+            self.cached_hashing_bytes = None
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def __repr__(self):
+        return f"Block({self.to_dict()!r})"
+
+def calculate_hash(block):
+    """
+    Calculates the SHA-256 hash of a given block. This is a plain function
+    (Blockchain.calculate_block_hash calls it) so that audit worker
+    processes can use it without a Blockchain object.
+
+    Args:
+        block (Block or dict): The block to hash.
+
+    Returns:
+        str: The calculated hash, or None if the block can't be encoded
+             (e.g. a tampered field of the wrong type).
+    """
+    if isinstance(block, dict):
+        block = Block.from_dict(block)
+    try:
+        return hash_bytes(block.hashing_bytes())
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def identities_root(block):
+    """
+    Calculates the Merkle root of a block's identity list. A plain
+    function, like calculate_hash, so audit workers can use it.
+
+    Returns:
+        str: The root, or None if the list can't be hashed (e.g. a
+             tampered entry of the wrong type).
+    """
+    try:
+        return merkle_root(block['identities'])
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+def identities_match(block):
+    """
+    Returns True if a block has no identity list, or the Merkle root of
+    its list is its data.
+    """
+    if 'identities' not in block:
+        return True
+    root = identities_root(block)
+    return root is not None and root == block['data']
+
+def with_write_lock(method):
+    """
+    Decorator for Blockchain methods that change the chain.
+    Only one thread (and one process sharing the same storage)
+    at a time may run any of them.
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        # Thread lock first, then the storage lock shared with other processes
+        with self.write_lock, self.storage.locked():
+            return method(self, *args, **kwargs)
+    return locked
+
+class Blockchain:
+    """
+    Manages the chain of blocks, including adding new blocks
+    and validating the integrity of the chain.
+    """
+    
+    def __init__(self, storage=None, bloom_error_rate=0.001, snapshot_interval=10000):
+        """
+        Constructor for the Blockchain.
+
+        Args:
+            storage (ChainStorage): Where the chain is persisted.
+                Defaults to the append-only log in 'blockchain.jsonl',
+                with older blocks sealed into compressed segments.
+            bloom_error_rate (float): False-positive rate of the
+                identity Bloom filter.
+            snapshot_interval (int): A new snapshot is written once this
+                many blocks were added since the last one.
+        """
+        # --- This is the main list that holds all the blocks ---
+        # The error was caused by using "self.chain" instead of "self.blockchain"
+        self.blockchain = []
+        self.storage = storage or SegmentedStorage("blockchain.jsonl")
+        self.storage_file = self.storage.path
+        # Chains saved by older versions live in this single JSON document
+        # next to the storage file. It is imported into the storage backend
+        # the first time we start.
+        self.legacy_file = os.path.join(os.path.dirname(self.storage_file), "blockchain.json")
+
+        # --- Identity Index ---
+        # Maps each identity hash (block['data']) to the position of the
+        # block that owns it in self.blockchain. This turns duplicate
+        # checks and verification into a constant-time dictionary lookup
+        # instead of a scan over the whole chain.
+        self.identity_index = {}
+
+        # --- Identity Bloom Filter ---
+        # Sits in front of the index: most lookups are for identities that
+        # are not registered, and the filter rules those out from a small
+        # memory-mapped bit array. It is stored next to the chain file and
+        # rebuilt from the chain whenever it can't be trusted.
+        self.bloom_file = os.path.splitext(self.storage_file)[0] + ".bloom"
+        self.bloom_error_rate = bloom_error_rate
+        self.bloom = None
+
+        # --- Startup Snapshot ---
+        # A binary copy of the chain and its index that is memory-mapped
+        # on startup, so only blocks appended since it was written have to
+        # be read from the log (see snapshot.py). snapshot_blocks is the
+        # number of blocks the newest snapshot we know of covers.
+        self.snapshot_file = os.path.splitext(self.storage_file)[0] + ".snapshot"
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_blocks = 0
+
+        # --- Sealed Segments ---
+        # Blocks that storage has sealed into segment files are not kept
+        # in memory; the chain list becomes a SegmentedChain that reads
+        # them back when needed. This is the sealed block count our chain
+        # list was built for.
+        self.sealed_seen = 0
+
+        # --- Validation Watermark ---
+        # verified_upto is the number of blocks at the start of the chain
+        # that have already been checked, and verified_digest is the hash
+        # of the last of them. Because every block links to the hash of the
+        # one before it, that single hash stands for the whole verified
+        # prefix. Normal checks only need to look at blocks appended since.
+        self.verified_upto = 1
+        self.verified_digest = None
+        self.tampered_index = -1
+        # (mtime, size) of the storage file as we last read or wrote it.
+        # If it changes behind our back, the file was edited externally.
+        self.storage_signature = None
+
+        # --- Concurrency ---
+        # Writers (appends, saves, reloads) take write_lock, so only one
+        # of them changes the chain at a time. Readers take no lock: the
+        # block list is only ever appended to or swapped for a new list,
+        # so a reader that takes a snapshot() sees a consistent prefix.
+        self.write_lock = threading.RLock()
+        self.validation_lock = threading.Lock()
+        
+        # --- COMPLETES PENDING TASK: Persistent Storage ---
+        # Try to load the chain from the file on startup.
+        # If no file exists, create the Genesis Block.
+        self.load_chain()
+        # Leave a fresh snapshot behind for the next start if enough
+        # blocks were added while we ran
+        atexit.register(self.save_snapshot_if_due)
+
+    def new_block(self, data, previous_hash):
+        """
+        Creates a new block to be added to the chain.
+        
+        Args:
+            data (str): The data to be stored (e.g., hashed Aadhaar).
+            previous_hash (str): The hash of the previous block in the chain.
+            
+        Returns:
+            Block: A new block object.
+        """
+        block = Block(
+            index=len(self.blockchain) + 1,
+            timestamp=str(datetime.now()),
+            data=data,
+            previous_hash=previous_hash,
+            hash=None # The hash will be calculated next
+        )
+        
+        # Calculate the hash for this new block
+        block.hash = self.calculate_block_hash(block)
+        return block
+
+    def new_merkle_block(self, identity_hashes, previous_hash):
+        """
+        Creates a block that holds many identity hashes at once.
+        The block's 'data' is the Merkle root of the identities, so the
+        block hash commits to all of them, and each identity can later be
+        proven with a short inclusion proof.
+
+        Args:
+            identity_hashes (list): The identity hashes to store.
+            previous_hash (str): The hash of the previous block in the chain.
+
+        Returns:
+            Block: A new block object with an 'identities' list.
+        """
+        block = Block(
+            index=len(self.blockchain) + 1,
+            timestamp=str(datetime.now()),
+            data=merkle_root(identity_hashes),
+            previous_hash=previous_hash,
+            hash=None,
+            identities=list(identity_hashes)
+        )
+        block.hash = self.calculate_block_hash(block)
+        return block
+
+    def get_last_block(self):
+        """
+        Returns the last block in the chain.
+        """
+        return self.blockchain[-1]
+
+    def calculate_block_hash(self, block):
+        """
+        Calculates the SHA-256 hash of a given block.
+        
+        Args:
+            block (dict): The block to hash.
+            
+        Returns:
+            str: The calculated hash.
+        """
+        return calculate_hash(block)
+
+    @with_write_lock
+    def create_genesis_block(self):
+        """
+        Creates the first block in the chain (Genesis Block).
+        """
+        genesis_block = self.new_block(
+            data="Genesis Block",
+            previous_hash="0"
+        )
+        self.blockchain = [genesis_block]
+        self.identity_index = {}
+        self.snapshot_blocks = 0
+        self.sealed_seen = 0
+        self.save_chain()
+        self.rebuild_bloom()
+
+    @metrics.timed(metrics.CHAIN_APPEND_SECONDS, kind="single")
+    @with_write_lock
+    def add_block(self, new_data_hash):
+        """
+        Adds a new block to the chain.
+
+        Returns:
+            dict: The new block, or None if it was not added.
+        """
+        # Another process may have appended since we last looked
+        self.sync_from_storage()
+
+        # --- Duplicate Check (from report's pending tasks) ---
+        if self.verify_identity(new_data_hash):
+            logger.info("Identity %s... is already registered.", new_data_hash[:10])
+            metrics.DUPLICATES_REJECTED.inc()
+            return None
+        
+        try:
+            # Get the previous block and its hash
+            last_block = self.get_last_block()
+            previous_hash = last_block['hash']
+            
+            # Create the new block
+            new_block = self.new_block(new_data_hash, previous_hash)
+            
+            # Add it to the chain, index it and append it to storage
+            self.blockchain.append(new_block)
+            self.index_block(new_block, len(self.blockchain) - 1)
+            self.append_to_storage([new_block])
+            self.update_bloom_coverage()
+            
+            metrics.BLOCKS_APPENDED.inc()
+            logger.info("Block #%s (Identity: %s...) added to the chain.", new_block['index'], new_data_hash[:10])
+            return new_block
+            
+        except Exception as e:
+            logger.error("Error adding block: %s", e)
+            return None
+
+    @metrics.timed(metrics.CHAIN_APPEND_SECONDS, kind="batch")
+    @with_write_lock
+    def add_blocks(self, data_hashes, merkle=False):
+        """
+        Adds many identities to the chain in one go.
+        Duplicates (already on the chain, or repeated within the batch)
+        are skipped, and all new blocks are written to storage together.
+
+        Args:
+            data_hashes (list): The identity hashes to add.
+            merkle (bool): Put all new identities into a single Merkle
+                block instead of one block per identity.
+
+        Returns:
+            list: One result dict per input hash, in the same order, with
+                  'hash', 'status' ('added' or 'duplicate') and, for added
+                  hashes, the 'index' of the new block.
+
+        Raises:
+            OSError: If the new blocks couldn't be stored. None of them
+                     were added.
+        """
+        # Another process may have appended since we last looked
+        self.sync_from_storage()
+
+        results = []
+        new_blocks = []
+        seen = set()
+
+        for data_hash in data_hashes:
+            if data_hash in seen or self.verify_identity(data_hash):
+                results.append({"hash": data_hash, "status": "duplicate"})
+                metrics.DUPLICATES_REJECTED.inc()
+                continue
+            seen.add(data_hash)
+
+            if merkle:
+                # The block index is filled in once the Merkle block exists
+                results.append({"hash": data_hash, "status": "added"})
+                continue
+
+            new_block = self.new_block(data_hash, self.get_last_block()['hash'])
+            self.blockchain.append(new_block)
+            self.index_block(new_block, len(self.blockchain) - 1)
+            new_blocks.append(new_block)
+            results.append({"hash": data_hash, "status": "added", "index": new_block['index']})
+
+        if merkle and seen:
+            identities = [r['hash'] for r in results if r['status'] == 'added']
+            new_block = self.new_merkle_block(identities, self.get_last_block()['hash'])
+            self.blockchain.append(new_block)
+            self.index_block(new_block, len(self.blockchain) - 1)
+            new_blocks.append(new_block)
+            for result in results:
+                if result['status'] == 'added':
+                    result['index'] = new_block['index']
+
+        # One storage write for the whole batch
+        self.append_to_storage(new_blocks)
+        self.update_bloom_coverage()
+        if new_blocks:
+            metrics.BLOCKS_APPENDED.inc(len(new_blocks))
+            logger.info("%d blocks added to the chain (#%s to #%s).",
+                        len(new_blocks), new_blocks[0]['index'], new_blocks[-1]['index'])
+        return results
+
+    @metrics.timed(metrics.CHAIN_APPEND_SECONDS, kind="replicated")
+    def import_blocks(self, blocks, start=None):
+        """
+        Adds blocks received from another node (see replication.py).
+        Unlike add_block, the blocks keep their own index, timestamp and
+        hash. Each one is checked on its own (hash, Merkle root and link
+        to the block before it), so the rest of the chain doesn't have to
+        be validated again: if it was verified before, the watermark just
+        moves past the new blocks.
+
+        Args:
+            blocks (list): Block dicts, in chain order.
+            start (int): Chain position of the first block. Defaults to
+                the end of the chain. If it is earlier, our blocks from
+                there on are replaced (the peer's chain wins, e.g. after
+                it was repaired).
+
+        Returns:
+            int: The number of blocks added.
+
+        Raises:
+            ValueError: If the blocks don't fit the chain at that position.
+            OSError: If they couldn't be stored. None of them were added.
+        """
+        # Same lock order as repair_chain: validation, then writers
+        with self.validation_lock, self.write_lock, self.storage.locked():
+            # Another process may have appended since we last looked
+            self.sync_from_storage()
+            chain = self.blockchain
+            length = len(chain)
+            start = length if start is None else start
+            if not 0 <= start <= length:
+                raise ValueError(f"Can't add blocks at position {start} of a chain of {length} blocks.")
+
+            new_blocks = []
+            previous_hash = chain[start - 1]['hash'] if start > 0 else "0"
+            for position, block in enumerate(blocks, start):
+                try:
+                    block = Block.from_dict(block)
+                    sound = self.block_is_sound(block, previous_hash, position)
+                except (KeyError, TypeError, AttributeError):
+                    sound = False
+                if not sound:
+                    raise ValueError(f"Block #{position + 1} does not fit the chain.")
+                new_blocks.append(block)
+                previous_hash = block['hash']
+            if not new_blocks:
+                return 0
+
+            # Everything before the new blocks was verified already
+            verified = self.tampered_index == -1 and self.verified_upto >= start
+            if start == length:
+                for block in new_blocks:
+                    chain.append(block)
+                    self.index_block(block, len(chain) - 1)
+                self.append_to_storage(new_blocks)
+                self.update_bloom_coverage()
+            else:
+                logger.warning("Replacing blocks #%d to #%d with the peer's chain.", start + 1, length)
+                self.storage.replace_suffix(length - start, new_blocks)
+                self.load_chain()
+
+            if verified:
+                self.verified_upto = len(self.blockchain)
+                self.verified_digest = new_blocks[-1]['hash']
+                self.tampered_index = -1
+            metrics.BLOCKS_REPLICATED.inc(len(new_blocks))
+            logger.info("%d blocks imported (#%s to #%s).",
+                        len(new_blocks), new_blocks[0]['index'], new_blocks[-1]['index'])
+            return len(new_blocks)
+
+    def is_chain_valid(self, full=False):
+        """
+        Checks the integrity of the blockchain.
+        1. Checks if each block's stored hash matches its calculated hash.
+        2. Checks if each block's 'previous_hash' matches the hash
+           of the actual previous block.
+
+        Only blocks appended since the last successful check are
+        re-hashed. The whole chain is re-verified when an operator asks
+        for it, when the storage file was changed outside of this process
+        (it is reloaded first), or when the verified prefix no longer
+        matches its recorded digest.
+
+        Args:
+            full (bool): Force a re-verification of the entire chain.
+
+        Returns:
+            int: -1 if the chain is valid, otherwise the index of the
+                 first tampered block.
+        """
+        # Fast path without locking: nothing appended or changed since
+        # the last successful check.
+        if not full and self.is_up_to_date():
+            return -1
+
+        # Only one thread validates at a time (the watermark is shared)
+        with self.validation_lock, metrics.CHAIN_VALIDATION_SECONDS.time(mode="full" if full else "incremental"):
+            try:
+                result = self.validate_chain(full)
+            except SegmentError as e:
+                result = self.segment_failed(e)
+        if result != -1:
+            metrics.TAMPER_DETECTIONS.inc()
+        return result
+
+    def is_up_to_date(self):
+        """
+        Returns True if the chain was fully verified and storage hasn't
+        changed since it was read (one stat() call, no locking).
+        """
+        return (self.tampered_index == -1
+                and self.verified_upto == len(self.blockchain)
+                and self.storage_signature == self.read_storage_signature())
+
+    def validate_chain(self, full):
+        """
+        Does the actual work for is_chain_valid. Callers must hold
+        validation_lock.
+        """
+        # Pick up blocks appended by other processes. If the storage was
+        # edited rather than appended to, our copy had to be reloaded.
+        if self.sync_from_storage() == 'reloaded':
+            logger.warning("%s changed on disk. Re-verifying the full chain.", self.storage_file)
+            full = True
+
+        # The verified prefix must still end in the block we recorded.
+        if not full and self.verified_upto > 1:
+            if (self.verified_upto > len(self.blockchain)
+                    or self.blockchain[self.verified_upto - 1]['hash'] != self.verified_digest):
+                full = True
+
+        if full:
+            if isinstance(self.blockchain, SnapshotChain):
+                # A full check must cover the log itself, not our snapshot
+                self.load_chain(use_snapshot=False)
+            self.reset_validation()
+
+        for i in range(self.verified_upto, len(self.blockchain)):
+            current_block = self.blockchain[i]
+            previous_block = self.blockchain[i-1]
+
+            # 0. Check that the block sits where its index says. Results
+            # are positions + 1, never the (maybe tampered) index field.
+            if current_block['index'] != i + 1:
+                logger.warning("Integrity FAILED: Block #%d has index %r.", i + 1, current_block['index'])
+                self.tampered_index = i + 1
+                return self.tampered_index
+
+            # 1. Check if the block's hash is correct
+            # We re-calculate the hash from the block's content
+            recalculated_hash = self.calculate_block_hash(current_block)
+
+            if current_block['hash'] != recalculated_hash:
+                logger.warning("Integrity FAILED: Block #%d hash is invalid (stored %s, recalculated %s).",
+                               i + 1, current_block['hash'], recalculated_hash)
+                self.tampered_index = i + 1
+                return self.tampered_index
+
+            # 1b. A Merkle block's root must match its identity list
+            if not identities_match(current_block):
+                logger.warning("Integrity FAILED: Block #%d identities do not match its Merkle root.", i + 1)
+                self.tampered_index = i + 1
+                return self.tampered_index
+
+            # 2. Check if the previous_hash link is correct
+            if current_block['previous_hash'] != previous_block['hash']:
+                logger.warning("Integrity FAILED: Block #%d 'previous_hash' does not match Block #%d 'hash'.",
+                               i + 1, i)
+                self.tampered_index = i + 1
+                return self.tampered_index
+
+            # Move the watermark past this block
+            self.verified_upto = i + 1
+            self.verified_digest = current_block['hash']
+
+        self.tampered_index = -1
+        if full:
+            logger.info("Blockchain Integrity Check: PASS. All blocks are valid and chain is secure.")
+        return -1
+
+    def sync_from_storage(self):
+        """
+        Brings the in-memory chain up to date with storage, for when other
+        processes (e.g. other server workers) share the same chain file.
+        Blocks appended since our last read are loaded incrementally; they
+        get hashed by the next is_chain_valid like any new block. If the
+        file was rewritten or edited instead, the whole chain is reloaded.
+
+        Returns:
+            str: 'unchanged', 'appended' or 'reloaded'.
+        """
+        # Cheap check without any locking: has the file changed at all?
+        if self.storage_signature == self.read_storage_signature():
+            return 'unchanged'
+
+        with self.write_lock, self.storage.locked():
+            signature = self.read_storage_signature()
+            if signature == self.storage_signature:
+                return 'unchanged'
+
+            # Only a pure append by another writer can be read incrementally.
+            # A different file (rewrite), a shorter file or a file whose
+            # content moved under our read position means a full reload.
+            appended = (signature is not None and self.storage_signature is not None
+                        and signature[0] == self.storage_signature[0]
+                        and self.storage.tail_is_aligned())
+            new_blocks = [Block.from_dict(block) for block in self.storage.iter_new_blocks()] if appended else []
+            if not new_blocks or new_blocks[0]['previous_hash'] != self.get_last_block()['hash']:
+                self.load_chain()
+                return 'reloaded'
+
+            for block in new_blocks:
+                self.blockchain.append(block)
+                self.index_block(block, len(self.blockchain) - 1)
+            self.storage_signature = signature
+            self.update_bloom_coverage()
+            self.release_sealed_blocks()
+            return 'appended'
+
+    def snapshot(self):
+        """
+        Returns a read-only view of the chain without taking any lock.
+
+        Returns:
+            tuple: (list of blocks, number of blocks). Readers should only
+                   look at the first `length` blocks of the list.
+        """
+        chain = self.blockchain
+        return chain, len(chain)
+
+    def audit_chain(self, workers=None, progress=None):
+        """
+        Full integrity audit that spreads the re-hashing over several CPU
+        cores (see audit.py). Gives the same answer as
+        is_chain_valid(full=True), and updates the validation watermark.
+
+        Args:
+            workers (int): Number of worker processes (default: CPU count).
+            progress (callable): Called as progress(blocks_checked, total).
+
+        Returns:
+            int: -1 if the chain is valid, otherwise the index of the
+                 first tampered block.
+        """
+        # Imported here because audit.py itself imports this module
+        from audit import parallel_audit
+
+        with self.validation_lock, metrics.CHAIN_VALIDATION_SECONDS.time(mode="audit"):
+            if self.sync_from_storage() == 'reloaded':
+                logger.warning("%s changed on disk. Auditing the reloaded chain.", self.storage_file)
+            if isinstance(self.blockchain, SnapshotChain):
+                # Audit the blocks in the log itself, not our snapshot
+                self.load_chain(use_snapshot=False)
+            chain, length = self.snapshot()
+            try:
+                result = parallel_audit(chain, workers=workers, progress=progress, length=length)
+            except SegmentError as e:
+                metrics.TAMPER_DETECTIONS.inc()
+                return self.segment_failed(e)
+
+            self.reset_validation()
+            if result == -1:
+                self.verified_upto = length
+                self.verified_digest = chain[length - 1]['hash']
+                logger.info("Blockchain Integrity Check: PASS. All blocks are valid and chain is secure.")
+            else:
+                # Everything before the tampered block checked out
+                self.verified_upto = result - 1
+                self.verified_digest = chain[result - 2]['hash']
+                self.tampered_index = result
+                metrics.TAMPER_DETECTIONS.inc()
+                logger.warning("Integrity FAILED: Block #%s is invalid.", result)
+            return result
+
+    def repair_chain(self):
+        """
+        Repairs the chain after tampering, starting at the first bad block.
+
+        From there on every block is checked against the one before it.
+        A block that doesn't fit is restored from the snapshot file if the
+        snapshot holds a verified copy that does; otherwise it is re-linked
+        to the block before it and re-hashed, keeping its current contents
+        (which changes the hash of every later block too). Only the part of
+        the chain from the first changed block onward is written back to
+        storage, so a repair costs time in proportion to the damaged
+        suffix, not the length of the chain.
+
+        Returns:
+            dict: Report of the repair: status ('intact', 'repaired' or
+                  'failed'), the first tampered block, how many blocks were
+                  restored, re-linked and rewritten, and the changes made
+                  (at most MAX_REPORTED_CHANGES of them).
+        """
+        # Same lock order as is_chain_valid: validation, then writers
+        with self.validation_lock, metrics.CHAIN_STORAGE_SECONDS.time(operation="repair"):
+            with self.write_lock, self.storage.locked():
+                return self.repair_suffix()
+
+    def repair_suffix(self):
+        """
+        Does the actual work for repair_chain. Callers hold the
+        validation lock and the write lock.
+        """
+        try:
+            result = self.validate_chain(False)
+        except SegmentError as e:
+            result = self.segment_failed(e)
+        chain, length = self.snapshot()
+        report = {
+            "status": "intact",
+            "tampered_index": None,
+            "repaired_from": None,
+            "restored_blocks": 0,
+            "relinked_blocks": 0,
+            "rewritten_blocks": 0,
+            "chain_length": length,
+            "changes": []
+        }
+        if result == -1:
+            return report
+        report["tampered_index"] = result
+
+        # Blocks of segments that failed their checksum, read unchecked
+        unverified = {}
+        # Every block before the watermark passed validation
+        start = max(1, min(self.verified_upto, length - 1))
+        snapshot = open_snapshot(self.snapshot_file)
+        trusted = 0
+        if snapshot is not None:
+            anchor = self.find_snapshot_anchor(snapshot, start, unverified)
+            if anchor is None:
+                snapshot = None
+            else:
+                start = anchor
+                trusted = min(snapshot.verified_upto, snapshot.block_count)
+
+        # The block before 'start' is only a safe anchor if its segment
+        # passed its checksum. Otherwise repair from the first block of
+        # that segment; the Genesis Block is checked against "0".
+        while start > 0 and not self.read_block_for_repair(start - 1, unverified)[1]:
+            start -= 1
+        previous_hash = self.read_block_for_repair(start - 1, unverified)[0]['hash'] if start > 0 else "0"
+        replaced = []
+        first_changed = None
+        # Blocks missing at the end (e.g. after a deleted line) come back
+        # from the snapshot too
+        for position in range(start, max(length, trusted)):
+            if position < length:
+                current, readable = self.read_block_for_repair(position, unverified)
+            else:
+                current, readable = None, True
+            block, action = current, None
+            if snapshot is not None and position < trusted:
+                candidate = snapshot.read_block(position, Block)
+                if not self.block_is_sound(candidate, previous_hash, position):
+                    candidate = None
+                if candidate is not None and (current is None or candidate.to_dict() != current.to_dict()):
+                    block, action = candidate, "restored"
+            if action is None:
+                if position >= length:
+                    break
+                if current is None:
+                    report["status"] = "failed"
+                    report["message"] = f"Block #{position + 1} can't be read and the snapshot has no copy of it."
+                    logger.error("Repair failed: %s", report["message"])
+                    return report
+                if not self.block_is_sound(current, previous_hash, position):
+                    block, action = self.relink_block(current, previous_hash, position), "relinked"
+                    if block.hash is None:
+                        report["status"] = "failed"
+                        report["message"] = f"Block #{position + 1} can't be re-hashed."
+                        logger.error("Repair failed: %s", report["message"])
+                        return report
+                elif not readable:
+                    # Intact, but its segment file is damaged
+                    action = "rewritten"
+
+            if action is not None:
+                if first_changed is None:
+                    first_changed = position
+                if len(report["changes"]) < MAX_REPORTED_CHANGES:
+                    report["changes"].append({
+                        "index": position + 1,
+                        "action": action,
+                        "old_hash": current['hash'] if current is not None else None,
+                        "new_hash": block['hash']
+                    })
+                replaced.append((position, current, block, action))
+            previous_hash = block['hash']
+
+        if first_changed is None:
+            # Nothing to change (e.g. the damage was undone meanwhile)
+            self.reset_validation()
+            report["status"] = "intact" if self.validate_chain(True) == -1 else "failed"
+            return report
+
+        # Write back every block from the first changed one to the end
+        changed = {position: block for position, _, block, _ in replaced}
+        new_length = max(length, replaced[-1][0] + 1)
+        suffix = [changed.get(position) or chain[position] for position in range(first_changed, new_length)]
+        self.storage.replace_suffix(length - first_changed, suffix)
+        self.storage_signature = self.read_storage_signature()
+
+        # Update the chain in memory and move the identities
+        if isinstance(chain, SegmentedChain):
+            chain.release_sealed()
+        for position, old_block, _, _ in replaced:
+            if old_block is not None:
+                self.unindex_block(old_block, position)
+        for position, _, block, _ in replaced:
+            if position < length:
+                chain[position] = block
+            else:
+                chain.append(block)
+            self.index_block(block, position)
+        self.update_bloom_coverage()
+
+        for _, _, _, action in replaced:
+            if action == "restored":
+                report["restored_blocks"] += 1
+            elif action == "relinked":
+                report["relinked_blocks"] += 1
+        report["rewritten_blocks"] = len(suffix)
+        report["repaired_from"] = first_changed + 1
+        report["chain_length"] = len(chain)
+        metrics.BLOCKS_REPAIRED.inc(len(replaced))
+
+        # Only the repaired part needs checking again
+        self.verified_upto = max(start, 1)
+        self.verified_digest = chain[start - 1]['hash'] if start > 1 else None
+        self.tampered_index = -1
+        try:
+            result = self.validate_chain(False)
+        except SegmentError as e:
+            result = self.segment_failed(e)
+        report["status"] = "repaired" if result == -1 else "failed"
+        logger.warning("Repaired the chain from block #%d: %d blocks restored from %s, %d re-linked, "
+                       "%d rewritten in storage.", first_changed + 1, report["restored_blocks"],
+                       self.snapshot_file, report["relinked_blocks"], len(suffix))
+        return report
+
+    def find_snapshot_anchor(self, snapshot, start, unverified):
+        """
+        Checks that the snapshot belongs to this chain and finds where
+        repair has to start using it. Blocks before 'start' passed
+        validation, but a block whose contents and hash were both replaced
+        only breaks the link of the block after it; the snapshot shows
+        where such damage really began.
+
+        Returns:
+            int: The position to repair from, or None if the snapshot
+                 can't help (another chain, or older than the damage).
+        """
+        trusted = min(snapshot.verified_upto, snapshot.block_count)
+        position = start
+        if position - 1 >= trusted:
+            return None
+        while position > 0:
+            # Read like the blocks being repaired: a damaged segment
+            # mustn't stop the search
+            block = self.read_block_for_repair(position - 1, unverified)[0]
+            if block is not None and snapshot.read_fields(position - 1)[5] == block['hash']:
+                break
+            position -= 1
+        return position if position > 0 else None
+
+    def read_block_for_repair(self, position, unverified):
+        """
+        Returns (block, readable) for repair. Blocks of a segment that
+        failed its checksum are read without the check (readable=False),
+        or are None if they can't be decoded at all.
+        """
+        try:
+            return self.blockchain[position], True
+        except SegmentError as e:
+            segment = e.segment
+        if segment['file'] not in unverified:
+            try:
+                unverified[segment['file']] = [Block.from_dict(block) for block in
+                                               self.storage.read_segment(segment, verify=False)]
+            except (SegmentError, KeyError, TypeError):
+                unverified[segment['file']] = []
+        blocks = unverified[segment['file']]
+        offset = position - segment['start']
+        return (blocks[offset] if offset < len(blocks) else None), False
+
+    def block_is_sound(self, block, previous_hash, position):
+        """
+        Returns True if a block sits correctly at a chain position: right
+        index, linked to previous_hash, and hashes to its stored hash.
+        """
+        return (block['index'] == position + 1
+                and block['previous_hash'] == previous_hash
+                and self.calculate_block_hash(block) == block['hash']
+                and identities_match(block))
+
+    def relink_block(self, block, previous_hash, position):
+        """
+        Returns a copy of a block linked to previous_hash and re-hashed.
+        A Merkle block gets the root of its identity list as its data.
+        The copy's hash is None if it can't be hashed.
+        """
+        data = identities_root(block) if 'identities' in block else block['data']
+        relinked = Block(position + 1, block['timestamp'], data, previous_hash,
+                         None, block.identities, block.version)
+        if 'identities' not in block or data is not None:
+            relinked.hash = self.calculate_block_hash(relinked)
+        return relinked
+
+    def segment_failed(self, error):
+        """
+        Records a sealed segment that failed its checksum (or is missing)
+        as tampering, starting at the segment's first block.
+
+        Returns:
+            int: The index of the segment's first block.
+        """
+        # Positions start at 0, block indexes at 1
+        self.tampered_index = error.segment['start'] + 1
+        self.verified_upto = min(self.verified_upto, error.segment['start'])
+        logger.warning("Integrity FAILED: %s", error)
+        return self.tampered_index
+
+    def reset_validation(self):
+        """
+        Forgets the validation watermark so the next check
+        re-verifies the chain from the Genesis Block.
+        """
+        self.verified_upto = 1
+        self.verified_digest = None
+        self.tampered_index = -1
+
+    def read_storage_signature(self):
+        """
+        Returns a cheap fingerprint of the storage file: its
+        modification time and size, or None if it does not exist.
+        """
+        return self.storage.signature()
+
+    def verify_identity(self, identity_hash):
+        """
+        Checks if a given hash already exists in the blockchain.
+        --- COMPLETES PENDING TASK: Duplicate Entry Prevention ---
+        
+        Args:
+            identity_hash (str): The hash to check for.
+            
+        Returns:
+            bool: True if hash exists, False otherwise.
+        """
+        # A "no" from the Bloom filter is always right, and most
+        # lookups are for identities that were never registered.
+        bloom = self.bloom
+        if bloom is not None and identity_hash not in bloom:
+            return False
+        # Constant-time lookup in the identity index instead of
+        # scanning every block in the chain.
+        return identity_hash in self.identity_index
+
+    def find_identity(self, identity_hash):
+        """
+        Looks up the block that registered a given identity hash.
+        
+        Args:
+            identity_hash (str): The hash to look up.
+            
+        Returns:
+            dict: The owning block, or None if the hash is not registered.
+        """
+        # Read the chain first: a reload swaps in the new chain before
+        # the new index, so a position from this index is always valid.
+        chain = self.blockchain
+        position = self.identity_index.get(identity_hash)
+        if position is None or position >= len(chain):
+            return None
+        return chain[position]
+
+    def rebuild_index(self):
+        """
+        Rebuilds the identity index by walking the chain once.
+        Called after the chain is loaded from disk.
+        """
+        # Build the new index aside and swap it in at once, so
+        # concurrent readers never see a half-built index.
+        identity_index = {}
+        # Start from 1 to skip the Genesis Block
+        position = 0
+        while position + 1 < len(self.blockchain):
+            position += 1
+            try:
+                block = self.blockchain[position]
+            except SegmentError as e:
+                # Keep the rest of the chain; the bad segment is reported
+                # as tampering instead of failing the whole load
+                self.segment_failed(e)
+                position = e.segment['start'] + e.segment['count'] - 1
+                continue
+            if 'identities' in block:
+                for identity_hash in block['identities']:
+                    identity_index[identity_hash] = position
+            else:
+                identity_index[block['data']] = position
+        self.identity_index = identity_index
+        self.load_bloom()
+
+    def index_block(self, block, position):
+        """
+        Adds the identities of a newly appended block to the
+        identity index and the Bloom filter.
+        """
+        identities = block['identities'] if 'identities' in block else [block['data']]
+        for identity_hash in identities:
+            self.identity_index[identity_hash] = position
+            if self.bloom is not None:
+                self.bloom.add(identity_hash)
+
+    def unindex_block(self, block, position):
+        """
+        Removes the identities of a block that is being replaced from the
+        identity index. The Bloom filter can't forget them; it only gives
+        a few extra "maybe" answers until it is next rebuilt.
+        """
+        identities = block['identities'] if 'identities' in block else [block['data']]
+        for identity_hash in identities:
+            if self.identity_index.get(identity_hash) == position:
+                del self.identity_index[identity_hash]
+
+    def load_bloom(self):
+        """
+        Memory-maps the Bloom filter saved next to the chain. If it covers
+        only part of the chain, the missing blocks are added. If it can't
+        be trusted (missing, not closed cleanly, from a different chain, or
+        too small), it is rebuilt from the identity index.
+        """
+        bloom = BloomFilter.open(self.bloom_file)
+        chain = self.blockchain
+        usable = (bloom is not None and bloom.clean
+                  and 0 < bloom.covered_blocks <= len(chain)
+                  and chain[bloom.covered_blocks - 1]['hash'] == bloom.last_hash
+                  and bloom.capacity >= len(self.identity_index))
+        if not usable:
+            if bloom is not None:
+                bloom.close()
+            self.rebuild_bloom()
+            return
+
+        # Catch up with blocks appended after the filter was last saved
+        for position in range(bloom.covered_blocks, len(chain)):
+            block = chain[position]
+            for identity_hash in (block['identities'] if 'identities' in block else [block['data']]):
+                bloom.add(identity_hash)
+        self.swap_bloom(bloom)
+        self.update_bloom_coverage()
+
+    def rebuild_bloom(self):
+        """
+        Builds a fresh Bloom filter from the identity index, sized with
+        room to grow, and swaps it in.
+        """
+        capacity = max(100000, 2 * len(self.identity_index))
+        bloom = BloomFilter.create(self.bloom_file, capacity, self.bloom_error_rate)
+        for identity_hash in self.identity_index:
+            bloom.add(identity_hash)
+        self.swap_bloom(bloom)
+        self.update_bloom_coverage()
+
+    def swap_bloom(self, bloom):
+        """
+        Puts a new filter in place and closes the old one.
+        """
+        old_bloom, self.bloom = self.bloom, bloom
+        atexit.register(bloom.close)
+        if old_bloom is not None:
+            old_bloom.close()
+
+    def update_bloom_coverage(self):
+        """
+        Records in the filter's header how much of the chain it covers,
+        and grows the filter once it holds more than it was sized for.
+        """
+        if self.bloom is None:
+            return
+        if self.bloom.is_full():
+            self.rebuild_bloom()
+            return
+        chain = self.blockchain
+        self.bloom.mark_covered(len(chain), chain[-1]['hash'])
+
+    def get_inclusion_proof(self, identity_hash):
+        """
+        Builds a proof that an identity is registered on the chain.
+        For a Merkle block, the proof is the O(log n) list of sibling
+        hashes from the identity up to the block's Merkle root, which can
+        be checked with merkle.verify_proof() without the rest of the chain.
+        For a single-identity block, the identity is the block's data
+        itself, so the proof list is empty.
+
+        Args:
+            identity_hash (str): The identity hash to prove.
+
+        Returns:
+            dict: The proof and the header of the owning block,
+                  or None if the identity is not registered.
+        """
+        block = self.find_identity(identity_hash)
+        if block is None:
+            return None
+
+        proof = {
+            "identity_hash": identity_hash,
+            "block_index": block['index'],
+            "block_hash": block['hash'],
+            "previous_hash": block['previous_hash'],
+            "timestamp": block['timestamp'],
+            "merkle_root": None,
+            "proof": []
+        }
+        if 'identities' in block:
+            position = block['identities'].index(identity_hash)
+            proof["merkle_root"] = block['data']
+            proof["proof"] = merkle_proof(block['identities'], position)
+        return proof
+
+    def print_chain(self):
+        """
+        Helper function to print the entire blockchain to the console.
+        """
+        if not self.blockchain:
+            print("The blockchain is empty.")
+            return
+            
+        for block in self.blockchain:
+            print(f"\nBlock {block['index']} " + "-"*30)
+            print(f"  Timestamp:     {block['timestamp']}")
+            print(f"  Data:          {block['data']}")
+            print(f"  Previous Hash: {block['previous_hash']}")
+            print(f"  Hash:          {block['hash']}")
+            print("-"*38)
+            
+    # --- Persistence Functions ---
+
+    @metrics.timed(metrics.CHAIN_STORAGE_SECONDS, operation="rewrite")
+    @with_write_lock
+    def save_chain(self):
+        """
+        Rewrites the entire blockchain into storage (compaction).
+        Normal appends go through append_to_storage instead.
+        """
+        try:
+            self.storage.write_all(self.blockchain)
+            self.storage_signature = self.read_storage_signature()
+            self.release_sealed_blocks()
+        except Exception as e:
+            logger.critical("Failed to save blockchain to %s: %s", self.storage_file, e)
+
+    @metrics.timed(metrics.CHAIN_STORAGE_SECONDS, operation="append")
+    def append_to_storage(self, blocks):
+        """
+        Appends newly added blocks to storage without
+        rewriting the blocks that are already there.
+
+        Args:
+            blocks (list): The new blocks, in chain order. They are
+                already in the chain and the identity index.
+
+        Raises:
+            OSError: If storage couldn't take them. The blocks are taken
+                back out of the chain first, so the next block links to
+                the last block that was actually stored.
+        """
+        try:
+            self.storage.append(blocks)
+        except Exception as e:
+            logger.critical("Failed to save blockchain to %s: %s", self.storage_file, e)
+            self.discard_blocks(len(self.blockchain) - len(blocks))
+            # Storage cut its file back to where it was, which touches
+            # the mtime; that is not an edit by someone else
+            self.storage_signature = self.read_storage_signature()
+            raise
+        self.storage_signature = self.read_storage_signature()
+        self.release_sealed_blocks()
+
+    def discard_blocks(self, length):
+        """
+        Removes the blocks after the first `length` from the chain in
+        memory and from the identity index.
+        """
+        chain = self.blockchain
+        for position in range(length, len(chain)):
+            self.unindex_block(chain[position], position)
+        if isinstance(chain, list):
+            del chain[length:]
+        else:
+            chain.truncate(length)
+
+    def release_sealed_blocks(self):
+        """
+        Once storage has sealed more blocks into segments (or rewrote
+        them), stops keeping those blocks in memory: they are read back
+        from their segment file when a page, lookup or audit needs them.
+        """
+        chain = self.blockchain
+        if isinstance(chain, SegmentedChain):
+            chain.release_sealed()
+            return
+        sealed = self.storage.sealed_block_count()
+        if sealed == self.sealed_seen:
+            return
+        segmented = SegmentedChain(self.storage, Block)
+        segmented.extend(chain[sealed:len(chain)])
+        self.blockchain = segmented
+        self.sealed_seen = sealed
+
+    @metrics.timed(metrics.CHAIN_LOAD_SECONDS)
+    @with_write_lock
+    def load_chain(self, use_snapshot=True):
+        """
+        Loads the blockchain from storage.
+        A chain in the old blockchain.json format is imported on first start.
+        If no chain exists, it creates a new chain with a Genesis Block.
+
+        Args:
+            use_snapshot (bool): Start from the snapshot file if it still
+                matches storage, and only read the blocks after it.
+        """
+        self.reset_validation()
+        try:
+            if not self.storage.exists() and os.path.exists(self.legacy_file):
+                self.import_legacy_chain()
+                return
+
+            if use_snapshot and self.load_snapshot():
+                return
+
+            self.snapshot_blocks = 0
+            self.sealed_seen = self.storage.sealed_block_count()
+            if self.sealed_seen:
+                # Sealed blocks stay on disk until they are needed
+                chain = SegmentedChain(self.storage, Block)
+                chain.extend(Block.from_dict(block) for block in self.storage.iter_tail_blocks())
+                self.blockchain = chain
+            else:
+                self.blockchain = [Block.from_dict(block) for block in self.storage.iter_blocks()]
+            self.storage_signature = self.read_storage_signature()
+            if not self.blockchain:
+                logger.info("Blockchain file is empty. Creating Genesis Block.")
+                self.create_genesis_block()
+            else:
+                self.rebuild_index()
+                logger.info("Blockchain with %d blocks loaded from %s.", len(self.blockchain), self.storage_file)
+                if use_snapshot:
+                    self.save_snapshot_if_due()
+        except FileNotFoundError:
+            logger.info("No file found at %s. Creating new blockchain with Genesis Block.", self.storage_file)
+            self.create_genesis_block()
+        except Exception as e:
+            logger.error("An unexpected error occurred during loading: %s", e)
+            self.create_genesis_block()
+
+    def load_snapshot(self):
+        """
+        Loads the chain from the snapshot file and reads only the blocks
+        appended to storage after it was written. The snapshot is only
+        used if it belongs to the current storage file, the files were at
+        most appended to since (see storage_unchanged_since) and its last
+        block is still stored exactly where the snapshot says it ends.
+        Callers must hold the write lock.
+
+        Returns:
+            bool: True if the chain was loaded, False to load it in full.
+        """
+        snapshot = open_snapshot(self.snapshot_file)
+        if snapshot is None:
+            return False
+        signature = self.read_storage_signature()
+        last_block = None
+        if (signature is not None and signature[0] == snapshot.log_id
+                and self.storage_unchanged_since(snapshot)):
+            last_block = self.storage.resume(snapshot.log_position)
+        if last_block is None or last_block.get('hash') != snapshot.last_hash:
+            logger.info("Snapshot %s does not match %s. Loading the full chain.", self.snapshot_file, self.storage_file)
+            return False
+
+        # Swap in the chain before the index (see find_identity)
+        chain = SnapshotChain(snapshot, Block)
+        self.blockchain = chain
+        self.identity_index = SnapshotIndex(snapshot)
+        self.snapshot_blocks = snapshot.block_count
+        self.sealed_seen = self.storage.sealed_block_count()
+        # Blocks covered by the snapshot were already verified
+        self.verified_upto = max(1, min(snapshot.verified_upto, snapshot.block_count))
+        self.verified_digest = snapshot.verified_digest if self.verified_upto > 1 else None
+
+        # Replay the blocks appended after the snapshot
+        for block in self.storage.iter_new_blocks():
+            chain.append(Block.from_dict(block))
+            self.index_block(chain[-1], len(chain) - 1)
+        self.storage_signature = self.read_storage_signature()
+        self.load_bloom()
+        logger.info("Blockchain with %d blocks loaded from %s and %d newer blocks from %s.",
+                    len(chain), self.snapshot_file, len(chain.tail), self.storage_file)
+        self.save_snapshot_if_due()
+        return True
+
+    def storage_unchanged_since(self, snapshot):
+        """
+        Returns True if the storage files were at most appended to since
+        the snapshot was written: the log is the same file and either
+        untouched or longer, and every other file (sealed segments) is
+        untouched. This is the rule sync_from_storage applies while the
+        chain is open, so an edit made while no server was running (same
+        size, new modification time) gets the chain re-read and fully
+        re-verified instead of the snapshot's old copy being trusted.
+        """
+        state = self.storage.file_state()
+        if state is None:
+            return False
+        inode, mtime, size, others = state
+        old_inode, old_mtime, old_size, old_others = snapshot.file_state
+        return (inode == old_inode and others == old_others
+                and (size > old_size or (size == old_size and mtime == old_mtime)))
+
+    def close(self):
+        """
+        Syncs storage and closes the Bloom filter, so the next start can
+        reuse it. The chain must not be changed afterwards.
+        """
+        self.storage.flush()
+        if self.bloom is not None:
+            self.bloom.close()
+
+    def save_snapshot_if_due(self):
+        """
+        Writes a new snapshot once snapshot_interval blocks were
+        added since the last one.
+        """
+        if len(self.blockchain) - self.snapshot_blocks >= self.snapshot_interval and self.storage.exists():
+            self.save_snapshot()
+
+    @metrics.timed(metrics.CHAIN_STORAGE_SECONDS, operation="snapshot")
+    @with_write_lock
+    def save_snapshot(self):
+        """
+        Writes the chain, identity index and validation watermark to the
+        snapshot file, so the next start doesn't have to read the whole log.
+
+        Returns:
+            bool: True if the snapshot was written.
+        """
+        # The snapshot must end exactly where storage ends, so catch up
+        # with blocks appended by other processes first
+        self.sync_from_storage()
+        position = self.storage.position()
+        signature = self.read_storage_signature()
+        file_state = self.storage.file_state()
+        if position is None or signature is None or file_state is None:
+            return False
+        # Don't replace a snapshot that vouches for more of the chain than
+        # we have verified (e.g. right after loading an edited log). It
+        # may hold the only good copy of damaged blocks (see repair_chain).
+        existing = open_snapshot(self.snapshot_file)
+        if existing is not None and existing.verified_upto > self.verified_upto:
+            logger.info("Keeping snapshot %s until more of the chain is verified.", self.snapshot_file)
+            return False
+        try:
+            write_snapshot(self.snapshot_file, self.blockchain, position, signature[0],
+                           self.verified_upto, self.verified_digest, file_state)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not write snapshot %s: %s", self.snapshot_file, e)
+            return False
+        self.snapshot_blocks = len(self.blockchain)
+        return True
+
+    def import_legacy_chain(self):
+        """
+        Imports a chain from the old single-document blockchain.json
+        and writes it into the storage backend.
+        """
+        try:
+            self.blockchain = [Block.from_dict(block) for block in read_legacy_json(self.legacy_file)]
+        except json.JSONDecodeError:
+            logger.error("Error decoding JSON from %s. File might be corrupt. "
+                         "Creating new blockchain with Genesis Block.", self.legacy_file)
+            self.create_genesis_block()
+            return
+
+        if not self.blockchain:
+            logger.info("Blockchain file is empty. Creating Genesis Block.")
+            self.create_genesis_block()
+            return
+
+        self.rebuild_index()
+        self.save_chain()
+        logger.info("Imported %d blocks from %s into %s.", len(self.blockchain), self.legacy_file, self.storage_file)
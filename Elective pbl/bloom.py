@@ -0,0 +1,182 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+"""
+File: bloom.py
+Description: Bloom filter over the identity hashes on the chain. It can
+answer "definitely not registered" in a few microseconds using a compact
+bit array, so the exact lookup only runs when an identity might be
+registered. The filter is kept in a file next to the chain and is
+memory-mapped when loaded, so it doesn't have to be read or rebuilt on
+startup.
+"""
+
+MAGIC = b"IDVBLOOM"
+FORMAT_VERSION = 1
+# magic, version, clean flag, bits, hash count, capacity, items added,
+# blocks covered, hash of the last covered block
+HEADER = struct.Struct("<8sIIQIQQQ64s")
+CLEAN_FLAG = struct.Struct("<I")
+CLEAN_FLAG_OFFSET = 12
+
+
+class BloomFilter:
+    """
+    A Bloom filter stored in a memory-mapped file.
+
+    The header records how many chain blocks the filter covers and the
+    hash of the last one, so it can be checked against the chain when it
+    is loaded. A 'clean' flag is cleared while the filter is being changed
+    and set again by close(); a filter that wasn't closed cleanly may be
+    missing bits and must be rebuilt.
+    """
+
+    def __init__(self, path, mapped, file):
+        """
+        Use BloomFilter.create() or BloomFilter.open() instead.
+        """
+        self.path = path
+        self.mapped = mapped
+        self.file = file
+        (_, _, _, self.num_bits, self.num_hashes, self.capacity,
+         self.count, self.covered_blocks, last_hash) = HEADER.unpack_from(mapped, 0)
+        self.last_hash = last_hash.rstrip(b"\x00").decode()
+        self.clean = True
+
+    @staticmethod
+    def optimal_size(capacity, error_rate):
+        """
+        Returns (number of bits, number of hash functions) for a filter
+        holding `capacity` items with the given false-positive rate.
+        """
+        num_bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return num_bits, num_hashes
+
+    @classmethod
+    def create(cls, path, capacity, error_rate):
+        """
+        Creates a new, empty filter file.
+
+        Args:
+            path (str): The filter file.
+            capacity (int): Number of items the filter is sized for.
+            error_rate (float): Wanted false-positive rate (e.g. 0.001).
+        """
+        capacity = max(1, capacity)
+        num_bits, num_hashes = cls.optimal_size(capacity, error_rate)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 1, num_bits, num_hashes, capacity, 0, 0, b""))
+            f.truncate(HEADER.size + (num_bits + 7) // 8)
+        os.replace(temp_path, path)
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Memory-maps an existing filter file.
+
+        Returns:
+            BloomFilter: The filter, or None if the file is missing or
+                         not a valid filter.
+        """
+        try:
+            file = open(path, 'r+b')
+        except OSError:
+            return None
+        try:
+            mapped = mmap.mmap(file.fileno(), 0)
+        except ValueError:
+            file.close()
+            return None
+        header = HEADER.unpack_from(mapped, 0) if len(mapped) >= HEADER.size else None
+        if (not header or header[0] != MAGIC or header[1] != FORMAT_VERSION
+                or len(mapped) < HEADER.size + (header[3] + 7) // 8):
+            mapped.close()
+            file.close()
+            return None
+        bloom = cls(path, mapped, file)
+        bloom.clean = header[2] == 1
+        return bloom
+
+    def positions(self, identity_hash):
+        """
+        Returns the bit positions for an item (double hashing).
+        Identity hashes are already SHA-256 hex digests, so their bytes
+        are used directly instead of hashing them again.
+        """
+        try:
+            digest = bytes.fromhex(identity_hash)
+        except ValueError:
+            digest = b""
+        if len(digest) < 16:
+            digest = hashlib.sha256(identity_hash.encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, identity_hash):
+        mapped = self.mapped
+        try:
+            for bit in self.positions(identity_hash):
+                if not mapped[HEADER.size + (bit >> 3)] & (1 << (bit & 7)):
+                    return False
+        except ValueError:
+            # The filter was closed under us (it is being replaced);
+            # "maybe" sends the caller on to the exact lookup.
+            pass
+        return True
+
+    def add(self, identity_hash):
+        """
+        Adds an item to the filter.
+        """
+        mapped = self.mapped
+        # Another process sharing the file may have closed it (and marked
+        # it clean) since we last looked, so check the header itself
+        if self.clean or CLEAN_FLAG.unpack_from(mapped, CLEAN_FLAG_OFFSET)[0]:
+            self.set_clean(False)
+        for bit in self.positions(identity_hash):
+            offset = HEADER.size + (bit >> 3)
+            mapped[offset] = mapped[offset] | (1 << (bit & 7))
+        self.count += 1
+
+    def mark_covered(self, block_count, last_hash):
+        """
+        Records that the filter now holds every identity in the first
+        `block_count` blocks of the chain.
+        """
+        self.covered_blocks = block_count
+        self.last_hash = last_hash
+        self.write_header()
+
+    def is_full(self):
+        """
+        Returns True once more items were added than the filter was
+        sized for (its false-positive rate starts to climb).
+        """
+        return self.count > self.capacity
+
+    def set_clean(self, clean):
+        self.clean = clean
+        self.write_header()
+
+    def write_header(self):
+        HEADER.pack_into(self.mapped, 0, MAGIC, FORMAT_VERSION, 1 if self.clean else 0,
+                         self.num_bits, self.num_hashes, self.capacity, self.count,
+                         self.covered_blocks, self.last_hash.encode())
+
+    def close(self):
+        """
+        Marks the filter clean, writes it to disk and unmaps it.
+        """
+        if self.mapped.closed:
+            return
+        self.set_clean(True)
+        self.mapped.flush()
+        self.mapped.close()
+        self.file.close()
@@ -0,0 +1,129 @@
+import json
+import os
+import time
+from hasher import hash_many
+from main import validate_id_number
+
+"""
+File: bulk_import.py
+Description: Non-interactive bulk registration of identity numbers.
+Streams a CSV or plain text file of 12-digit IDs (first column, one per
+line), validates and hashes them in batches, skips IDs that are already
+on the chain, and appends each batch to the chain with a single write.
+Progress is saved to a checkpoint file after every batch, so an
+interrupted import continues where it stopped.
+"""
+
+def load_checkpoint(checkpoint_path):
+    """
+    Reads the saved progress of an earlier, interrupted import.
+
+    Returns:
+        dict: The checkpoint, or None if there is none.
+    """
+    try:
+        with open(checkpoint_path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    """
+    Saves import progress atomically (temp file + rename), so a crash
+    never leaves a half-written checkpoint.
+    """
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, checkpoint_path)
+
+def read_batches(path, offset, batch_size, counts):
+    """
+    Streams valid ID numbers from the file in batches.
+
+    Args:
+        path (str): The CSV or text file.
+        offset (int): Byte offset to start reading from.
+        batch_size (int): Valid IDs per batch.
+        counts (dict): Counters updated for every line read.
+
+    Yields:
+        tuple: (list of valid IDs, byte offset just after the batch)
+    """
+    batch = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            text = line.decode('utf-8', errors='replace').strip()
+            if not text:
+                continue
+            counts['read'] += 1
+
+            # For CSV files, the ID is the first column
+            id_number = text.split(',', 1)[0].strip().strip('"')
+            if not validate_id_number(id_number, quiet=True):
+                counts['invalid'] += 1
+                continue
+
+            batch.append(id_number)
+            if len(batch) >= batch_size:
+                yield batch, offset
+                batch = []
+    if batch:
+        yield batch, offset
+
+def import_identities(blockchain, path, batch_size=10000, checkpoint_path=None, merkle=False, restart=False):
+    """
+    Registers every valid ID in a file on the blockchain.
+
+    Args:
+        blockchain (Blockchain): The chain to register the IDs on.
+        path (str): CSV or text file with one ID per line.
+        batch_size (int): IDs validated, hashed and written per batch.
+        checkpoint_path (str): Where progress is saved
+            (default: '<file>.checkpoint').
+        merkle (bool): Store each batch as one Merkle block.
+        restart (bool): Ignore an existing checkpoint and start over.
+
+    Returns:
+        dict: Counters for the run (read, invalid, duplicate, added).
+    """
+    checkpoint_path = checkpoint_path or path + ".checkpoint"
+    checkpoint = None if restart else load_checkpoint(checkpoint_path)
+
+    if checkpoint and checkpoint.get('file') == os.path.abspath(path):
+        print(f"Resuming import of {path} from byte {checkpoint['offset']}.")
+        offset = checkpoint['offset']
+        counts = checkpoint['counts']
+    else:
+        offset = 0
+        counts = {'read': 0, 'invalid': 0, 'duplicate': 0, 'added': 0}
+
+    start_time = time.perf_counter()
+    read_at_start = counts['read']
+
+    for batch, offset in read_batches(path, offset, batch_size, counts):
+        hashes = list(hash_many(batch))
+        # Duplicates (on the chain or within the batch) are skipped, and
+        # the whole batch is appended to storage in one write
+        results = blockchain.add_blocks(hashes, merkle=merkle)
+        for result in results:
+            counts['added' if result['status'] == 'added' else 'duplicate'] += 1
+
+        save_checkpoint(checkpoint_path, {
+            'file': os.path.abspath(path),
+            'offset': offset,
+            'counts': counts
+        })
+
+        elapsed = time.perf_counter() - start_time
+        rate = (counts['read'] - read_at_start) / elapsed if elapsed else 0
+        print(f"  {counts['read']} read, {counts['added']} added, {counts['duplicate']} duplicate, "
+              f"{counts['invalid']} invalid ({rate:.0f} IDs/s)")
+
+    blockchain.storage.flush()
+    # The import finished, so there is nothing left to resume
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return counts
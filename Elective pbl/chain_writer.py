@@ -0,0 +1,128 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+"""
+File: chain_writer.py
+Description: Single-writer append queue for the blockchain. Request
+threads hand their appends to one dedicated writer thread instead of
+calling add_block themselves, so two approvals can never both read the
+same last block and fork the 'previous_hash' linkage. Appends that are
+waiting in the queue together are written as one batch (group commit).
+"""
+
+class ChainWriter:
+    """
+    Owns the only thread that appends to a Blockchain.
+    """
+
+    def __init__(self, blockchain, max_batch=1000):
+        """
+        Constructor for the ChainWriter. Starts the writer thread.
+
+        Args:
+            blockchain (Blockchain): The chain to append to.
+            max_batch (int): Most single appends merged into one write.
+        """
+        self.blockchain = blockchain
+        self.max_batch = max_batch
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="chain-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, payload):
+        """
+        Queues a job for the writer thread.
+
+        Args:
+            kind (str): 'block' (one identity) or 'blocks' (a batch).
+            payload: The identity hash, or (hashes, merkle) for a batch.
+
+        Returns:
+            Future: Resolves to the job's result.
+        """
+        future = Future()
+        self.jobs.put((kind, payload, future))
+        return future
+
+    def add_block(self, data_hash, timeout=None):
+        """
+        Appends one identity and waits for the result.
+
+        Returns:
+            dict: The new block, or None if it was a duplicate.
+        """
+        return self.submit('block', data_hash).result(timeout)
+
+    def add_blocks(self, data_hashes, merkle=False, timeout=None):
+        """
+        Appends a batch of identities and waits for the per-item results
+        (see Blockchain.add_blocks).
+        """
+        return self.submit('blocks', (list(data_hashes), merkle)).result(timeout)
+
+    def run(self):
+        """
+        Writer thread main loop.
+        """
+        job = None
+        while True:
+            if job is None:
+                job = self.jobs.get()
+
+            # Collect the single appends that are already queued behind
+            # this one, so they share one storage write.
+            singles = []
+            while job is not None and job[0] == 'block' and len(singles) < self.max_batch:
+                singles.append(job)
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    job = None
+            if singles:
+                self.write_singles(singles)
+                continue
+
+            kind, payload, future = job
+            job = None
+            if kind == 'stop':
+                break
+            data_hashes, merkle = payload
+            self.run_job(future, self.blockchain.add_blocks, data_hashes, merkle)
+
+    def write_singles(self, singles):
+        """
+        Writes a group of single appends with one add_blocks call and
+        hands each caller its own block (or None for a duplicate).
+        """
+        # Skip callers that gave up (cancelled) before we got to them
+        active = [(data_hash, future) for _, data_hash, future in singles
+                  if future.set_running_or_notify_cancel()]
+        try:
+            results = self.blockchain.add_blocks([data_hash for data_hash, _ in active])
+        except Exception as e:
+            for _, future in active:
+                future.set_exception(e)
+            return
+
+        chain, _ = self.blockchain.snapshot()
+        for (_, future), result in zip(active, results):
+            future.set_result(chain[result['index'] - 1] if result['status'] == 'added' else None)
+
+    def run_job(self, future, function, *args):
+        """
+        Runs one job and stores its result (or error) in the future.
+        """
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+    def stop(self):
+        """
+        Stops the writer thread once the queued jobs are done.
+        """
+        self.jobs.put(('stop', None, None))
+        self.thread.join()
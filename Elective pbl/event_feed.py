@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+
+"""
+File: event_feed.py
+Description: Live feed of new pending applications and new blocks for the
+admin dashboard, sent as server-sent events (the /events route). Instead
+of re-downloading the pending list and the chain on every refresh, a
+dashboard keeps one connection open and only receives what changed.
+
+Each event carries an id "<queue position>:<chain length>". Browsers send
+the last one back when they reconnect, so nothing is missed or repeated.
+Changes made by this process wake the feed at once (notify()); changes
+made by other server workers are picked up by polling every few seconds.
+"""
+
+def mask_id_number(id_number):
+    """
+    Returns an Aadhaar number with all but its last 4 digits hidden, as
+    shown on the dashboard ("XXXX XXXX 1234"). Events go to every open
+    dashboard, so they never carry the full number.
+    """
+    return "XXXX XXXX " + str(id_number)[-4:]
+
+class ChangeFeed:
+    """
+    Streams changes of the pending queue and the chain to dashboards.
+    """
+
+    def __init__(self, blockchain, users, poll_interval=2.0, heartbeat_interval=15.0):
+        """
+        Args:
+            blockchain (Blockchain): The chain to watch for new blocks.
+            users (UserStore): The store holding the pending queue.
+            poll_interval (float): Seconds between checks for changes
+                made by other processes.
+            heartbeat_interval (float): Seconds of silence after which a
+                comment is sent, so proxies don't close the connection.
+        """
+        self.blockchain = blockchain
+        self.users = users
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.changed = threading.Condition()
+        self.version = 0
+        self.clients = 0
+
+    def notify(self):
+        """
+        Wakes every open stream (call after enqueueing an application
+        or appending blocks).
+        """
+        with self.changed:
+            self.version += 1
+            self.changed.notify_all()
+
+    def parse_event_id(self, last_event_id):
+        """
+        Returns the (queue position, chain length) a reconnecting client
+        has already seen. New clients get the whole queue but only blocks
+        appended from now on (they download the chain with /chain_data).
+        """
+        try:
+            seq, length = last_event_id.split(":")
+            return int(seq), int(length)
+        except (AttributeError, ValueError):
+            return 0, len(self.blockchain.blockchain)
+
+    def stream(self, last_event_id=None):
+        """
+        Generator of server-sent events for one client. Runs until the
+        client disconnects.
+
+        Args:
+            last_event_id (str): The Last-Event-ID header, if reconnecting.
+
+        Yields:
+            str: Text of the event stream.
+        """
+        seq, length = self.parse_event_id(last_event_id)
+        # Hash of the last block the client has, to notice repairs
+        tip = None
+        with self.changed:
+            self.clients += 1
+        try:
+            # Tell the browser how long to wait before reconnecting
+            yield "retry: 3000\n\n"
+            last_sent = time.monotonic()
+            while True:
+                with self.changed:
+                    seen_version = self.version
+
+                events = []
+                seq, length, tip = self.collect(seq, length, tip, events)
+                if events:
+                    last_sent = time.monotonic()
+                    yield "".join(events)
+                elif time.monotonic() - last_sent >= self.heartbeat_interval:
+                    last_sent = time.monotonic()
+                    yield ": keep-alive\n\n"
+
+                with self.changed:
+                    if self.version == seen_version:
+                        self.changed.wait(self.poll_interval)
+        finally:
+            with self.changed:
+                self.clients -= 1
+
+    def collect(self, seq, length, tip, events):
+        """
+        Adds the events for everything after (seq, length) to `events`.
+        `tip` is the hash of the last block the client has (None if not
+        known).
+
+        Returns:
+            tuple: The new (queue position, chain length, tip).
+        """
+        while True:
+            entries = self.users.pending_after(seq, 500)
+            for entry_seq, application in entries:
+                seq = entry_seq
+                application = dict(application, id_number=mask_id_number(application['id_number']))
+                events.append(self.format_event("application", application, seq, length))
+            if len(entries) < 500:
+                break
+
+        # Blocks appended by other server workers only show up after a sync
+        self.blockchain.sync_from_storage()
+        chain, chain_length = self.blockchain.snapshot()
+        if chain_length < length or (tip is not None and chain[length - 1]['hash'] != tip):
+            # The chain was rewritten (e.g. repaired), so the client's copy is stale
+            length = chain_length
+            events.append(self.format_event("reset", {"length": chain_length}, seq, length))
+        for position in range(length, chain_length):
+            length = position + 1
+            events.append(self.format_event("block", chain[position].to_dict(), seq, length))
+        tip = chain[length - 1]['hash'] if length else None
+        return seq, length, tip
+
+    def format_event(self, kind, data, seq, length):
+        return f"id: {seq}:{length}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
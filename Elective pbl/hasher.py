@@ -1,38 +1,177 @@
-import hashlib
-import sys
-
-"""
-File: hasher.py
-Description: As per the project report, this is a utility module dedicated
-to handling the SHA-256 hashing function. It keeps the hashing logic
-separate from the main application logic.
-"""
-
-def hash_data(data_string):
-    """
-    Hashes a given string using the SHA-256 algorithm.
-    
-    The report specifies SHA-256 to convert identity data (like Aadhaar)
-    into a secure, fixed-length cryptographic digest.
-
-    Args:
-        data_string (str): The input string to be hashed (e.g., "123456789012").
-
-    Returns:
-        str: The resulting SHA-256 hash as a hexadecimal string.
-    """
-    try:
-        # 1. Encode the string into bytes
-        #    The hashlib functions require byte-like objects, not strings.
-        #    'utf-8' is a standard encoding.
-        data_bytes = data_string.encode('utf-8')
-        
-        # 2. Create a new SHA-256 hash object
-        sha256_hash = hashlib.sha256(data_bytes)
-        
-        # 3. Get the hexadecimal representation of the hash digest
-        return sha256_hash.hexdigest()
-        
-    except Exception as e:
-        print(f"Error during hashing: {e}", file=sys.stderr)
-        return None
\ No newline at end of file
+import hashlib
+import mmap
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import metrics
+
+"""
+File: hasher.py
+Description: As per the project report, this is a utility module dedicated
+to handling the SHA-256 hashing function. It keeps the hashing logic
+separate from the main application logic.
+"""
+
+def hash_data(data_string):
+    """
+    Hashes a given string using the SHA-256 algorithm.
+    
+    The report specifies SHA-256 to convert identity data (like Aadhaar)
+    into a secure, fixed-length cryptographic digest.
+
+    Args:
+        data_string (str): The input string to be hashed (e.g., "123456789012").
+
+    Returns:
+        str: The resulting SHA-256 hash as a hexadecimal string.
+    """
+    try:
+        # 1. Encode the string into bytes
+        #    The hashlib functions require byte-like objects, not strings.
+        #    'utf-8' is a standard encoding.
+        data_bytes = data_string.encode('utf-8')
+        
+        # 2. Create a new SHA-256 hash object
+        sha256_hash = hashlib.sha256(data_bytes)
+        
+        # 3. Get the hexadecimal representation of the hash digest
+        return sha256_hash.hexdigest()
+        
+    except Exception as e:
+        print(f"Error during hashing: {e}", file=sys.stderr)
+        return None
+
+def hash_bytes(data_bytes):
+    """
+    Hashes raw bytes using the SHA-256 algorithm.
+    Unlike hash_data, there is no string encoding step, so callers that
+    already hold bytes (e.g. a block's canonical encoding) skip a copy.
+
+    Args:
+        data_bytes (bytes): The input bytes to be hashed.
+
+    Returns:
+        str: The resulting SHA-256 hash as a hexadecimal string.
+    """
+    return hashlib.sha256(data_bytes).hexdigest()
+
+def iter_records(source, width=None):
+    """
+    Yields the individual ID numbers (as bytes) from a batch source.
+
+    Args:
+        source: Either an iterable of str/bytes/int values, or a buffer
+            (bytes, bytearray, mmap, NumPy array of fixed-width bytes such
+            as dtype 'S12', ...) holding fixed-width records back to back.
+        width (int): Record width in bytes for buffers. Taken from the
+            buffer's item size (e.g. 12 for a NumPy 'S12' array) if omitted.
+    """
+    if isinstance(source, str):
+        raise TypeError("hash_many needs an iterable of IDs or a buffer, not a single string")
+
+    try:
+        view = memoryview(source)
+    except TypeError:
+        view = None
+
+    if view is None:
+        # A plain iterable of values
+        for value in source:
+            if isinstance(value, str):
+                yield value.encode('utf-8')
+            elif isinstance(value, int):
+                yield str(value).encode('ascii')
+            else:
+                yield bytes(value)
+        return
+
+    width = width or (view.itemsize if view.itemsize > 1 else None)
+    if not width:
+        raise ValueError("width is required to split a byte buffer into records")
+    view = view.cast('B')
+    if len(view) % width:
+        raise ValueError(f"buffer length {len(view)} is not a multiple of the record width {width}")
+    for start in range(0, len(view), width):
+        # Fixed-width records may be padded (NUL for NumPy, newline for files)
+        yield bytes(view[start:start + width]).rstrip(b"\x00\r\n ")
+
+@metrics.timed(metrics.HASH_BATCH_SECONDS)
+def hash_chunk(records, raw):
+    """
+    Hashes a list of records. Runs in a worker thread.
+    """
+    metrics.HASHED_IDS.inc(len(records))
+    sha256 = hashlib.sha256
+    if raw:
+        return [sha256(record).digest() for record in records]
+    return [sha256(record).hexdigest() for record in records]
+
+def hash_many(source, width=None, raw=False, workers=4, chunk_size=4096):
+    """
+    Hashes many ID numbers with SHA-256 and yields the digests in input
+    order, as a stream (memory stays bounded for huge inputs).
+
+    Unlike hash_data, errors are raised instead of being printed, and no
+    per-item string encoding happens for byte inputs. The work is spread
+    over a thread pool in chunks. hashlib only releases the GIL for
+    inputs larger than about 2 KB, so for short IDs most of the gain
+    comes from the batching itself; long records hash truly in parallel.
+
+    Args:
+        source: An iterable of IDs or a buffer of fixed-width records
+            (see iter_records).
+        width (int): Record width for buffer sources.
+        raw (bool): Yield 32-byte digests instead of hex strings.
+        workers (int): Number of hashing threads.
+        chunk_size (int): Records handed to a thread at a time.
+
+    Yields:
+        str or bytes: One digest per input record.
+    """
+    records = iter_records(source, width)
+    if workers <= 1:
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                return
+            yield from hash_chunk(chunk, raw)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Keep only a few chunks in flight so memory stays bounded
+        in_flight = []
+        while True:
+            while len(in_flight) < workers * 2:
+                chunk = list(islice(records, chunk_size))
+                if not chunk:
+                    break
+                in_flight.append(pool.submit(hash_chunk, chunk, raw))
+            if not in_flight:
+                return
+            yield from in_flight.pop(0).result()
+
+def hash_file(path, width=None, **options):
+    """
+    Hashes every ID in a file through a memory map, so the file is never
+    read into memory as a whole.
+
+    Args:
+        path (str): File with one ID per line, or fixed-width records.
+        width (int): Record width in bytes (including any line break).
+            If omitted, the file is read line by line.
+        **options: raw, workers and chunk_size, as for hash_many.
+
+    Yields:
+        str or bytes: One digest per ID, in file order.
+    """
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file can't be memory-mapped
+            return
+        with mapped:
+            if width:
+                yield from hash_many(mapped, width=width, **options)
+            else:
+                lines = (line.strip() for line in iter(mapped.readline, b""))
+                yield from hash_many((line for line in lines if line), **options)
\ No newline at end of file
@@ -0,0 +1,106 @@
+from hasher import hash_data
+
+"""
+File: merkle.py
+Description: Merkle tree helpers. A block can hold many identity hashes
+and commit to all of them through a single Merkle root. An inclusion
+proof is the list of sibling hashes on the path from one leaf up to the
+root: O(log n) hashes that anyone can check without the rest of the chain.
+
+Leaves and inner nodes are hashed with different prefixes ("0" and "1")
+so that an inner node can never be passed off as a leaf. When a level has
+an odd number of nodes, the last one is carried up unchanged.
+"""
+
+def hash_leaf(identity_hash):
+    """
+    Hashes an identity hash into a Merkle leaf.
+    """
+    return hash_data("0" + identity_hash)
+
+def hash_node(left, right):
+    """
+    Hashes two child nodes into their parent node.
+    """
+    return hash_data("1" + left + right)
+
+def build_levels(identity_hashes):
+    """
+    Builds every level of the tree, from the leaves up to the root.
+
+    Args:
+        identity_hashes (list): The identity hashes (leaves), in order.
+
+    Returns:
+        list: A list of levels; levels[0] are the leaves, levels[-1] = [root].
+    """
+    level = [hash_leaf(h) for h in identity_hashes]
+    levels = [level]
+    while len(level) > 1:
+        parents = []
+        for i in range(0, len(level) - 1, 2):
+            parents.append(hash_node(level[i], level[i + 1]))
+        if len(level) % 2 == 1:
+            # Odd node out: carry it up to the next level as is
+            parents.append(level[-1])
+        level = parents
+        levels.append(level)
+    return levels
+
+def merkle_root(identity_hashes):
+    """
+    Calculates the Merkle root of a list of identity hashes.
+
+    Args:
+        identity_hashes (list): The identity hashes, in order.
+
+    Returns:
+        str: The root hash, or None for an empty list.
+    """
+    if not identity_hashes:
+        return None
+    return build_levels(identity_hashes)[-1][0]
+
+def merkle_proof(identity_hashes, position):
+    """
+    Builds the inclusion proof for one leaf.
+
+    Args:
+        identity_hashes (list): All identity hashes in the block, in order.
+        position (int): Position of the identity to prove.
+
+    Returns:
+        list: Proof steps, each {"hash": sibling, "side": "left" or "right"},
+              from the leaf level up.
+    """
+    proof = []
+    for level in build_levels(identity_hashes)[:-1]:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append({
+                "hash": level[sibling],
+                "side": "left" if sibling < position else "right"
+            })
+        position //= 2
+    return proof
+
+def verify_proof(identity_hash, proof, root):
+    """
+    Checks an inclusion proof against a Merkle root.
+    This is what a relying party (e.g. a bank) runs on its side.
+
+    Args:
+        identity_hash (str): The identity hash being proven.
+        proof (list): Proof steps from merkle_proof().
+        root (str): The Merkle root stored in the block.
+
+    Returns:
+        bool: True if the identity is included under the root.
+    """
+    node = hash_leaf(identity_hash)
+    for step in proof:
+        if step["side"] == "left":
+            node = hash_node(step["hash"], node)
+        else:
+            node = hash_node(node, step["hash"])
+    return node == root
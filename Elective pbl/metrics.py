@@ -0,0 +1,211 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+File: metrics.py
+Description: Lightweight instrumentation for the identity system.
+Counters and latency histograms are kept in memory and rendered in the
+Prometheus text format by app.py's /metrics route. There is no dependency
+on prometheus_client.
+
+Set the environment variable IDV_METRICS=0 (or call set_enabled(False))
+to turn instrumentation off. Every recording function then returns after
+a single flag check.
+"""
+
+enabled = os.environ.get("IDV_METRICS", "1") != "0"
+
+# Latency buckets in seconds, from 100 microseconds to 10 seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Every metric registers itself here, in the order it is rendered
+REGISTRY = []
+
+def set_enabled(flag):
+    """
+    Turns instrumentation on or off for the whole process.
+    """
+    global enabled
+    enabled = bool(flag)
+
+def format_labels(labelnames, key, extra=""):
+    """
+    Renders label values as {name="value",...} for the text format.
+    """
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """
+    A value that only goes up (e.g. duplicates rejected).
+    """
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        if not enabled:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = sorted(self.values.items())
+        if not values and not self.labelnames:
+            values = [((), 0)]
+        for key, value in values:
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    """
+    Distribution of observed values, usually durations in seconds.
+    """
+
+    def __init__(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (last one is +Inf), sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        if not enabled:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][slot] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Times the body of a with-block.
+        """
+        if not enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            values = sorted((key, [list(entry[0]), entry[1], entry[2]]) for key, entry in self.values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Gauge:
+    """
+    A value read at render time from a function (e.g. the chain length).
+    """
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.function = None
+        REGISTRY.append(self)
+
+    def set_function(self, function):
+        self.function = function
+
+    def render(self):
+        if self.function is None:
+            return []
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.function()}"]
+
+def timed(histogram, **labels):
+    """
+    Decorator that records how long each call of a function takes.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorate
+
+def render():
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- The metrics of the identity system ---
+
+CHAIN_APPEND_SECONDS = Histogram(
+    "idv_chain_append_seconds", "Time to append identities to the chain, including lock waits.", ("kind",))
+CHAIN_VALIDATION_SECONDS = Histogram(
+    "idv_chain_validation_seconds", "Time spent checking chain integrity.", ("mode",))
+CHAIN_STORAGE_SECONDS = Histogram(
+    "idv_chain_storage_seconds", "Time spent writing the chain to disk.", ("operation",))
+CHAIN_LOAD_SECONDS = Histogram(
+    "idv_chain_load_seconds", "Time to load the chain from storage.")
+USER_STORE_SECONDS = Histogram(
+    "idv_user_store_seconds", "Time spent reading and writing users.", ("operation",))
+HASH_BATCH_SECONDS = Histogram(
+    "idv_hash_batch_seconds", "Time to hash one chunk of a batch hashing call.")
+HTTP_REQUEST_SECONDS = Histogram(
+    "idv_http_request_seconds", "HTTP request latency per route.", ("route", "method", "status"))
+PASSWORD_HASH_SECONDS = Histogram(
+    "idv_password_hash_seconds", "Time to hash or check one password, including the wait for a hashing slot.")
+
+BLOCKS_APPENDED = Counter("idv_blocks_appended_total", "Blocks appended by this process.")
+BLOCKS_REPLICATED = Counter("idv_blocks_replicated_total", "Blocks imported from a peer node.")
+REPLICATION_ERRORS = Counter("idv_replication_errors_total", "Syncs from a peer node that failed.")
+HASHED_IDS = Counter("idv_hashed_ids_total", "Identities hashed through batch hashing.")
+DUPLICATES_REJECTED = Counter("idv_duplicates_rejected_total", "Registrations rejected because the identity was already on the chain.")
+SEGMENT_LOADS = Counter("idv_segment_loads_total", "Sealed chain segments read back from disk.")
+VERIFY_LOOKUPS = Counter("idv_verify_lookups_total", "Identity lookups answered by the verification server.")
+VERIFY_COALESCED = Counter("idv_verify_coalesced_total", "Lookups that shared an identical lookup already in progress.")
+BLOCKS_REPAIRED = Counter("idv_blocks_repaired_total", "Blocks restored or re-linked by chain repairs.")
+TAMPER_DETECTIONS = Counter("idv_tamper_detections_total", "Integrity checks that found a tampered block.")
+CREDENTIAL_CACHE = Counter("idv_credential_cache_total", "User record lookups for logins, by cache hit or miss.", ("result",))
+
+CHAIN_BLOCKS = Gauge("idv_chain_blocks", "Number of blocks in the chain.")
+CHAIN_IDENTITIES = Gauge("idv_chain_identities", "Number of identities registered on the chain.")
+EVENT_STREAM_CLIENTS = Gauge("idv_event_stream_clients", "Dashboards connected to the /events feed.")
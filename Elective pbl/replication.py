@@ -0,0 +1,255 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+from urllib.request import urlopen
+import metrics
+
+"""
+File: replication.py
+Description: Node-to-node replication of the chain, so lookups can be
+served by several nodes (read replicas) instead of one.
+
+Every node serves two read-only routes (in app.py and verify_server.py):
+    GET /sync/headers?after=<n>&limit=<m>   [index, previous_hash, hash]
+                                            of the blocks after the first n
+    GET /sync/blocks?after=<n>&limit=<m>    the full blocks after the first n
+
+A follower syncs headers first. It downloads the small headers after its
+last block and checks that they link up with each other and with its own
+chain, which needs no hashing. Only then does it download the block
+bodies, several batches in parallel, and appends them in order with
+Blockchain.import_blocks. That checks each new block on its own, so the
+follower never has to validate its whole chain again.
+
+If the peer's chain no longer contains our last block (e.g. the peer was
+repaired, or this node started with its own Genesis Block), the follower
+walks back to the last block both chains share and replaces everything
+after it with the peer's blocks.
+
+Usage: python verify_server.py --port 5002 --chain node2/blockchain.jsonl \
+           --peer http://127.0.0.1:5001
+"""
+
+logger = logging.getLogger(__name__)
+
+# Most headers and block bodies served per request
+MAX_HEADERS = 5000
+MAX_BLOCKS = 1000
+
+class ReplicationError(Exception):
+    """
+    The peer couldn't be reached or sent something that doesn't fit.
+    """
+
+def read_headers(blockchain, after, limit):
+    """
+    Returns the headers of the blocks after the first `after` blocks,
+    for GET /sync/headers.
+
+    Returns:
+        dict: {"length": chain length, "headers": [[index, previous_hash, hash], ...]}
+    """
+    chain, length = blockchain.snapshot()
+    after = max(after, 0)
+    end = min(after + max(min(limit, MAX_HEADERS), 0), length)
+    headers = []
+    for position in range(after, end):
+        block = chain[position]
+        headers.append([block['index'], block['previous_hash'], block['hash']])
+    return {"length": length, "headers": headers}
+
+def read_blocks(blockchain, after, limit):
+    """
+    Returns the blocks after the first `after` blocks, for GET /sync/blocks.
+
+    Returns:
+        dict: {"length": chain length, "blocks": [block dict, ...]}
+    """
+    chain, length = blockchain.snapshot()
+    after = max(after, 0)
+    end = min(after + max(min(limit, MAX_BLOCKS), 0), length)
+    return {"length": length, "blocks": [chain[position].to_dict() for position in range(after, end)]}
+
+def header_hash(header):
+    """
+    Returns the block hash of a header, or None if it is malformed.
+    """
+    return header[2] if isinstance(header, list) and len(header) == 3 else None
+
+def check_linkage(headers, first_position, previous_hash):
+    """
+    Checks that headers follow each other: consecutive indexes, and each
+    one names the hash of the one before it. No block is hashed.
+
+    Args:
+        headers (list): [index, previous_hash, hash] entries.
+        first_position (int): Chain position of the first header.
+        previous_hash (str): Hash of the block before the first header.
+
+    Raises:
+        ReplicationError: If the headers don't form a chain.
+    """
+    for position, header in enumerate(headers, first_position):
+        if header_hash(header) is None:
+            raise ReplicationError(f"Malformed header at position {position}.")
+        index, linked_hash, block_hash = header
+        if index != position + 1 or linked_hash != previous_hash:
+            raise ReplicationError(f"Header of block #{position + 1} does not link to the block before it.")
+        previous_hash = block_hash
+
+class Follower:
+    """
+    Keeps a local chain in step with a peer node's chain.
+    """
+
+    def __init__(self, blockchain, peer, header_batch=MAX_HEADERS, body_batch=500,
+                 workers=4, interval=2.0, timeout=10.0):
+        """
+        Args:
+            blockchain (Blockchain): The local chain to fill.
+            peer (str): Base URL of the node to follow (http://host:port).
+            header_batch (int): Headers asked for per request.
+            body_batch (int): Blocks asked for per body request.
+            workers (int): Body requests running at the same time.
+            interval (float): Seconds between syncs once caught up.
+            timeout (float): Seconds to wait for the peer per request.
+        """
+        self.blockchain = blockchain
+        self.peer = peer.rstrip("/")
+        self.header_batch = min(header_batch, MAX_HEADERS)
+        self.body_batch = min(body_batch, MAX_BLOCKS)
+        self.workers = workers
+        self.interval = interval
+        self.timeout = timeout
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def fetch(self, route, after, limit):
+        """
+        Calls one of the peer's /sync routes.
+
+        Returns:
+            list: The headers or blocks of the reply.
+
+        Raises:
+            ReplicationError: If the peer can't be reached or refuses
+                              (e.g. 503 because its chain is compromised).
+        """
+        url = f"{self.peer}{route}?after={after}&limit={limit}"
+        try:
+            with urlopen(url, timeout=self.timeout) as response:
+                reply = json.loads(response.read())
+        except (URLError, OSError, ValueError) as e:
+            raise ReplicationError(f"{url}: {e}")
+        # "headers" or "blocks"
+        field = route.rsplit("/", 1)[1]
+        if not isinstance(reply, dict) or not isinstance(reply.get(field), list):
+            raise ReplicationError(f"{url}: unexpected reply.")
+        return reply[field]
+
+    def sync_once(self):
+        """
+        Pulls everything the peer has and we don't.
+
+        Returns:
+            int: The number of blocks added.
+
+        Raises:
+            ReplicationError: If the peer can't be reached or its
+                              headers or blocks don't check out.
+            ValueError: If a block doesn't fit the local chain.
+        """
+        added = 0
+        while True:
+            chain, length = self.blockchain.snapshot()
+            # Our own last block comes first, to check we're still on the peer's chain
+            headers = self.fetch("/sync/headers", length - 1, self.header_batch)
+            if headers and header_hash(headers[0]) == chain[length - 1]['hash']:
+                start, headers = length, headers[1:]
+            else:
+                start = self.find_fork(chain, length)
+                headers = self.fetch("/sync/headers", start, self.header_batch)
+            if not headers:
+                return added
+            if start < length:
+                logger.warning("Chain differs from %s after block #%d.", self.peer, start)
+
+            check_linkage(headers, start, chain[start - 1]['hash'] if start > 0 else "0")
+            added += self.pull_blocks(start, headers)
+
+    def find_fork(self, chain, length):
+        """
+        Finds how many blocks at the start of our chain the peer has too
+        (the position to sync from), walking back one header batch at a time.
+        """
+        end = length
+        while end > 0:
+            after = max(end - self.header_batch, 0)
+            headers = self.fetch("/sync/headers", after, end - after)
+            for position in range(min(end, after + len(headers)) - 1, after - 1, -1):
+                if header_hash(headers[position - after]) == chain[position]['hash']:
+                    return position + 1
+            end = after
+        return 0
+
+    def pull_blocks(self, start, headers):
+        """
+        Downloads the bodies of the given headers in parallel batches and
+        adds them to the chain in order.
+
+        Returns:
+            int: The number of blocks added.
+        """
+        batches = [(start + offset, headers[offset:offset + self.body_batch])
+                   for offset in range(0, len(headers), self.body_batch)]
+        added = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # map() hands back the batches in order, so each one is
+            # added as soon as it and the ones before it have arrived
+            for (position, _), blocks in zip(batches, pool.map(self.fetch_blocks, batches)):
+                added += self.blockchain.import_blocks(blocks, start=position)
+        return added
+
+    def fetch_blocks(self, batch):
+        """
+        Downloads one batch of block bodies and checks them against
+        their headers.
+        """
+        position, expected = batch
+        blocks = self.fetch("/sync/blocks", position, len(expected))
+        if len(blocks) != len(expected):
+            raise ReplicationError(f"Asked for {len(expected)} blocks after #{position}, got {len(blocks)}.")
+        for block, header in zip(blocks, expected):
+            if not isinstance(block, dict) or [block.get('index'), block.get('previous_hash'), block.get('hash')] != header:
+                raise ReplicationError(f"Block #{header[0]} does not match its header.")
+        return blocks
+
+    def run(self):
+        """
+        Syncs until stop() is called.
+        """
+        while not self.stopped.is_set():
+            try:
+                added = self.sync_once()
+                if added:
+                    logger.info("Synced %d blocks from %s.", added, self.peer)
+            except (ReplicationError, ValueError, OSError) as e:
+                # OSError: the blocks couldn't be stored here; they were
+                # rolled back and the next round fetches them again
+                metrics.REPLICATION_ERRORS.inc()
+                logger.warning("Sync from %s failed: %s", self.peer, e)
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        """
+        Runs the follower in a background thread.
+        """
+        self.thread = threading.Thread(target=self.run, name="follower", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,587 @@
+import bisect
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from storage import JsonLinesStorage, to_json_value
+import metrics
+
+"""
+File: segments.py
+Description: Segmented chain storage. New blocks are appended to the
+JSON-lines log as before (the "active" log). Once the active log holds
+two segments' worth of blocks, the oldest segment is sealed: written to
+an immutable, gzip-compressed file and listed in a manifest together
+with the file's SHA-256 checksum and the hash of its last block. Only the
+active blocks stay resident in memory; a sealed segment is read back (and
+checked against its checksum) when a page, lookup or audit needs it, and
+only the most recently used segments are kept.
+
+Files, next to the active log 'blockchain.jsonl':
+    blockchain.segments/manifest.json
+    blockchain.segments/segment-<generation>-<first position>.jsonl.gz
+
+An existing plain log is simply an active log with no sealed segments,
+so it is picked up without any migration.
+"""
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+# Storage positions (see ChainStorage.position) hold the number of sealed
+# blocks above the byte offset in the active log
+OFFSET_BITS = 40
+
+class SegmentError(ValueError):
+    """
+    Raised when a sealed segment is missing, doesn't match its checksum
+    or can't be decoded.
+    """
+
+    def __init__(self, segment, message):
+        super().__init__(message)
+        self.segment = segment
+
+def sealed_count(segments):
+    """
+    Returns the number of blocks held by a list of sealed segments.
+    """
+    return segments[-1]['start'] + segments[-1]['count'] if segments else 0
+
+class SegmentedStorage(JsonLinesStorage):
+    """
+    JSON-lines log whose older blocks are sealed into compressed,
+    checksummed segment files.
+    """
+
+    def __init__(self, path="blockchain.jsonl", segment_size=10000, sync_every=16):
+        """
+        Constructor for the segmented storage.
+
+        Args:
+            path (str): The active log file.
+            segment_size (int): Blocks per sealed segment.
+            sync_every (int): Number of append calls between fsyncs.
+        """
+        super().__init__(path, sync_every)
+        self.segment_size = max(1, segment_size)
+        self.segment_dir = os.path.splitext(path)[0] + ".segments"
+        self.manifest_path = os.path.join(self.segment_dir, "manifest.json")
+        self.manifest = None
+        self.manifest_stat = None
+        # What we last read from or wrote to the active log: its inode,
+        # how many blocks were sealed at the time, the 'index' of the last
+        # block and the number of blocks in it (None = not counted yet)
+        self.read_inode = None
+        self.read_sealed = 0
+        self.last_index = None
+        self.active_blocks = None
+
+    # --- Manifest ---
+
+    def load_manifest(self):
+        """
+        Returns the manifest, reading the file again only if it changed.
+        """
+        try:
+            stat = os.stat(self.manifest_path)
+        except OSError:
+            self.manifest_stat = None
+            self.manifest = {"version": MANIFEST_VERSION, "generation": 0, "segments": []}
+            return self.manifest
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key != self.manifest_stat:
+            with open(self.manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+            self.manifest_stat = key
+        return self.manifest
+
+    def save_manifest(self, manifest):
+        """
+        Replaces the manifest atomically. This is the commit point of
+        sealing and of rewrites.
+        """
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+        self.sync_directory(self.segment_dir)
+
+    def sealed_segments(self):
+        return self.load_manifest()['segments']
+
+    def sealed_block_count(self):
+        return sealed_count(self.sealed_segments())
+
+    # --- Sealed segments ---
+
+    def write_segment(self, generation, start, blocks):
+        """
+        Writes one sealed segment file and returns its manifest entry.
+        """
+        os.makedirs(self.segment_dir, exist_ok=True)
+        lines = "".join(json.dumps(block, separators=(',', ':'), default=to_json_value) + "\n" for block in blocks)
+        data = gzip.compress(lines.encode(), compresslevel=6)
+        name = f"segment-{generation:04d}-{start:012d}.jsonl.gz"
+        temp_path = os.path.join(self.segment_dir, name + ".tmp")
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, os.path.join(self.segment_dir, name))
+        return {
+            "file": name,
+            "start": start,
+            "count": len(blocks),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "first_previous_hash": blocks[0]['previous_hash'],
+            "last_hash": blocks[-1]['hash']
+        }
+
+    def read_segment(self, segment, verify=True):
+        """
+        Reads the blocks of a sealed segment after checking its checksum
+        (repair reads damaged segments with verify=False).
+
+        Raises:
+            SegmentError: If the file is missing, changed or unreadable.
+        """
+        path = os.path.join(self.segment_dir, segment['file'])
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            raise SegmentError(segment, f"Sealed segment {segment['file']} can't be read: {e}")
+        if verify and hashlib.sha256(data).hexdigest() != segment['sha256']:
+            raise SegmentError(segment, f"Sealed segment {segment['file']} does not match its checksum.")
+        try:
+            blocks = [json.loads(line) for line in gzip.decompress(data).splitlines() if line.strip()]
+        except (OSError, EOFError, ValueError) as e:
+            raise SegmentError(segment, f"Sealed segment {segment['file']} can't be decoded: {e}")
+        if len(blocks) != segment['count']:
+            raise SegmentError(segment, f"Sealed segment {segment['file']} holds {len(blocks)} blocks, not {segment['count']}.")
+        metrics.SEGMENT_LOADS.inc()
+        return blocks
+
+    # --- The active log ---
+
+    def active_inode(self):
+        try:
+            return os.stat(self.path).st_ino
+        except OSError:
+            return None
+
+    def read_active(self):
+        """
+        Parses every complete block in the active log without moving the
+        read position (used for sealing).
+        """
+        sealed = self.sealed_block_count()
+        blocks = []
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return blocks
+        with f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                if not line.strip():
+                    continue
+                block = json.loads(line)
+                if isinstance(block.get('index'), int) and block['index'] <= sealed:
+                    continue
+                blocks.append(block)
+        return blocks
+
+    def read_active_from(self, start, last_index):
+        """
+        Reads the active log from a byte offset, skipping blocks at or
+        before 'last_index' (already sealed, or already read).
+        """
+        self.valid_length = start
+        if start == 0:
+            self.read_inode = self.active_inode()
+            self.read_sealed = self.sealed_block_count()
+            self.active_blocks = 0
+        if not os.path.exists(self.path):
+            return
+        for block in self.read_lines(warn=start == 0):
+            if last_index is not None and isinstance(block.get('index'), int) and block['index'] <= last_index:
+                if block['index'] > self.read_sealed and self.active_blocks is not None:
+                    self.active_blocks += 1
+                continue
+            if self.active_blocks is not None:
+                self.active_blocks += 1
+            self.last_index = block.get('index')
+            yield block
+
+    # --- ChainStorage interface ---
+
+    def exists(self):
+        return super().exists() or bool(self.sealed_segments())
+
+    def iter_blocks(self):
+        """
+        Yields every block: the sealed segments first, then the active log.
+        """
+        for segment in self.sealed_segments():
+            yield from self.read_segment(segment)
+        yield from self.iter_tail_blocks()
+
+    def iter_tail_blocks(self):
+        sealed = self.sealed_block_count()
+        self.last_index = sealed or None
+        # A crash between sealing and rewriting the active log can leave
+        # already-sealed blocks at its start; they are skipped by index
+        return self.read_active_from(0, sealed or None)
+
+    def iter_new_blocks(self):
+        if self.valid_length is None or self.last_index is None:
+            return self.iter_blocks()
+        if self.active_inode() == self.read_inode:
+            return self.read_active_from(self.valid_length, None)
+        return self.iter_blocks_after(self.last_index)
+
+    def iter_blocks_after(self, last_index):
+        """
+        Yields the blocks after 'last_index' when the active log was
+        rewritten by a seal in another process: first from segments
+        sealed since, then from the new active log.
+        """
+        for segment in self.sealed_segments():
+            if segment['start'] + segment['count'] > last_index:
+                for block in self.read_segment(segment):
+                    if block['index'] > last_index:
+                        self.last_index = block['index']
+                        yield block
+        yield from self.read_active_from(0, self.last_index)
+
+    def tail_is_aligned(self):
+        if self.read_inode is not None and self.active_inode() != self.read_inode:
+            # The active log was replaced. That's expected after a seal
+            # (more sealed blocks than when we read it), anything else
+            # means the log was rewritten or edited.
+            return self.sealed_block_count() > self.read_sealed
+        return super().tail_is_aligned()
+
+    def append(self, blocks):
+        if not blocks:
+            return
+        super().append(blocks)
+        if self.read_inode is None:
+            self.read_inode = self.active_inode()
+            self.read_sealed = self.sealed_block_count()
+        self.last_index = blocks[-1]['index']
+        if self.active_blocks is not None:
+            self.active_blocks += len(blocks)
+        self.seal_if_due()
+
+    def write_all(self, blocks):
+        """
+        Rewrites the whole chain (compaction): full segments are sealed
+        under a new generation and the rest goes to the active log. The
+        files of the previous generation are kept until the next rewrite,
+        so readers that still use them (other processes, or the chain
+        being written) aren't cut off.
+        """
+        manifest = self.load_manifest()
+        generation = manifest['generation'] + 1
+        total = len(blocks)
+        sealed = max(0, (total - self.segment_size) // self.segment_size) * self.segment_size
+
+        segments = []
+        buffer = []
+        remaining = []
+        for position, block in enumerate(blocks):
+            if position >= sealed:
+                remaining.append(block)
+                continue
+            buffer.append(block)
+            if len(buffer) == self.segment_size:
+                segments.append(self.write_segment(generation, position + 1 - len(buffer), buffer))
+                buffer = []
+
+        if segments or manifest['segments']:
+            os.makedirs(self.segment_dir, exist_ok=True)
+            self.save_manifest({"version": MANIFEST_VERSION, "generation": generation, "segments": segments})
+        super().write_all(remaining)
+        self.remove_old_generations(generation - 1)
+
+        self.read_inode = self.active_inode()
+        self.read_sealed = sealed
+        self.last_index = blocks[total - 1]['index'] if total else None
+        self.active_blocks = len(remaining)
+
+    def replace_suffix(self, removed, blocks):
+        """
+        Replaces the last `removed` blocks. If they are all in the active
+        log, only its end is rewritten. Otherwise the sealed segments from
+        the first affected one onward are written again under a new
+        generation (with the same boundaries), followed by the active log;
+        segments before it are kept as they are.
+        """
+        self.flush()
+        manifest = self.load_manifest()
+        segments = manifest['segments']
+        sealed = sealed_count(segments)
+        if self.active_blocks is None:
+            self.active_blocks = len(self.read_active())
+        start = sealed + self.active_blocks - removed
+        blocks = list(blocks)
+
+        if start >= sealed:
+            super().replace_suffix(removed, blocks)
+            self.active_blocks += len(blocks) - removed
+            if blocks:
+                self.last_index = blocks[-1]['index']
+            return
+
+        first = bisect.bisect_right([segment['start'] for segment in segments], start) - 1
+        first_start = segments[first]['start']
+        if start > first_start:
+            # Unchanged blocks at the start of the first affected segment
+            blocks = self.read_segment(segments[first])[:start - first_start] + blocks
+        generation = manifest['generation'] + 1
+        resealed = min(sealed - first_start, len(blocks) // self.segment_size * self.segment_size)
+        new_segments = list(segments[:first])
+        for offset in range(0, resealed, self.segment_size):
+            new_segments.append(self.write_segment(generation, first_start + offset,
+                                                   blocks[offset:offset + self.segment_size]))
+
+        self.save_manifest({"version": MANIFEST_VERSION, "generation": generation, "segments": new_segments})
+        JsonLinesStorage.write_all(self, blocks[resealed:])
+        self.remove_old_generations(generation - 1)
+
+        self.read_inode = self.active_inode()
+        self.read_sealed = sealed_count(new_segments)
+        self.last_index = blocks[-1]['index'] if blocks else None
+        self.active_blocks = len(blocks) - resealed
+
+    def remove_old_generations(self, oldest_kept):
+        """
+        Deletes segment files from generations before 'oldest_kept'
+        that the manifest no longer lists.
+        """
+        try:
+            names = os.listdir(self.segment_dir)
+        except OSError:
+            return
+        listed = {segment['file'] for segment in self.sealed_segments()}
+        for name in names:
+            parts = name.split('-')
+            if name in listed:
+                continue
+            if name.startswith("segment-") and len(parts) == 3 and parts[1].isdigit() and int(parts[1]) < oldest_kept:
+                try:
+                    os.remove(os.path.join(self.segment_dir, name))
+                except OSError:
+                    pass
+
+    def seal_if_due(self):
+        """
+        Seals full segments once the active log holds at least two
+        segments' worth of blocks, so the newest segment_size blocks or
+        more always stay in the active log. Callers hold the storage lock.
+        """
+        # The blocks are already stored by now, so a failure here must not
+        # fail the append
+        try:
+            if self.active_blocks is None:
+                self.active_blocks = len(self.read_active())
+            if self.active_blocks < 2 * self.segment_size:
+                return
+            self.seal()
+        except (OSError, ValueError) as e:
+            logger.warning("Could not seal a segment of %s: %s", self.path, e)
+
+    def seal(self):
+        """
+        Moves the oldest blocks of the active log into sealed segments.
+        """
+        self.flush()
+        manifest = self.load_manifest()
+        segments = list(manifest['segments'])
+        active = self.read_active()
+        count = (len(active) - self.segment_size) // self.segment_size * self.segment_size
+        if count <= 0:
+            return
+        start = sealed_count(segments)
+        for offset in range(0, count, self.segment_size):
+            segments.append(self.write_segment(manifest['generation'], start + offset,
+                                               active[offset:offset + self.segment_size]))
+
+        # The manifest commits the seal; the active log is cut afterwards
+        self.save_manifest({"version": MANIFEST_VERSION, "generation": manifest['generation'], "segments": segments})
+        JsonLinesStorage.write_all(self, active[count:])
+        self.read_inode = self.active_inode()
+        self.read_sealed = sealed_count(segments)
+        self.active_blocks = len(active) - count
+
+    def signature(self):
+        active = super().signature()
+        manifest = self.load_manifest()
+        if active is None and not manifest['segments']:
+            return None
+        # The generation only changes on a rewrite, so a seal by another
+        # process still looks like an append (see Blockchain.sync_from_storage)
+        return (manifest['generation'], sealed_count(manifest['segments'])) + (active or (0, 0, 0))
+
+    def file_state(self):
+        active = JsonLinesStorage.signature(self)
+        if active is None:
+            return None
+        # Sealed segments are only checked against their checksums when
+        # read, and a snapshot stands in for reading them, so their own
+        # sizes and modification times are recorded too
+        digest = hashlib.sha256(str(self.load_manifest()['generation']).encode())
+        for segment in self.sealed_segments():
+            try:
+                stat = os.stat(os.path.join(self.segment_dir, segment['file']))
+            except OSError:
+                return None
+            digest.update(f"{segment['file']}:{segment['sha256']}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        return active + (digest.digest(),)
+
+    def size(self):
+        total = super().size()
+        for segment in self.sealed_segments():
+            try:
+                total += os.path.getsize(os.path.join(self.segment_dir, segment['file']))
+            except OSError:
+                pass
+        return total
+
+    def position(self):
+        if self.valid_length is None:
+            return None
+        return (self.read_sealed << OFFSET_BITS) | self.valid_length
+
+    def resume(self, position):
+        sealed = position >> OFFSET_BITS
+        if sealed != self.sealed_block_count():
+            return None
+        block = super().resume(position & ((1 << OFFSET_BITS) - 1))
+        if block is None:
+            return None
+        self.read_inode = self.active_inode()
+        self.read_sealed = sealed
+        self.last_index = block.get('index')
+        self.active_blocks = None
+        return block
+
+class SegmentedChain:
+    """
+    The block list of a chain with sealed segments. Behaves like the
+    plain list Blockchain normally uses (len, indexing, slicing, iteration,
+    append). Blocks of sealed segments are loaded from storage when they
+    are used, and only the most recently used segments stay in memory.
+    """
+
+    def __init__(self, storage, block_type, cached_segments=4):
+        self.storage = storage
+        self.block_type = block_type
+        self.cached_segments = cached_segments
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        # (sealed segments, their start positions, sealed block count,
+        # resident tail). Swapped as a whole, so lock-free readers always
+        # see a consistent view.
+        self.state = self.make_state(list(storage.sealed_segments()), [])
+
+    @staticmethod
+    def make_state(segments, tail):
+        return (segments, [segment['start'] for segment in segments], sealed_count(segments), tail)
+
+    def __len__(self):
+        _, _, sealed, tail = self.state
+        return sealed + len(tail)
+
+    def __getitem__(self, position):
+        state = self.state
+        segments, starts, sealed, tail = state
+        length = sealed + len(tail)
+        if isinstance(position, slice):
+            return [self.block_at(i, state) for i in range(*position.indices(length))]
+        if position < 0:
+            position += length
+            if position < 0:
+                raise IndexError("chain index out of range")
+        return self.block_at(position, state)
+
+    def __iter__(self):
+        state = self.state
+        for position in range(state[2] + len(state[3])):
+            yield self.block_at(position, state)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def block_at(self, position, state):
+        segments, starts, sealed, tail = state
+        if position >= sealed:
+            return tail[position - sealed]
+        segment = segments[bisect.bisect_right(starts, position) - 1]
+        return self.load_segment(segment)[position - segment['start']]
+
+    def load_segment(self, segment):
+        """
+        Returns the blocks of a sealed segment, from the cache if possible.
+        """
+        key = segment['file']
+        with self.cache_lock:
+            blocks = self.cache.get(key)
+            if blocks is not None:
+                self.cache.move_to_end(key)
+                return blocks
+        blocks = [self.block_type.from_dict(block) for block in self.storage.read_segment(segment)]
+        with self.cache_lock:
+            self.cache[key] = blocks
+            while len(self.cache) > self.cached_segments:
+                self.cache.popitem(last=False)
+        return blocks
+
+    def __setitem__(self, position, block):
+        segments, starts, sealed, tail = self.state
+        if position >= sealed:
+            tail[position - sealed] = block
+            return
+        # Sealed blocks are only replaced by rewriting their segment in
+        # storage first; drop our cached copy so it is read back
+        segment = segments[bisect.bisect_right(starts, position) - 1]
+        with self.cache_lock:
+            self.cache.pop(segment['file'], None)
+
+    def append(self, block):
+        self.state[3].append(block)
+
+    def extend(self, blocks):
+        self.state[3].extend(blocks)
+
+    def truncate(self, length):
+        # Drops blocks appended in memory that storage didn't take; they
+        # are always still resident
+        _, _, sealed, tail = self.state
+        del tail[max(length - sealed, 0):]
+
+    def release_sealed(self):
+        """
+        Follows the segments currently in storage: drops resident blocks
+        that were sealed since, and switches to the new segment files
+        after a rewrite. Callers hold the chain's write lock.
+        """
+        state = self.state
+        segments, _, sealed, tail = state
+        new_segments = list(self.storage.sealed_segments())
+        if new_segments == segments:
+            return
+        new_sealed = sealed_count(new_segments)
+        # Blocks before the old sealed count come from the old segment
+        # files, which stay on disk until the next rewrite
+        new_tail = [self.block_at(position, state) for position in range(new_sealed, sealed + len(tail))]
+        self.state = self.make_state(new_segments, new_tail)
@@ -0,0 +1,370 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+"""
+File: snapshot.py
+Description: Binary snapshots of the chain for fast startup. A snapshot
+holds the block table, a sorted identity index and the validation
+watermark, and remembers how far into the storage log it goes. On startup
+the snapshot is memory-mapped instead of parsing the whole log: blocks are
+only decoded when they are used, identities are found by binary search in
+the mapped index, and only the blocks appended after the snapshot are read
+from the log.
+
+Layout (all integers little-endian):
+    header
+    block records       one per block, see RECORD below
+    block offsets       (block count + 1) 8-byte offsets of the records
+    identity index      sorted (32-byte key, 4-byte block position) entries
+"""
+
+MAGIC = b"IDVSNAP\x00"
+FORMAT_VERSION = 2
+# magic, version, block count, log position, log id, verified_upto,
+# verified_digest, hash of the last block, identity count,
+# offset of the block offsets, offset of the identity index,
+# and the storage's file state (see ChainStorage.file_state): inode,
+# modification time and size of the log, digest of the other files
+HEADER = struct.Struct("<8sIQQQQ64s64sQQQQQQ32s")
+# index, version, number of identities (NO_IDENTITIES for a normal block),
+# followed by the length-prefixed strings: timestamp, data,
+# previous_hash, hash and then each identity
+RECORD = struct.Struct("<qHI")
+LENGTH = struct.Struct("<I")
+INDEX_ENTRY = struct.Struct("<32sI")
+NO_IDENTITIES = 0xFFFFFFFF
+
+def identity_key(identity_hash):
+    """
+    Returns the 32-byte key an identity is stored under in the index.
+    Identity hashes are SHA-256 hex digests, so their own bytes are used;
+    anything else is hashed first.
+    """
+    identity_hash = str(identity_hash)
+    if len(identity_hash) == 64:
+        try:
+            key = bytes.fromhex(identity_hash)
+            if key.hex() == identity_hash:
+                return key
+        except ValueError:
+            pass
+    return hashlib.sha256(b"key:" + identity_hash.encode('utf-8')).digest()
+
+def encode_string(value):
+    """
+    Encodes one block field as a length-prefixed UTF-8 string.
+    """
+    if not isinstance(value, str):
+        raise ValueError(f"Cannot store {type(value).__name__} value {value!r} in a snapshot")
+    encoded = value.encode('utf-8')
+    return LENGTH.pack(len(encoded)) + encoded
+
+def encode_block(block):
+    """
+    Encodes one block as a snapshot record.
+    """
+    identities = block['identities'] if 'identities' in block else None
+    if not isinstance(block['index'], int) or not isinstance(block['version'], int):
+        raise ValueError(f"Cannot store block {block['index']!r} in a snapshot")
+    parts = [RECORD.pack(block['index'], block['version'],
+                         NO_IDENTITIES if identities is None else len(identities))]
+    for field in ('timestamp', 'data', 'previous_hash', 'hash'):
+        parts.append(encode_string(block[field]))
+    for identity_hash in identities or ():
+        parts.append(encode_string(identity_hash))
+    return b"".join(parts)
+
+def write_snapshot(path, chain, log_position, log_id, verified_upto, verified_digest, file_state):
+    """
+    Writes a snapshot of the chain (temp file + rename, so a crash never
+    leaves a half-written snapshot behind).
+
+    Args:
+        path (str): The snapshot file.
+        chain (list): The blocks to store, in chain order.
+        log_position (int): Storage position just after the last block.
+        log_id (int): Identifies the storage file (its inode), so a
+            snapshot of a rewritten log is never used.
+        verified_upto (int): Validation watermark to store.
+        verified_digest (str): Hash of the last verified block.
+        file_state (tuple): The storage's file_state() when the chain
+            was read.
+
+    Raises:
+        ValueError: If a block can't be stored (e.g. a tampered field of
+                    the wrong type).
+    """
+    temp_path = path + ".tmp"
+    try:
+        write_snapshot_file(temp_path, chain, log_position, log_id, verified_upto, verified_digest, file_state)
+    except BaseException:
+        # Don't leave a half-written snapshot behind
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+
+def write_snapshot_file(temp_path, chain, log_position, log_id, verified_upto, verified_digest, file_state):
+    """
+    Writes the snapshot contents to a file (see write_snapshot).
+    """
+    offsets = array('Q')
+    # Same rule as Blockchain.rebuild_index: the last block wins
+    keys = {}
+    with open(temp_path, 'wb') as f:
+        f.write(bytes(HEADER.size))
+        offset = HEADER.size
+        for position, block in enumerate(chain):
+            record = encode_block(block)
+            offsets.append(offset)
+            f.write(record)
+            offset += len(record)
+            if position > 0:
+                for identity_hash in (block['identities'] if 'identities' in block else [block['data']]):
+                    keys[identity_key(identity_hash)] = position
+        offsets.append(offset)
+
+        offsets_start = offset
+        f.write(offsets.tobytes())
+        index_start = offsets_start + len(offsets) * offsets.itemsize
+        f.write(b"".join(INDEX_ENTRY.pack(key, keys[key]) for key in sorted(keys)))
+
+        last_hash = chain[-1]['hash'] if len(chain) else ""
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(chain), log_position, log_id,
+                            verified_upto, (verified_digest or "").encode(), last_hash.encode(),
+                            len(keys), offsets_start, index_start, *file_state))
+        f.flush()
+        os.fsync(f.fileno())
+
+class Snapshot:
+    """
+    A snapshot file, memory-mapped for reading.
+    """
+
+    def __init__(self, path, mapped):
+        """
+        Use open_snapshot() instead.
+        """
+        self.path = path
+        self.mapped = mapped
+        (_, _, self.block_count, self.log_position, self.log_id, self.verified_upto,
+         verified_digest, last_hash, self.identity_count,
+         self.offsets_start, self.index_start, *file_state) = HEADER.unpack_from(mapped, 0)
+        self.file_state = tuple(file_state)
+        self.verified_digest = verified_digest.rstrip(b"\x00").decode() or None
+        self.last_hash = last_hash.rstrip(b"\x00").decode()
+        self.offsets = memoryview(mapped)[self.offsets_start:self.index_start].cast('Q')
+
+    def read_fields(self, position):
+        """
+        Decodes the record of one block.
+
+        Returns:
+            tuple: (index, version, timestamp, data, previous_hash, hash,
+                    identities or None)
+        """
+        mapped = self.mapped
+        offset = self.offsets[position]
+        index, version, identity_count = RECORD.unpack_from(mapped, offset)
+        offset += RECORD.size
+        strings = []
+        for _ in range(4 + (0 if identity_count == NO_IDENTITIES else identity_count)):
+            length = LENGTH.unpack_from(mapped, offset)[0]
+            offset += LENGTH.size
+            strings.append(mapped[offset:offset + length].decode('utf-8'))
+            offset += length
+        identities = None if identity_count == NO_IDENTITIES else strings[4:]
+        return (index, version) + tuple(strings[:4]) + (identities,)
+
+    def read_block(self, position, block_type):
+        """
+        Decodes one block into a block_type (blockchain.Block) object.
+        """
+        index, version, timestamp, data, previous_hash, block_hash, identities = self.read_fields(position)
+        return block_type(index, timestamp, data, previous_hash, block_hash, identities, version)
+
+    def find_identity(self, identity_hash):
+        """
+        Binary search in the mapped identity index.
+
+        Returns:
+            int: Position of the owning block, or None if not found.
+        """
+        key = identity_key(identity_hash)
+        mapped = self.mapped
+        low, high = 0, self.identity_count
+        while low < high:
+            middle = (low + high) // 2
+            start = self.index_start + middle * INDEX_ENTRY.size
+            probe = mapped[start:start + 32]
+            if probe < key:
+                low = middle + 1
+            elif probe > key:
+                high = middle
+            else:
+                return INDEX_ENTRY.unpack_from(mapped, start)[1]
+        return None
+
+def open_snapshot(path):
+    """
+    Memory-maps a snapshot file.
+
+    Returns:
+        Snapshot: The snapshot, or None if the file is missing or
+                  not a valid snapshot.
+    """
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(mapped) < HEADER.size:
+        mapped.close()
+        return None
+    header = HEADER.unpack_from(mapped, 0)
+    block_count, offsets_start, index_start = header[2], header[9], header[10]
+    if (header[0] != MAGIC or header[1] != FORMAT_VERSION or block_count == 0
+            or index_start != offsets_start + (block_count + 1) * 8
+            or len(mapped) != index_start + header[8] * INDEX_ENTRY.size):
+        mapped.close()
+        return None
+    return Snapshot(path, mapped)
+
+class SnapshotChain:
+    """
+    The block list of a chain loaded from a snapshot. Behaves like the
+    plain list Blockchain normally uses (len, indexing, slicing, iteration,
+    append), but blocks from the snapshot are only decoded when they are
+    used, and only the most recently used ones stay in memory. Appended
+    blocks are kept in an ordinary list.
+    """
+
+    def __init__(self, snapshot, block_type, cached_blocks=40000):
+        self.snapshot = snapshot
+        self.block_type = block_type
+        self.base_length = snapshot.block_count
+        self.cached_blocks = cached_blocks
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        # Snapshot blocks replaced since (see Blockchain.repair_chain);
+        # never evicted, and only ever a handful
+        self.replaced = {}
+        self.tail = []
+
+    def __len__(self):
+        return self.base_length + len(self.tail)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+            if position < 0:
+                raise IndexError("chain index out of range")
+        if position >= self.base_length:
+            return self.tail[position - self.base_length]
+        return self.block_at(position)
+
+    def block_at(self, position):
+        """
+        Returns a snapshot block, from the cache if possible.
+        """
+        block = self.replaced.get(position)
+        if block is not None:
+            return block
+        with self.cache_lock:
+            block = self.cache.get(position)
+            if block is not None:
+                self.cache.move_to_end(position)
+                return block
+        block = self.snapshot.read_block(position, self.block_type)
+        with self.cache_lock:
+            self.cache[position] = block
+            while len(self.cache) > self.cached_blocks:
+                self.cache.popitem(last=False)
+        return block
+
+    def __iter__(self):
+        # Walking the whole chain (e.g. to save it) shouldn't push every
+        # other block out of the cache, so this bypasses it
+        for position in range(len(self)):
+            if position < self.base_length and position not in self.replaced:
+                yield self.snapshot.read_block(position, self.block_type)
+            else:
+                yield self[position]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __setitem__(self, position, block):
+        # Replaced blocks (see Blockchain.repair_chain) shadow the snapshot
+        if position >= self.base_length:
+            self.tail[position - self.base_length] = block
+            return
+        self.replaced[position] = block
+        with self.cache_lock:
+            self.cache.pop(position, None)
+
+    def append(self, block):
+        self.tail.append(block)
+
+    def truncate(self, length):
+        # Drops blocks appended in memory that storage didn't take
+        del self.tail[max(length - self.base_length, 0):]
+
+class SnapshotIndex:
+    """
+    The identity index of a chain loaded from a snapshot. Lookups go to
+    the mapped index of the snapshot; identities added (or removed)
+    since live in a normal dict on top of it.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.added = {}
+        # Identities currently in the index. An identity can be set again
+        # or removed after it was added, so len(added) isn't the change.
+        self.count = snapshot.identity_count
+
+    def get(self, identity_hash, default=None):
+        if identity_hash in self.added:
+            # None marks an identity removed since the snapshot
+            position = self.added[identity_hash]
+        else:
+            position = self.snapshot.find_identity(identity_hash)
+        return default if position is None else position
+
+    def __contains__(self, identity_hash):
+        return self.get(identity_hash) is not None
+
+    def __setitem__(self, identity_hash, position):
+        if identity_hash not in self:
+            self.count += 1
+        self.added[identity_hash] = position
+
+    def __delitem__(self, identity_hash):
+        if identity_hash not in self:
+            raise KeyError(identity_hash)
+        self.count -= 1
+        self.added[identity_hash] = None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # The mapped index only holds keys, so the identities
+        # are read back from the block records
+        snapshot = self.snapshot
+        added = self.added
+        for position in range(1, snapshot.block_count):
+            _, _, _, data, _, _, identities = snapshot.read_fields(position)
+            # Identities moved or removed since come from `added`
+            yield from (identity_hash for identity_hash in (identities if identities is not None else [data])
+                        if identity_hash not in added)
+        yield from (identity_hash for identity_hash, position in self.added.items() if position is not None)
@@ -0,0 +1,561 @@
+import atexit
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+# Cross-process file locking: fcntl on Unix, msvcrt on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+"""
+File: storage.py
+Description: Storage backends for the blockchain. The Blockchain class
+talks to a backend through a small interface (load, append, rewrite),
+so the on-disk format can be swapped without touching the chain logic.
+The default backend is an append-only JSON-lines log: adding a block
+writes one line instead of rewriting the whole file.
+"""
+
+logger = logging.getLogger(__name__)
+
+def to_json_value(value):
+    """
+    json.dumps hook: stores objects that know their own dict form
+    (such as blockchain.Block) as that dict.
+    """
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class ChainStorage:
+    """
+    Interface every storage backend implements.
+    """
+
+    def exists(self):
+        """
+        Returns True if the backend already holds a stored chain.
+        """
+        raise NotImplementedError
+
+    def iter_blocks(self):
+        """
+        Yields the stored blocks in chain order, one at a time.
+        """
+        raise NotImplementedError
+
+    def append(self, blocks):
+        """
+        Appends new blocks to the end of the stored chain.
+
+        Args:
+            blocks (list): The blocks to append, in chain order.
+        """
+        raise NotImplementedError
+
+    def write_all(self, blocks):
+        """
+        Replaces the stored chain with the given blocks.
+
+        Args:
+            blocks (list): The complete chain.
+        """
+        raise NotImplementedError
+
+    def replace_suffix(self, removed, blocks):
+        """
+        Replaces the last `removed` stored blocks with new ones (used to
+        repair a damaged end of the chain). Backends that can't do better
+        rewrite the whole chain.
+
+        Args:
+            removed (int): Number of blocks to replace, counted from the end.
+            blocks (list): The blocks that take their place, in chain order.
+        """
+        stored = list(self.iter_blocks())
+        self.write_all(stored[:len(stored) - removed] + list(blocks))
+
+    def iter_new_blocks(self):
+        """
+        Yields only the blocks stored after the last read or write made
+        through this object (e.g. blocks appended by another process).
+        """
+        raise NotImplementedError
+
+    def tail_is_aligned(self):
+        """
+        Returns True if iter_new_blocks can safely continue from the last
+        read position. Backends that can't tell return False, which makes
+        the chain reload in full.
+        """
+        return False
+
+    def size(self):
+        """
+        Returns the size of the stored data in bytes.
+        """
+        return 0
+
+    def sealed_segments(self):
+        """
+        Returns the descriptors of the sealed (archived) segments, oldest
+        first. Backends without segments have none.
+        """
+        return []
+
+    def sealed_block_count(self):
+        """
+        Returns the number of blocks held in sealed segments.
+        """
+        return 0
+
+    def read_segment(self, segment, verify=True):
+        """
+        Returns the blocks of one sealed segment.
+
+        Args:
+            segment (dict): The segment, as listed by sealed_segments().
+            verify (bool): Check the segment against its checksum.
+        """
+        raise NotImplementedError
+
+    def iter_tail_blocks(self):
+        """
+        Yields the blocks that are not in a sealed segment (all of
+        them for backends without segments).
+        """
+        return self.iter_blocks()
+
+    def position(self):
+        """
+        Returns where the last block read or written through this object
+        ends, in a form resume() accepts later (e.g. from a snapshot), or
+        None if the backend can't resume reading.
+        """
+        return None
+
+    def resume(self, position):
+        """
+        Continues reading at a position returned by position() earlier,
+        so iter_new_blocks only yields the blocks stored after it.
+
+        Returns:
+            dict: The block stored just before the position, or None if
+                  the position is no longer valid (nothing is changed).
+        """
+        return None
+
+    def flush(self):
+        """
+        Forces any buffered writes onto the disk.
+        """
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds an exclusive lock on the stored chain, shared between
+        processes, for the duration of the with-block.
+        """
+        yield
+
+    def signature(self):
+        """
+        Returns a cheap fingerprint of the stored data that changes
+        whenever the data is modified, or None if nothing is stored.
+        """
+        raise NotImplementedError
+
+    def file_state(self):
+        """
+        Returns what a snapshot records about the stored files, to notice
+        later whether they were edited (e.g. while no server was running):
+        (inode, modification time in ns and size of the log, digest of
+        any other stored files), or None if the backend can't tell.
+        """
+        return None
+
+
+class JsonLinesStorage(ChainStorage):
+    """
+    Append-only log with one JSON-encoded block per line.
+
+    - Appends are O(1): the new blocks are written at the end of the file.
+    - fsync is batched: the file is synced to disk every `sync_every`
+      append calls (and on exit), instead of on every single block.
+    - Rewrites (compaction) go through a temporary file that is renamed
+      over the log, so a crash never leaves a half-written log behind.
+    - A crash in the middle of an append can only tear the last line.
+      The reader stops at that line and the next append cuts it off.
+    - Repairs replace only the end of the log. The new lines are saved
+      to a journal file first, so a crash halfway is finished on the
+      next start instead of losing blocks.
+    """
+
+    def __init__(self, path="blockchain.jsonl", sync_every=16):
+        """
+        Constructor for the log storage.
+
+        Args:
+            path (str): The log file.
+            sync_every (int): Number of append calls between fsyncs.
+        """
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self.unsynced_appends = 0
+        # Byte offset just after the last complete line we have read.
+        # Anything after it is a torn write and gets truncated.
+        self.valid_length = None
+        self.log_file = None
+        # Cross-process lock file and how deeply we currently hold it
+        self.lock_path = path + ".lock"
+        self.lock_file = None
+        self.lock_depth = 0
+        # Pending repair (see replace_suffix)
+        self.journal_path = path + ".journal"
+        atexit.register(self.flush)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def iter_blocks(self):
+        """
+        Streams the blocks from the log line by line, so the file
+        never has to be held in memory as one big string.
+        """
+        self.recover_journal()
+        self.valid_length = 0
+        return self.read_lines(warn=True)
+
+    def iter_new_blocks(self):
+        """
+        Streams the blocks after the last complete line we have read or
+        written. An incomplete last line may be another process still
+        writing, so it is left alone.
+        """
+        if self.valid_length is None:
+            return self.iter_blocks()
+        return self.read_lines(warn=False)
+
+    def tail_is_aligned(self):
+        """
+        Returns True if the file still has a line break just before the
+        point we have read up to. If not, the file was rewritten or edited
+        and reading on from our offset would give garbage.
+        """
+        if not self.valid_length:
+            return True
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.valid_length - 1)
+                return f.read(1) == b'\n'
+        except OSError:
+            return False
+
+    def position(self):
+        return self.valid_length
+
+    def resume(self, position):
+        """
+        Seeks back from the byte offset to the start of the line that
+        ends there, so the block before it can be checked without
+        reading the log from the start.
+        """
+        if not position:
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(position - 1)
+                if f.read(1) != b'\n':
+                    return None
+                start = position - 1
+                while start > 0:
+                    step = min(start, 65536)
+                    f.seek(start - step)
+                    newline = f.read(step).rfind(b'\n')
+                    if newline != -1:
+                        start = start - step + newline + 1
+                        break
+                    start -= step
+                f.seek(start)
+                block = json.loads(f.read(position - start))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(block, dict):
+            return None
+        self.valid_length = position
+        return block
+
+    def read_lines(self, warn):
+        """
+        Reads blocks starting at self.valid_length, advancing it past
+        every complete line.
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(self.valid_length)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    if warn:
+                        logger.warning("Ignoring incomplete last entry in %s.", self.path)
+                    break
+                if not line.strip():
+                    self.valid_length += len(line)
+                    continue
+                try:
+                    block = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Ignoring unreadable entry at byte %d of %s.", self.valid_length, self.path)
+                    break
+                self.valid_length += len(line)
+                yield block
+
+    def append(self, blocks):
+        if not blocks:
+            return
+        log_file = self.open_log()
+        lines = [json.dumps(block, separators=(',', ':'), default=to_json_value) + '\n' for block in blocks]
+        # One write call for the whole batch
+        data = ''.join(lines).encode()
+        # Appends run under locked(), so this is where the batch starts
+        start = os.fstat(log_file.fileno()).st_size
+        try:
+            log_file.write(data)
+            log_file.flush()
+            self.unsynced_appends += 1
+            if self.unsynced_appends >= self.sync_every:
+                self.flush()
+        except OSError:
+            # All or nothing: a batch that didn't fully reach the disk
+            # (e.g. disk full) must not leave some of its blocks behind
+            self.discard_from(start)
+            raise
+        if self.valid_length is not None:
+            self.valid_length += len(data)
+
+    def discard_from(self, offset):
+        """
+        Cuts the log back to a byte offset after a failed append. If that
+        fails too, the next open_log cuts it back to valid_length.
+        """
+        log_file, self.log_file = self.log_file, None
+        self.unsynced_appends = 0
+        try:
+            log_file.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(self.path, offset)
+        except OSError:
+            pass
+
+    def write_all(self, blocks):
+        self.close()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            for block in blocks:
+                f.write((json.dumps(block, separators=(',', ':'), default=to_json_value) + '\n').encode())
+            f.flush()
+            os.fsync(f.fileno())
+        # Atomically swap the new log in place of the old one
+        os.replace(temp_path, self.path)
+        self.sync_directory()
+        self.valid_length = os.path.getsize(self.path)
+
+    def replace_suffix(self, removed, blocks):
+        """
+        Cuts the last `removed` blocks off the log and appends the new
+        ones in their place. The log is searched backwards for where the
+        removed blocks start, so the cost depends on the size of the
+        replaced part only.
+        """
+        self.close()
+        self.recover_journal()
+        offset = self.offset_of_last_blocks(removed)
+        data = ''.join(json.dumps(block, separators=(',', ':'), default=to_json_value) + '\n'
+                       for block in blocks)
+
+        # Save what is about to be done, then do it
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({"offset": offset, "data": data}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.journal_path)
+        self.sync_directory()
+        self.recover_journal()
+
+    def recover_journal(self):
+        """
+        Applies a saved repair to the log: truncates it at the recorded
+        offset and writes the new lines. Running it twice gives the same
+        log, so a repair interrupted by a crash is simply redone.
+        """
+        try:
+            with open(self.journal_path, 'r') as f:
+                journal = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable repair journal %s: %s", self.journal_path, e)
+            return
+        self.close()
+        with open(self.path, 'r+b') as f:
+            f.truncate(journal['offset'])
+            f.seek(journal['offset'])
+            f.write(journal['data'].encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.remove(self.journal_path)
+        self.valid_length = os.path.getsize(self.path)
+
+    def offset_of_last_blocks(self, count):
+        """
+        Returns the byte offset at which the last `count` blocks of the
+        log start (blank lines are not blocks).
+
+        Raises:
+            ValueError: If the log holds fewer blocks.
+        """
+        end = self.valid_length if self.valid_length is not None else os.path.getsize(self.path)
+        line_end = end
+        # The part of the file read so far, from data_start up to end
+        data, data_start = b"", end
+        with open(self.path, 'rb') as f:
+            while count > 0:
+                if line_end == 0:
+                    raise ValueError(f"{self.path} holds fewer blocks than expected")
+                # The line break before this line (its own is at line_end - 1)
+                newline = data.rfind(b'\n', 0, max(0, line_end - 1 - data_start))
+                while newline == -1 and data_start > 0:
+                    step = min(data_start, 65536)
+                    f.seek(data_start - step)
+                    data = f.read(step) + data
+                    data_start -= step
+                    newline = data.rfind(b'\n', 0, line_end - 1 - data_start)
+                line_start = data_start + newline + 1
+                if data[line_start - data_start:line_end - data_start].strip():
+                    count -= 1
+                line_end = line_start
+        return line_end
+
+    def flush(self):
+        if self.log_file and self.unsynced_appends:
+            os.fsync(self.log_file.fileno())
+        self.unsynced_appends = 0
+
+    def close(self):
+        """
+        Syncs and closes the append handle, if one is open.
+        """
+        if self.log_file:
+            self.flush()
+            self.log_file.close()
+            self.log_file = None
+
+    @contextmanager
+    def locked(self):
+        """
+        Takes an exclusive lock on '<log>.lock' so that only one process
+        at a time appends to or rewrites the log. Nested use within one
+        process is allowed (the caller must serialise its own threads).
+        """
+        if self.lock_depth == 0:
+            self.lock_file = open(self.lock_path, 'a+b')
+            if fcntl:
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+            elif msvcrt:
+                self.lock_file.seek(0)
+                msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            # Finish a repair another process didn't get to complete
+            # before anyone writes to the log again
+            self.recover_journal()
+        self.lock_depth += 1
+        try:
+            yield
+        finally:
+            self.lock_depth -= 1
+            if self.lock_depth == 0:
+                if fcntl:
+                    fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+                elif msvcrt:
+                    self.lock_file.seek(0)
+                    msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                self.lock_file.close()
+                self.lock_file = None
+
+    def signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        # The inode changes when the log is replaced by a rewrite
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def file_state(self):
+        signature = JsonLinesStorage.signature(self)
+        return None if signature is None else signature + (bytes(32),)
+
+    def size(self):
+        """
+        Returns the current size of the log in bytes (0 if missing).
+        """
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def open_log(self):
+        """
+        Returns the append handle, opening it on first use or when the
+        log file was replaced. A torn last line left over from a crash
+        is cut off first.
+        """
+        if self.log_file is not None:
+            if (not os.path.exists(self.path)
+                    or os.fstat(self.log_file.fileno()).st_ino != os.stat(self.path).st_ino):
+                # Another process replaced the log (a rewrite); follow it
+                self.close()
+        if self.log_file is None:
+            if self.valid_length is not None and os.path.exists(self.path):
+                if os.path.getsize(self.path) > self.valid_length:
+                    with open(self.path, 'r+b') as f:
+                        f.truncate(self.valid_length)
+            self.log_file = open(self.path, 'ab')
+        return self.log_file
+
+    def sync_directory(self, directory=None):
+        """
+        Syncs the directory entry so a rename survives a power loss.
+        """
+        directory = directory or os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def read_legacy_json(path):
+    """
+    Reads a chain saved in the old single-document format
+    (the whole chain as one JSON list in blockchain.json).
+
+    Args:
+        path (str): The legacy JSON file.
+
+    Returns:
+        list: The blocks stored in the file.
+    """
+    with open(path, 'r') as f:
+        return json.load(f)
@@ -0,0 +1,67 @@
+import os
+import sys
+import pytest
+
+"""
+File: conftest.py
+Description: Shared pytest setup. The modules live one directory up and
+are imported by name, like the scripts next to them do.
+"""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Real password hashing would make every login in the tests take 0.1 s
+os.environ.setdefault("IDV_PBKDF2_ITERATIONS", "1000")
+
+def pytest_configure(config):
+    # Multi-process checks; skip them with -m "not slow"
+    config.addinivalue_line("markers", "slow: starts several processes or servers")
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs the test in an empty directory, so data files (blockchain.jsonl,
+    users.db, ...) never touch the real ones.
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    """
+    A fresh import of app.py (and so a fresh chain and user database) in
+    an empty directory, shared by the tests of one module.
+    """
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    sys.modules.pop('app', None)
+    try:
+        import app
+        yield app
+        app.chain_writer.stop()
+        app.my_blockchain.close()
+    finally:
+        sys.modules.pop('app', None)
+        os.chdir(cwd)
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+@pytest.fixture
+def add_pending():
+    """
+    Returns a function that creates users with a pending application
+    each: add_pending(users, count, prefix) -> their usernames, in queue
+    order.
+    """
+    from hasher import hash_data
+
+    def add(users, count, prefix="user"):
+        usernames = []
+        for n in range(count):
+            username = f"{prefix}{n}"
+            users.create(username, {"password": "x", "role": "user", "status": "pending",
+                                    "application_data": {"id_number": f"{n:012d}", "hash": hash_data(username)}})
+            usernames.append(username)
+        return usernames
+    return add
@@ -0,0 +1,133 @@
+import os
+
+"""
+File: test_app.py
+Description: Tests for the Flask routes in app.py.
+"""
+
+def auth(app_module, username, role):
+    return {"Authorization": f"Bearer {app_module.sessions.issue(username, role)}"}
+
+def test_get_pending_clamps_limit(app_module, client, add_pending):
+    add_pending(app_module.users, 1005, prefix="applicant")
+    admin = auth(app_module, "gov", "admin")
+
+    # 0 and negative limits return one application
+    for limit in (0, -1):
+        response = client.get(f"/get_pending?limit={limit}", headers=admin)
+        assert response.status_code == 200
+        assert len(response.get_json()) == 1
+        assert response.headers['X-Next-Cursor']
+
+    # No more than 1000 at a time
+    response = client.get("/get_pending?limit=5000", headers=admin)
+    assert len(response.get_json()) == 1000
+    rest = client.get(f"/get_pending?limit=1000&after={response.headers['X-Next-Cursor']}", headers=admin)
+    assert len(rest.get_json()) == 5
+    assert 'X-Next-Cursor' not in rest.headers
+
+def test_events_need_admin_session(app_module, client):
+    assert client.get("/events").status_code == 401
+    assert client.get("/events?token=forged.token").status_code == 401
+    assert client.get("/events", headers=auth(app_module, "someone", "user")).status_code == 403
+
+    # EventSource can only send the token in the URL
+    token = app_module.sessions.issue("gov", "admin")
+    response = client.get(f"/events?token={token}", buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    response.close()
+
+def test_events_mask_id_numbers(app_module, add_pending):
+    add_pending(app_module.users, 2, prefix="masked")
+    events = []
+    app_module.change_feed.collect(0, len(app_module.my_blockchain.blockchain), None, events)
+    applications = [event for event in events if "event: application" in event]
+    assert applications
+    assert not any("000000000001" in event for event in applications)
+    assert any('"id_number": "XXXX XXXX 0001"' in event for event in applications)
+
+def test_admin_routes_need_admin_session(app_module, client):
+    admin_routes = [("GET", "/get_pending"), ("POST", "/approve_request"), ("POST", "/approve_requests"),
+                    ("POST", "/repair"), ("POST", "/audit")]
+    for method, route in admin_routes:
+        assert client.open(route, method=method, json={}).status_code == 401
+        assert client.open(route, method=method, json={}, headers=auth(app_module, "someone", "user")).status_code == 403
+        # Only routes read by EventSource take the token in the URL
+        token = app_module.sessions.issue("gov", "admin")
+        assert client.open(f"{route}?token={token}", method=method, json={}).status_code == 401
+
+def test_login_returns_working_token(app_module, client):
+    response = client.post("/login", json={"username": "gov", "password": "secure_gov", "role": "admin"})
+    assert response.status_code == 200
+    token = response.get_json()['token']
+    assert client.get("/get_pending", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    assert client.post("/login", json={"username": "gov", "password": "wrong", "role": "admin"}).status_code == 401
+
+def test_audit_runs_one_at_a_time(app_module, client):
+    admin = auth(app_module, "gov", "admin")
+    response = client.post("/audit", headers=admin)
+    assert response.status_code == 200
+    assert response.get_json()['is_valid']
+
+    # As if another request's audit were still running
+    with app_module.audit_running:
+        assert client.post("/audit", headers=admin).status_code == 409
+    assert client.post("/audit", headers=admin).status_code == 200
+
+def test_approve_requests_validates_usernames(app_module, client, add_pending):
+    admin = auth(app_module, "gov", "admin")
+    for body in ({}, {"usernames": []}, {"usernames": "batch0"}, {"usernames": ["batch0", 7]}, ["batch0"]):
+        assert client.post("/approve_requests", json=body, headers=admin).status_code == 400
+    too_many = [f"batch{n}" for n in range(app_module.MAX_APPROVAL_BATCH + 1)]
+    assert client.post("/approve_requests", json={"usernames": too_many}, headers=admin).status_code == 413
+
+    usernames = add_pending(app_module.users, 3, prefix="batch")
+    response = client.post("/approve_requests", json={"usernames": usernames + ["nobody"]}, headers=admin)
+    assert response.status_code == 200
+    statuses = {result['username']: result['status'] for result in response.get_json()['results']}
+    assert statuses == {"batch0": "approved", "batch1": "approved", "batch2": "approved", "nobody": "not_found"}
+
+def test_approval_reports_failed_write(app_module, client, add_pending, monkeypatch):
+    [username] = add_pending(app_module.users, 1, prefix="diskfull")
+    app_module.my_blockchain.storage.sync_every = 1
+    length = len(app_module.my_blockchain.blockchain)
+
+    def fail(fd):
+        raise OSError(28, "No space left on device")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "fsync", fail)
+        response = client.post('/approve_request', json={"username": username},
+                               headers=auth(app_module, "admin", "admin"))
+    assert response.status_code == 503
+    assert app_module.users.get(username)['status'] == 'pending'
+    assert len(app_module.my_blockchain.blockchain) == length
+
+    response = client.post('/approve_request', json={"username": username},
+                           headers=auth(app_module, "admin", "admin"))
+    assert response.status_code == 200
+    assert app_module.users.get(username)['status'] == 'approved'
+
+def test_chain_data_pages_always_move_forward(app_module, client):
+    app_module.chain_writer.add_blocks([f"{n:064x}" for n in range(1, 6)])
+    length = len(app_module.my_blockchain.blockchain)
+
+    # Walking the chain with the smallest possible page ends
+    after, pages = 0, 0
+    while after is not None:
+        data = client.get(f"/chain_data?after={after}&limit=0").get_json()
+        assert len(data['chain']) == 1
+        after, pages = data['next_after'], pages + 1
+    assert pages == length
+
+def test_chain_data_etag_covers_the_request(app_module, client):
+    first = client.get("/chain_data?after=0&limit=2")
+    etag = first.headers['ETag']
+    assert client.get("/chain_data?after=0&limit=2", headers={"If-None-Match": etag}).status_code == 304
+
+    # Same chain, but a different page or format
+    for query in ("after=2&limit=2", "after=0&limit=3", "after=0&limit=2&format=jsonl"):
+        response = client.get(f"/chain_data?{query}", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
@@ -0,0 +1,84 @@
+import json
+import pytest
+import audit
+from blockchain import Block, Blockchain, calculate_hash
+from hasher import hash_data
+
+"""
+File: test_audit.py
+Description: Tests for the full-chain audit and the checks it shares
+with is_chain_valid.
+"""
+
+def tamper_log(line_number, **fields):
+    """
+    Overwrites fields of one block in blockchain.jsonl.
+    """
+    with open("blockchain.jsonl") as f:
+        lines = f.read().splitlines()
+    block = json.loads(lines[line_number])
+    block.update(fields)
+    lines[line_number] = json.dumps(block)
+    with open("blockchain.jsonl", "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+@pytest.fixture
+def stored_chain(workdir):
+    chain = Blockchain()
+    chain.add_blocks([hash_data(f"identity-{n}") for n in range(40)])
+    chain.close()
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_audit_reports_position_of_block_with_forged_index(stored_chain, monkeypatch, workers):
+    # Let two workers split even a small chain
+    monkeypatch.setattr(audit, "MIN_PARALLEL_BLOCKS", 0)
+    tamper_log(12, index=100000)
+    chain = Blockchain()
+    assert chain.audit_chain(workers=workers) == 13
+    assert chain.verified_upto == 12
+    assert chain.is_chain_valid(full=True) == 13
+    chain.close()
+
+def test_audit_passes_intact_chain(stored_chain):
+    chain = Blockchain()
+    assert chain.audit_chain(workers=1) == -1
+    assert chain.is_chain_valid() == -1
+    chain.close()
+
+def test_audit_finds_first_of_several_tampered_blocks(stored_chain):
+    tamper_log(30, data=hash_data("forged"))
+    tamper_log(7, previous_hash="0" * 64)
+    chain = Blockchain()
+    assert chain.audit_chain(workers=1) == 8
+    chain.close()
+
+def test_merkle_block_with_non_string_identity_is_tampered(workdir):
+    chain = Blockchain()
+    chain.add_blocks([hash_data(f"identity-{n}") for n in range(5)])
+    chain.add_blocks([hash_data(f"batch-{n}") for n in range(8)], merkle=True)
+    chain.close()
+    with open("blockchain.jsonl") as f:
+        identities = json.loads(f.read().splitlines()[6])['identities']
+    tamper_log(6, identities=identities[:3] + [12345] + identities[4:])
+
+    chain = Blockchain()
+    assert chain.is_chain_valid(full=True) == 7
+    assert chain.audit_chain(workers=1) == 7
+    # The list can't be re-hashed, so repair gives up instead of crashing
+    assert chain.repair_chain()["status"] == "failed"
+    chain.close()
+
+def test_fields_of_the_wrong_type_dont_hash():
+    block = Block(7, "2024-01-01 00:00:00", "123", "0" * 64)
+    assert calculate_hash(block)
+    for field, value in [("index", "7"), ("index", 7.0), ("index", True), ("data", 123), ("version", 2.0)]:
+        forged = Block.from_dict(dict(block.to_dict(), **{field: value}))
+        assert calculate_hash(forged) is None
+
+def test_block_with_float_index_is_tampered(stored_chain):
+    # 13.0 == 13, so only the type check catches it
+    tamper_log(12, index=13.0)
+    chain = Blockchain()
+    assert chain.is_chain_valid(full=True) == 13
+    assert chain.audit_chain(workers=1) == 13
+    chain.close()
@@ -0,0 +1,171 @@
+import json
+import os
+import pytest
+from blockchain import Block, Blockchain, calculate_hash
+from hasher import hash_data
+
+"""
+File: test_blockchain.py
+Description: Tests for the Blockchain class and its blocks.
+"""
+
+SINGLES = [hash_data(f"single-{n}") for n in range(10)]
+BATCH = [hash_data(f"batch-{n}") for n in range(8)]
+
+@pytest.fixture
+def chain(workdir):
+    chain = Blockchain()
+    chain.add_blocks(SINGLES)
+    chain.add_blocks(BATCH, merkle=True)
+    yield chain
+    chain.close()
+
+def test_index_finds_every_identity(chain):
+    for position, identity_hash in enumerate(SINGLES, start=1):
+        assert chain.verify_identity(identity_hash)
+        assert chain.find_identity(identity_hash)['data'] == identity_hash
+        assert chain.identity_index[identity_hash] == position
+    # All identities of a Merkle block map to that one block
+    merkle_block = chain.get_last_block()
+    for identity_hash in BATCH:
+        assert chain.verify_identity(identity_hash)
+        assert chain.find_identity(identity_hash) is merkle_block
+    assert len(chain.identity_index) == len(SINGLES) + len(BATCH)
+
+    assert not chain.verify_identity(hash_data("never-registered"))
+    assert chain.find_identity(hash_data("never-registered")) is None
+
+def test_duplicates_are_rejected(chain):
+    length = len(chain.blockchain)
+    assert chain.add_block(SINGLES[3]) is None
+    new = hash_data("new")
+    results = chain.add_blocks([BATCH[0], new, new])
+    assert [result['status'] for result in results] == ['duplicate', 'added', 'duplicate']
+    assert len(chain.blockchain) == length + 1
+    assert chain.identity_index[new] == length
+
+@pytest.mark.parametrize("with_snapshot", [False, True])
+def test_index_is_rebuilt_on_load(chain, with_snapshot):
+    index = dict(chain.identity_index)
+    if with_snapshot:
+        chain.save_snapshot()
+    chain.close()
+    assert os.path.exists("blockchain.snapshot") == with_snapshot
+
+    chain = Blockchain()
+    assert {identity_hash: chain.identity_index.get(identity_hash) for identity_hash in index} == index
+    assert len(chain.identity_index) == len(index)
+    assert chain.verify_identity(BATCH[-1])
+    assert not chain.verify_identity(hash_data("never-registered"))
+    chain.close()
+
+def count_hashing(chain, monkeypatch):
+    """
+    Counts the blocks the chain re-hashes from now on.
+    """
+    hashed = []
+    calculate_block_hash = chain.calculate_block_hash
+    def counting(block):
+        hashed.append(block['index'])
+        return calculate_block_hash(block)
+    monkeypatch.setattr(chain, "calculate_block_hash", counting)
+    return hashed
+
+def test_only_new_blocks_are_verified(chain, monkeypatch):
+    assert chain.is_chain_valid(full=True) == -1
+    length = len(chain.blockchain)
+    hashed = count_hashing(chain, monkeypatch)
+    assert chain.is_chain_valid() == -1
+    assert hashed == []
+
+    chain.add_blocks([hash_data("late-1"), hash_data("late-2")])
+    hashed.clear()
+    assert chain.is_chain_valid() == -1
+    assert hashed == [length + 1, length + 2]
+    assert chain.verified_upto == length + 2
+    assert chain.verified_digest == chain.get_last_block()['hash']
+
+def test_blocks_from_another_process_are_verified(chain, monkeypatch):
+    assert chain.is_chain_valid(full=True) == -1
+    length = len(chain.blockchain)
+    other = Blockchain()
+    other.add_block(hash_data("from-other"))
+    other.close()
+
+    hashed = count_hashing(chain, monkeypatch)
+    assert chain.is_chain_valid() == -1
+    assert hashed == [length + 1]
+    assert chain.verify_identity(hash_data("from-other"))
+
+def test_log_edited_underneath_is_reverified(chain):
+    assert chain.is_chain_valid(full=True) == -1
+    with open("blockchain.jsonl") as f:
+        lines = f.read().splitlines()
+    # Same length, so only the mtime gives the edit away
+    lines[3] = lines[3].replace(SINGLES[2], SINGLES[2][::-1])
+    with open("blockchain.jsonl", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.utime("blockchain.jsonl", ns=(0, os.stat("blockchain.jsonl").st_mtime_ns + 10**9))
+    assert chain.is_chain_valid() == 4
+
+def test_changed_verified_prefix_is_reverified(chain):
+    assert chain.is_chain_valid(full=True) == -1
+    length = len(chain.blockchain)
+    chain.blockchain[-1]['hash'] = "0" * 64
+    # Nothing new to check yet; the next block makes the check
+    # compare the prefix against its digest
+    chain.add_block(hash_data("late"))
+    assert chain.is_chain_valid() == length
+
+def old_block_hash(block):
+    """
+    The hash older versions stored: the block as sorted-key JSON, with
+    'hash' set to None.
+    """
+    return hash_data(json.dumps(dict(block, hash=None), sort_keys=True))
+
+def write_old_chain(count):
+    """
+    Writes a chain the way older versions did, to blockchain.json.
+    """
+    blocks = []
+    previous_hash = "0"
+    for n in range(count):
+        block = {"index": n + 1, "timestamp": f"2025-10-28 00:00:{n:02d}.000000",
+                 "data": "Genesis Block" if n == 0 else hash_data(f"old-{n}"),
+                 "previous_hash": previous_hash, "hash": None}
+        block["hash"] = previous_hash = old_block_hash(block)
+        blocks.append(block)
+    with open("blockchain.json", "w") as f:
+        json.dump(blocks, f, indent=4)
+    return blocks
+
+def test_old_chain_still_verifies(workdir):
+    old_blocks = write_old_chain(5)
+    chain = Blockchain()
+    assert chain.is_chain_valid(full=True) == -1
+    assert [block.to_dict() for block in chain.blockchain] == old_blocks
+    assert all(block['version'] == 1 for block in chain.blockchain)
+
+    # New blocks use the current encoding and link to the old ones
+    block = chain.add_block(hash_data("new"))
+    assert block['version'] == Block.CURRENT_VERSION
+    assert block['previous_hash'] == old_blocks[-1]['hash']
+    chain.close()
+
+    chain = Blockchain()
+    assert chain.is_chain_valid(full=True) == -1
+    assert len(chain.blockchain) == 6
+    chain.close()
+
+def test_old_block_hash_covers_its_fields():
+    old = {"index": 2, "timestamp": "2025-10-28 00:00:01.000000", "data": hash_data("old"),
+           "previous_hash": "0" * 64, "hash": None}
+    old["hash"] = old_block_hash(old)
+    block = Block.from_dict(old)
+    assert block['version'] == 1
+    assert calculate_hash(block) == old["hash"]
+    for field, value in [("data", hash_data("forged")), ("timestamp", "2025-10-29"), ("index", 3)]:
+        assert calculate_hash(Block.from_dict(dict(old, **{field: value}))) != old["hash"]
+    # The two encodings never give the same hash
+    assert calculate_hash(Block.from_dict(dict(old, version=2))) != old["hash"]
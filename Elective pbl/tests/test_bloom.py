@@ -0,0 +1,102 @@
+import pytest
+from blockchain import Blockchain
+from bloom import CLEAN_FLAG, CLEAN_FLAG_OFFSET, BloomFilter
+from hasher import hash_data
+
+"""
+File: test_bloom.py
+Description: Tests for the identity Bloom filter and how the chain
+keeps it in step.
+"""
+
+IDENTITIES = [hash_data(f"identity-{n}") for n in range(2000)]
+
+def test_no_false_negatives_and_few_false_positives(workdir):
+    bloom = BloomFilter.create("ids.bloom", 2000, 0.01)
+    for identity_hash in IDENTITIES:
+        bloom.add(identity_hash)
+    assert all(identity_hash in bloom for identity_hash in IDENTITIES)
+    false_positives = sum(hash_data(f"other-{n}") in bloom for n in range(20000))
+    assert false_positives < 20000 * 0.02
+    bloom.close()
+
+def test_filter_survives_reopening(workdir):
+    bloom = BloomFilter.create("ids.bloom", 100, 0.001)
+    for identity_hash in IDENTITIES[:50]:
+        bloom.add(identity_hash)
+    bloom.mark_covered(51, "a" * 64)
+    assert not bloom.clean
+    bloom.close()
+
+    bloom = BloomFilter.open("ids.bloom")
+    assert bloom.clean
+    assert (bloom.count, bloom.covered_blocks, bloom.last_hash) == (50, 51, "a" * 64)
+    assert all(identity_hash in bloom for identity_hash in IDENTITIES[:50])
+    bloom.close()
+
+    with open("ids.bloom", "r+b") as f:
+        f.write(b"NOTBLOOM")
+    assert BloomFilter.open("ids.bloom") is None
+    assert BloomFilter.open("missing.bloom") is None
+
+def count_rebuilds(monkeypatch):
+    rebuilds = []
+    rebuild_bloom = Blockchain.rebuild_bloom
+    def counting(chain):
+        rebuilds.append(len(chain.blockchain))
+        rebuild_bloom(chain)
+    monkeypatch.setattr(Blockchain, "rebuild_bloom", counting)
+    return rebuilds
+
+def test_chain_reuses_a_clean_filter(workdir, monkeypatch):
+    chain = Blockchain()
+    chain.add_blocks(IDENTITIES[:100])
+    chain.close()
+    # Added while the filter was closed; loading catches up
+    other = Blockchain()
+    other.bloom.close()
+    other.bloom = None
+    other.add_blocks(IDENTITIES[100:110])
+    other.close()
+
+    rebuilds = count_rebuilds(monkeypatch)
+    chain = Blockchain()
+    assert rebuilds == []
+    assert chain.bloom.covered_blocks == 111
+    assert all(chain.verify_identity(identity_hash) for identity_hash in IDENTITIES[:110])
+    chain.close()
+
+def test_chain_rebuilds_an_untrusted_filter(workdir, monkeypatch):
+    chain = Blockchain()
+    chain.add_blocks(IDENTITIES[:100])
+    chain.close()
+    # Left behind by a process that died while changing it
+    with open("blockchain.bloom", "r+b") as f:
+        f.seek(CLEAN_FLAG_OFFSET)
+        f.write(CLEAN_FLAG.pack(0))
+
+    rebuilds = count_rebuilds(monkeypatch)
+    chain = Blockchain()
+    assert rebuilds == [101]
+    assert all(chain.verify_identity(identity_hash) for identity_hash in IDENTITIES[:100])
+    chain.close()
+
+class RecordingIndex(dict):
+    def __init__(self, index):
+        super().__init__(index)
+        self.lookups = []
+
+    def __contains__(self, identity_hash):
+        self.lookups.append(identity_hash)
+        return super().__contains__(identity_hash)
+
+def test_negative_lookups_skip_the_index(workdir):
+    chain = Blockchain()
+    chain.add_blocks(IDENTITIES[:100])
+    chain.identity_index = index = RecordingIndex(chain.identity_index)
+    unknown = [hash_data(f"unknown-{n}") for n in range(1000)]
+    assert not any(chain.verify_identity(identity_hash) for identity_hash in unknown)
+    assert len(index.lookups) < 10
+    assert chain.verify_identity(IDENTITIES[0])
+    assert index.lookups[-1] == IDENTITIES[0]
+    chain.close()
@@ -0,0 +1,81 @@
+import os
+import pytest
+from blockchain import Blockchain
+from bulk_import import import_identities, load_checkpoint
+from hasher import hash_data
+
+"""
+File: test_bulk_import.py
+Description: Tests for bulk_import.import_identities.
+"""
+
+VALID = [f"{n:012d}" for n in range(100000000000, 100000000100)]
+
+@pytest.fixture
+def id_file(workdir):
+    # 100 valid IDs, a few invalid ones, a duplicate and a CSV column
+    lines = [f'"{id_number}",Some Name' for id_number in VALID[:50]]
+    lines += ["12345", "abcdefghijkl", "", VALID[0]]
+    lines += VALID[50:]
+    with open("ids.csv", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return "ids.csv"
+
+def interrupt_after(chain, monkeypatch, batches):
+    """
+    Makes the chain fail (like a crash) after a number of batches.
+    """
+    add_blocks = chain.add_blocks
+    calls = []
+    def failing(*args, **kwargs):
+        if len(calls) == batches:
+            raise KeyboardInterrupt
+        calls.append(args)
+        return add_blocks(*args, **kwargs)
+    monkeypatch.setattr(chain, "add_blocks", failing)
+
+def test_import_counts_every_line(id_file):
+    chain = Blockchain()
+    counts = import_identities(chain, id_file, batch_size=30)
+    assert counts == {'read': 103, 'invalid': 2, 'duplicate': 1, 'added': 100}
+    assert all(chain.verify_identity(hash_data(id_number)) for id_number in VALID)
+    assert not os.path.exists(id_file + ".checkpoint")
+    assert chain.is_chain_valid(full=True) == -1
+    chain.close()
+
+@pytest.mark.parametrize("merkle", [False, True])
+def test_interrupted_import_resumes(id_file, monkeypatch, merkle):
+    chain = Blockchain()
+    with monkeypatch.context() as patch:
+        interrupt_after(chain, patch, 2)
+        with pytest.raises(KeyboardInterrupt):
+            import_identities(chain, id_file, batch_size=30, merkle=merkle)
+    checkpoint = load_checkpoint(id_file + ".checkpoint")
+    assert checkpoint['counts']['added'] == 59
+    length = len(chain.blockchain)
+
+    # Every line counted once: the first batches weren't read again
+    counts = import_identities(chain, id_file, batch_size=30, merkle=merkle)
+    assert counts == {'read': 103, 'invalid': 2, 'duplicate': 1, 'added': 100}
+    assert len(chain.identity_index) == 100
+    assert len(chain.blockchain) == length + (2 if merkle else 41)
+    assert chain.is_chain_valid(full=True) == -1
+    chain.close()
+
+def test_checkpoint_of_another_file_is_ignored(id_file, monkeypatch):
+    chain = Blockchain()
+    with monkeypatch.context() as patch:
+        interrupt_after(chain, patch, 1)
+        with pytest.raises(KeyboardInterrupt):
+            import_identities(chain, id_file, batch_size=30, checkpoint_path="import.checkpoint")
+    with open("other.txt", "w") as f:
+        f.write("\n".join(VALID[:40]) + "\n")
+
+    # Starts from the top: 30 IDs are on the chain already
+    counts = import_identities(chain, "other.txt", batch_size=30, checkpoint_path="import.checkpoint")
+    assert counts == {'read': 40, 'invalid': 0, 'duplicate': 30, 'added': 10}
+
+    # restart=True ignores even a checkpoint of the same file
+    counts = import_identities(chain, "other.txt", restart=True)
+    assert counts == {'read': 40, 'invalid': 0, 'duplicate': 40, 'added': 0}
+    chain.close()
@@ -0,0 +1,50 @@
+import hashlib
+import pytest
+from hasher import hash_data, hash_file, hash_many
+
+"""
+File: test_hasher.py
+Description: Tests for the batch hashing API.
+"""
+
+IDS = [f"{n:012d}" for n in range(1, 10001, 7)]
+EXPECTED = [hash_data(id_number) for id_number in IDS]
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_hash_many_matches_hash_data_in_order(workers):
+    # Small chunks, so several are in flight at once
+    assert list(hash_many(IDS, workers=workers, chunk_size=100)) == EXPECTED
+    assert list(hash_many((id_number.encode() for id_number in IDS), workers=workers)) == EXPECTED
+    assert list(hash_many([123456789012, 999999999999], workers=workers)) == [
+        hash_data("123456789012"), hash_data("999999999999")]
+
+def test_hash_many_splits_buffers_into_records():
+    buffer = "".join(IDS).encode()
+    assert list(hash_many(buffer, width=12)) == EXPECTED
+    assert list(hash_many(bytearray(buffer), width=12, raw=True)) == [bytes.fromhex(h) for h in EXPECTED]
+    # NUL-padded records, like a NumPy 'S16' array
+    padded = b"".join(id_number.encode().ljust(16, b"\x00") for id_number in IDS[:5])
+    assert list(hash_many(padded, width=16)) == EXPECTED[:5]
+
+def test_hash_many_rejects_unusable_input():
+    with pytest.raises(TypeError):
+        list(hash_many("123456789012"))
+    with pytest.raises(ValueError):
+        list(hash_many(b"123456789012"))
+    with pytest.raises(ValueError):
+        list(hash_many(b"1234567890123", width=12))
+
+def test_hash_file(tmp_path):
+    lines = tmp_path / "ids.txt"
+    lines.write_text("\n".join(IDS[:50]) + "\n\n")
+    assert list(hash_file(str(lines))) == EXPECTED[:50]
+
+    # Fixed-width records, line break included
+    records = tmp_path / "ids.dat"
+    records.write_bytes(b"".join(id_number.encode() + b"\n" for id_number in IDS[:50]))
+    assert list(hash_file(str(records), width=13, workers=2, chunk_size=8)) == EXPECTED[:50]
+    assert list(hash_file(str(records), width=13, raw=True))[0] == hashlib.sha256(IDS[0].encode()).digest()
+
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+    assert list(hash_file(str(empty))) == []
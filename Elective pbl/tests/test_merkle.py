@@ -0,0 +1,61 @@
+import math
+import pytest
+from blockchain import Blockchain, calculate_hash
+from hasher import hash_data
+from merkle import build_levels, hash_node, merkle_proof, merkle_root, verify_proof
+
+"""
+File: test_merkle.py
+Description: Tests for Merkle roots and inclusion proofs.
+"""
+
+def identities(count):
+    return [hash_data(f"identity-{n}") for n in range(count)]
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 8, 9, 100])
+def test_every_identity_has_a_valid_proof(count):
+    leaves = identities(count)
+    root = merkle_root(leaves)
+    for position, identity_hash in enumerate(leaves):
+        proof = merkle_proof(leaves, position)
+        assert len(proof) <= math.ceil(math.log2(count))
+        assert verify_proof(identity_hash, proof, root)
+
+def test_forged_proofs_fail():
+    leaves = identities(6)
+    root = merkle_root(leaves)
+    proof = merkle_proof(leaves, 2)
+    assert not verify_proof(hash_data("not-in-the-block"), proof, root)
+    assert not verify_proof(leaves[3], proof, root)
+    assert not verify_proof(leaves[2], proof, merkle_root(leaves[:5]))
+    tampered = [dict(step) for step in proof]
+    tampered[0]["side"] = "left" if tampered[0]["side"] == "right" else "right"
+    assert not verify_proof(leaves[2], tampered, root)
+
+def test_inner_node_is_not_a_leaf():
+    leaves = identities(4)
+    levels = build_levels(leaves)
+    assert hash_node(levels[1][0], levels[1][1]) == merkle_root(leaves)
+    # The parent of leaves 0 and 1, offered as an identity of its own
+    proof = [{"hash": levels[1][1], "side": "right"}]
+    assert not verify_proof(levels[1][0], proof, merkle_root(leaves))
+
+def test_chain_proves_identities(workdir):
+    chain = Blockchain()
+    single = hash_data("single")
+    batch = identities(7)
+    chain.add_block(single)
+    chain.add_blocks(batch, merkle=True)
+
+    block = chain.get_last_block()
+    for identity_hash in batch:
+        proof = chain.get_inclusion_proof(identity_hash)
+        assert proof["block_index"] == block['index']
+        assert proof["merkle_root"] == block['data']
+        assert proof["block_hash"] == calculate_hash(block)
+        assert verify_proof(identity_hash, proof["proof"], proof["merkle_root"])
+
+    proof = chain.get_inclusion_proof(single)
+    assert proof["merkle_root"] is None and proof["proof"] == []
+    assert chain.get_inclusion_proof(hash_data("unknown")) is None
+    chain.close()
@@ -0,0 +1,87 @@
+import gzip
+import json
+import os
+import pytest
+import metrics
+from blockchain import Blockchain
+from hasher import hash_data
+from segments import SegmentedStorage
+
+"""
+File: test_repair.py
+Description: Tests for Blockchain.repair_chain on segmented storage.
+"""
+
+SEGMENT_SIZE = 50
+
+def open_chain():
+    return Blockchain(storage=SegmentedStorage("blockchain.jsonl", segment_size=SEGMENT_SIZE))
+
+def tamper_segment(number, line):
+    """
+    Changes the data of one block inside a sealed segment file, which
+    breaks the segment's checksum.
+    """
+    with open(os.path.join("blockchain.segments", "manifest.json")) as f:
+        segment = json.load(f)['segments'][number]
+    path = os.path.join("blockchain.segments", segment['file'])
+    with open(path, 'rb') as f:
+        lines = gzip.decompress(f.read()).splitlines()
+    block = json.loads(lines[line])
+    block['data'] = hash_data("tampered")
+    lines[line] = json.dumps(block).encode()
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(b"\n".join(lines) + b"\n"))
+
+@pytest.fixture
+def chain_with_segments(workdir):
+    chain = open_chain()
+    chain.add_blocks([hash_data(f"identity-{n}") for n in range(200)])
+    assert chain.is_chain_valid(full=True) == -1
+    return chain
+
+@pytest.mark.parametrize("with_snapshot", [False, True])
+@pytest.mark.parametrize("segment", [0, 2])
+def test_repair_tampered_sealed_segment(chain_with_segments, segment, with_snapshot):
+    chain = chain_with_segments
+    if with_snapshot:
+        chain.save_snapshot()
+    last_hash = chain.get_last_block()['hash']
+    chain.close()
+    if not with_snapshot and os.path.exists("blockchain.snapshot"):
+        os.remove("blockchain.snapshot")
+    tamper_segment(segment, 5)
+
+    chain = open_chain()
+    assert chain.is_chain_valid(full=True) == segment * SEGMENT_SIZE + 1
+    report = chain.repair_chain()
+    assert report["status"] == "repaired"
+    assert report["chain_length"] == 201
+    if with_snapshot:
+        # The snapshot holds the original block, so nothing else changes
+        assert report["restored_blocks"] == 1
+        assert report["relinked_blocks"] == 0
+        assert chain.get_last_block()['hash'] == last_hash
+    chain.close()
+
+    # The repaired chain is valid on disk, too
+    chain = open_chain()
+    assert chain.is_chain_valid(full=True) == -1
+    assert len(chain.blockchain) == 201
+    chain.close()
+
+def test_repair_intact_chain(chain_with_segments):
+    report = chain_with_segments.repair_chain()
+    assert report["status"] == "intact"
+    assert report["changes"] == []
+
+def test_tampered_segment_counted_once(chain_with_segments):
+    chain_with_segments.close()
+    tamper_segment(1, 0)
+    chain = open_chain()
+    before = metrics.TAMPER_DETECTIONS.values.get((), 0)
+    assert chain.is_chain_valid(full=True) == SEGMENT_SIZE + 1
+    assert metrics.TAMPER_DETECTIONS.values.get((), 0) == before + 1
+    assert chain.audit_chain(workers=1) == SEGMENT_SIZE + 1
+    assert metrics.TAMPER_DETECTIONS.values.get((), 0) == before + 2
+    chain.close()
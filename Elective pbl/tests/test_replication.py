@@ -0,0 +1,193 @@
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+import pytest
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+from blockchain import Blockchain
+from hasher import hash_data
+from segments import SegmentedStorage
+from verify_server import run_worker
+
+"""
+File: test_replication.py
+Description: Replication between nodes: Blockchain.import_blocks, and
+verification servers following each other. In the server test node 0
+serves the leader's chain and every other node follows the one before it
+(node 1 follows node 0, node 2 follows node 1). Blocks are added to the
+leader while the followers run; every node must end up with the same
+chain.
+"""
+
+NODES = 3
+BLOCKS = 600
+
+def free_port():
+    """
+    Returns a localhost port nothing is listening on right now.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def node(chain_path, port, peer):
+    """
+    One node process: a verification server, following `peer` if given.
+    """
+    # Keep the nodes' log messages out of the test output
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    run_worker("127.0.0.1", port, False, chain_path, peer)
+
+def get_json(url, body=None):
+    """
+    GET (or POST, with a body) a JSON route of a node.
+    """
+    data = json.dumps(body).encode() if body is not None else None
+    request = Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+def wait_for_nodes(ports, length, last_hash, timeout=60):
+    """
+    Waits until every node reports the leader's chain length and last hash.
+
+    Returns:
+        list: The last /health reply of each node.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        health = []
+        for port in ports:
+            try:
+                health.append(get_json(f"http://127.0.0.1:{port}/health"))
+            except (URLError, OSError, ValueError):
+                health.append(None)
+        if all(reply and reply['length'] == length and reply['last_hash'] == last_hash for reply in health):
+            return health
+        if time.monotonic() > deadline:
+            return health
+        time.sleep(0.2)
+
+def open_node(name):
+    os.makedirs(name, exist_ok=True)
+    return Blockchain(storage=SegmentedStorage(os.path.join(name, "blockchain.jsonl")))
+
+@pytest.fixture
+def leader_and_follower(workdir):
+    leader = open_node("leader")
+    leader.add_blocks([hash_data(f"identity-{n}") for n in range(10)])
+    leader.add_blocks([hash_data(f"batch-{n}") for n in range(5)], merkle=True)
+    follower = open_node("follower")
+    yield leader, follower
+    leader.close()
+    follower.close()
+
+def blocks_of(chain, start=0):
+    return [block.to_dict() for block in chain.blockchain[start:]]
+
+def test_follower_copies_the_leader(leader_and_follower):
+    leader, follower = leader_and_follower
+    # The follower's own Genesis Block is replaced by the leader's
+    assert follower.import_blocks(blocks_of(leader), start=0) == len(leader.blockchain)
+    assert blocks_of(follower) == blocks_of(leader)
+    assert follower.verify_identity(hash_data("batch-3"))
+
+    leader.add_block(hash_data("late"))
+    assert follower.import_blocks(blocks_of(leader, len(follower.blockchain))) == 1
+    assert follower.get_last_block()['hash'] == leader.get_last_block()['hash']
+    assert follower.is_chain_valid(full=True) == -1
+
+def tampered_copies(blocks):
+    """
+    Yields (description, blocks) for forged versions of a block list.
+    """
+    def changed(position, **fields):
+        forged = [dict(block) for block in blocks]
+        forged[position].update(fields)
+        return forged
+
+    yield "data", changed(3, data=hash_data("forged"))
+    yield "index", changed(3, index=99)
+    yield "hash", changed(3, hash="0" * 64)
+    yield "link", changed(3, previous_hash=blocks[1]['hash'])
+    merkle = next(position for position, block in enumerate(blocks) if 'identities' in block)
+    yield "identities", changed(merkle, identities=blocks[merkle]['identities'][:-1] + [hash_data("forged")])
+    yield "missing field", [dict(block) for block in blocks[:3]] + [{"index": 4}]
+
+def test_tampered_blocks_are_rejected(leader_and_follower):
+    leader, follower = leader_and_follower
+    follower.import_blocks(blocks_of(leader)[:2], start=0)
+    before = blocks_of(follower)
+    for description, forged in tampered_copies(blocks_of(leader)):
+        with pytest.raises(ValueError):
+            follower.import_blocks(forged[2:])
+        # Nothing of a rejected batch is kept, not even its sound blocks
+        assert blocks_of(follower) == before, description
+    assert follower.is_chain_valid(full=True) == -1
+
+def test_forked_chain_is_rejected(leader_and_follower):
+    leader, follower = leader_and_follower
+    follower.import_blocks(blocks_of(leader)[:5], start=0)
+    # Blocks of a chain that doesn't share our Genesis Block
+    other = open_node("other")
+    other.add_blocks([hash_data(f"other-{n}") for n in range(10)])
+    with pytest.raises(ValueError):
+        follower.import_blocks(blocks_of(other, 5))
+    other.close()
+
+    with pytest.raises(ValueError):
+        follower.import_blocks(blocks_of(leader, 5), start=len(follower.blockchain) + 1)
+    assert len(follower.blockchain) == 5
+    assert follower.import_blocks(blocks_of(leader, 5)) == len(leader.blockchain) - 5
+
+@pytest.mark.slow
+def test_followers_replicate_the_leader(workdir):
+    paths = [os.path.join(f"node{n}", "blockchain.jsonl") for n in range(NODES)]
+    ports = [free_port() for _ in range(NODES)]
+    os.makedirs("node0")
+    leader = Blockchain(storage=SegmentedStorage(paths[0]))
+    identities = [hash_data(f"identity-{n}") for n in range(BLOCKS)]
+    # Half of the identities exist before the followers start
+    half = BLOCKS // 2
+    leader.add_blocks(identities[:half // 2])
+    leader.add_blocks(identities[half // 2:half], merkle=True)
+    leader.storage.flush()
+
+    processes = [
+        multiprocessing.Process(target=node, args=(paths[n], ports[n],
+                                                   f"http://127.0.0.1:{ports[n - 1]}" if n else None))
+        for n in range(NODES)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        # The rest arrive while the followers are running
+        for start in range(half, BLOCKS, 100):
+            leader.add_blocks(identities[start:start + 100])
+            time.sleep(0.05)
+        leader.storage.flush()
+
+        length, last_hash = len(leader.blockchain), leader.get_last_block()['hash']
+        health = wait_for_nodes(ports, length, last_hash)
+        assert all(reply and reply['length'] == length and reply['last_hash'] == last_hash for reply in health)
+
+        sample = identities[::10]
+        results = get_json(f"http://127.0.0.1:{ports[-1]}/verify", {"hashes": sample})['results']
+        assert all(result['registered'] for result in results)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        leader.close()
+
+    # Every follower's chain file holds a valid copy of the leader's chain
+    for path in paths:
+        chain = Blockchain(storage=SegmentedStorage(path))
+        assert chain.is_chain_valid(full=True) == -1
+        assert len(chain.blockchain) == length
+        chain.close()
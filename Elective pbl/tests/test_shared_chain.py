@@ -0,0 +1,61 @@
+import multiprocessing
+import pytest
+from blockchain import Blockchain
+from segments import SegmentedStorage
+from storage import JsonLinesStorage
+
+"""
+File: test_shared_chain.py
+Description: Multi-worker deployments. Several processes append to the
+same chain file at the same time (like several server workers would);
+no block may be lost or forked.
+"""
+
+WORKERS = 4
+BLOCKS = 100
+
+def open_storage(segment_size):
+    """
+    Opens the shared chain file, as segmented storage if a segment
+    size was given.
+    """
+    if segment_size:
+        return SegmentedStorage("blockchain.jsonl", segment_size=segment_size)
+    return JsonLinesStorage("blockchain.jsonl")
+
+def worker(segment_size, worker_id, ready):
+    """
+    One worker process: opens the shared chain and appends its identities,
+    alternating single appends and small batches.
+    """
+    chain = Blockchain(storage=open_storage(segment_size))
+    ready.wait()
+
+    for i in range(0, BLOCKS, 2):
+        chain.add_block(f"worker-{worker_id}-{i}")
+        chain.add_blocks([f"worker-{worker_id}-{i + 1}", f"shared-{i}"])
+    chain.storage.flush()
+
+@pytest.mark.slow
+@pytest.mark.parametrize("segment_size", [0, 50])
+def test_concurrent_appends_from_several_processes(workdir, segment_size):
+    # Create the chain (and its Genesis Block) before the workers start
+    Blockchain(storage=open_storage(segment_size)).close()
+
+    ready = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=worker, args=(segment_size, n, ready))
+                 for n in range(WORKERS)]
+    for process in processes:
+        process.start()
+    ready.set()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    chain = Blockchain(storage=open_storage(segment_size))
+    assert chain.is_chain_valid(full=True) == -1
+    # Every worker's own identities plus one copy of each shared one
+    assert len(chain.identity_index) == WORKERS * BLOCKS + BLOCKS // 2
+    if segment_size:
+        assert chain.storage.sealed_segments()
+    chain.close()
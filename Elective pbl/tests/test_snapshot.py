@@ -0,0 +1,131 @@
+import json
+import os
+import pytest
+from blockchain import Blockchain
+from hasher import hash_data
+from segments import SegmentedStorage
+from snapshot import SnapshotChain, SnapshotIndex, open_snapshot
+
+"""
+File: test_snapshot.py
+Description: Tests for the snapshot-backed identity index.
+"""
+
+IDENTITIES = [hash_data(f"identity-{n}") for n in range(50)]
+
+@pytest.fixture
+def snapshot(workdir):
+    chain = Blockchain()
+    chain.add_blocks(IDENTITIES[:30])
+    chain.add_blocks(IDENTITIES[30:], merkle=True)
+    assert chain.is_chain_valid(full=True) == -1
+    chain.save_snapshot()
+    chain.close()
+    return open_snapshot("blockchain.snapshot")
+
+def test_index_counts_each_identity_once(snapshot):
+    index = SnapshotIndex(snapshot)
+    assert len(index) == 50
+
+    # Moving an identity that is already in the snapshot, twice
+    index[IDENTITIES[0]] = 40
+    index[IDENTITIES[0]] = 41
+    assert len(index) == 50
+    assert index.get(IDENTITIES[0]) == 41
+
+    # A new identity, set again
+    new = hash_data("new")
+    index[new] = 60
+    index[new] = 61
+    assert len(index) == 51
+
+    # Removed identities, one from the snapshot and the new one
+    del index[IDENTITIES[1]]
+    del index[new]
+    assert len(index) == 49
+    assert IDENTITIES[1] not in index
+    with pytest.raises(KeyError):
+        del index[IDENTITIES[1]]
+
+    # Re-added after removal
+    index[IDENTITIES[1]] = 2
+    assert len(index) == 50
+    assert sorted(index) == sorted(IDENTITIES)
+
+def test_chain_keeps_only_recent_blocks_decoded(snapshot):
+    from blockchain import Block
+
+    chain = SnapshotChain(snapshot, Block, cached_blocks=4)
+    blocks = [chain[position] for position in range(len(chain))]
+    assert [block['hash'] for block in blocks] == [block['hash'] for block in chain]
+    assert len(chain.cache) == 4
+    assert chain[-1] is blocks[-1]
+
+    # A replaced block outlives any number of other reads
+    replacement = Block.from_dict(dict(blocks[3].to_dict(), data=hash_data("repaired")))
+    chain[3] = replacement
+    for position in range(len(chain)):
+        chain[position]
+    assert chain[3] is replacement
+    assert list(chain)[3] is replacement
+    assert len(chain.cache) == 4
+
+def test_chain_loaded_from_snapshot_counts_identities(snapshot):
+    chain = Blockchain()
+    assert isinstance(chain.identity_index, SnapshotIndex)
+    chain.add_blocks([hash_data("late-1"), hash_data("late-2")])
+    assert len(chain.identity_index) == 52
+    chain.close()
+
+def edit_log_in_place(path, line_number):
+    """
+    Reverses one block's data in the log, which keeps the file's length,
+    as an edit made while no server was running could.
+    """
+    with open(path, 'rb') as f:
+        lines = f.read().split(b"\n")
+    data = json.loads(lines[line_number])['data'].encode()
+    lines[line_number] = lines[line_number].replace(data, data[::-1])
+    stat = os.stat(path)
+    with open(path, 'r+b') as f:
+        f.write(b"\n".join(lines))
+    assert os.stat(path).st_size == stat.st_size
+    # Make sure the modification time moves even on coarse clocks
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+def test_log_edited_while_stopped_is_reverified(snapshot):
+    edit_log_in_place("blockchain.jsonl", 10)
+    chain = Blockchain()
+    assert not isinstance(chain.blockchain, SnapshotChain)
+    assert chain.is_chain_valid() == 11
+    chain.close()
+
+def test_blocks_appended_after_snapshot_keep_it(snapshot):
+    chain = Blockchain()
+    chain.add_blocks([hash_data("after-1"), hash_data("after-2")])
+    chain.close()
+
+    chain = Blockchain()
+    assert isinstance(chain.blockchain, SnapshotChain)
+    assert len(chain.blockchain) == 34
+    assert chain.is_chain_valid() == -1
+    chain.close()
+
+def test_sealed_segment_edited_while_stopped_is_reverified(workdir):
+    chain = Blockchain(storage=SegmentedStorage("blockchain.jsonl", segment_size=20))
+    chain.add_blocks(IDENTITIES)
+    assert chain.is_chain_valid(full=True) == -1
+    assert chain.save_snapshot()
+    chain.close()
+
+    # Replace a sealed segment file with one of the same contents: its
+    # checksum still matches, but the snapshot can't know that
+    segment = SegmentedStorage("blockchain.jsonl", segment_size=20).sealed_segments()[0]
+    path = os.path.join("blockchain.segments", segment['file'])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    chain = Blockchain(storage=SegmentedStorage("blockchain.jsonl", segment_size=20))
+    assert not isinstance(chain.blockchain, SnapshotChain)
+    assert chain.is_chain_valid() == -1
+    chain.close()
@@ -0,0 +1,119 @@
+import json
+import os
+import pytest
+from blockchain import Blockchain
+from hasher import hash_data
+from segments import SegmentedStorage
+from storage import JsonLinesStorage
+
+"""
+File: test_storage.py
+Description: Tests for the append-only log storage: crash recovery, and
+how the chain and its storage behave when writing to disk fails.
+"""
+
+def blocks(first, count):
+    return [{"index": n, "data": f"block-{n}"} for n in range(first, first + count)]
+
+def read_log():
+    with open("blockchain.jsonl") as f:
+        return [json.loads(line) for line in f]
+
+def test_torn_last_line_is_cut_off(workdir):
+    storage = JsonLinesStorage("blockchain.jsonl")
+    storage.append(blocks(1, 3))
+    storage.close()
+    # A crash in the middle of the next append
+    with open("blockchain.jsonl", "ab") as f:
+        f.write(b'{"index": 4, "da')
+
+    storage = JsonLinesStorage("blockchain.jsonl")
+    assert list(storage.iter_blocks()) == blocks(1, 3)
+    storage.append(blocks(4, 1))
+    storage.close()
+    assert read_log() == blocks(1, 4)
+
+def test_torn_line_of_another_writer_is_left_alone(workdir):
+    storage = JsonLinesStorage("blockchain.jsonl")
+    storage.append(blocks(1, 2))
+    assert list(storage.iter_blocks()) == blocks(1, 2)
+    with open("blockchain.jsonl", "ab") as f:
+        f.write(b'{"index": 3, "da')
+    assert list(storage.iter_new_blocks()) == []
+    with open("blockchain.jsonl", "ab") as f:
+        f.write(b'ta": "block-3"}\n')
+    assert list(storage.iter_new_blocks()) == blocks(3, 1)
+    storage.close()
+
+def test_replace_suffix(workdir):
+    storage = JsonLinesStorage("blockchain.jsonl")
+    storage.append(blocks(1, 5))
+    storage.replace_suffix(2, blocks(10, 3))
+    storage.close()
+    assert read_log() == blocks(1, 3) + blocks(10, 3)
+    assert not os.path.exists("blockchain.jsonl.journal")
+
+@pytest.mark.parametrize("applied", [0, 10, None])
+def test_interrupted_repair_is_finished_on_open(workdir, applied):
+    storage = JsonLinesStorage("blockchain.jsonl")
+    storage.append(blocks(1, 5))
+    storage.close()
+    # A repair that crashed after saving its journal, having applied
+    # none, some or all of it to the log
+    offset = storage.offset_of_last_blocks(2)
+    data = "".join(json.dumps(block) + "\n" for block in blocks(10, 3))
+    with open("blockchain.jsonl.journal", "w") as f:
+        json.dump({"offset": offset, "data": data}, f)
+    with open("blockchain.jsonl", "r+b") as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(data.encode()[:applied])
+
+    storage = JsonLinesStorage("blockchain.jsonl")
+    assert list(storage.iter_blocks()) == blocks(1, 3) + blocks(10, 3)
+    assert not os.path.exists("blockchain.jsonl.journal")
+    storage.close()
+
+def fail_fsync(monkeypatch):
+    """
+    Makes every fsync fail like a full disk would, after the data was
+    already written to the file.
+    """
+    def fsync(fd):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(os, "fsync", fsync)
+
+@pytest.mark.parametrize("segmented", [False, True])
+def test_failed_append_is_rolled_back(workdir, monkeypatch, segmented):
+    storage = (SegmentedStorage("blockchain.jsonl", segment_size=10) if segmented
+               else JsonLinesStorage("blockchain.jsonl"))
+    storage.sync_every = 1
+    chain = Blockchain(storage=storage)
+    chain.add_blocks([hash_data(f"identity-{n}") for n in range(30)])
+    length = len(chain.blockchain)
+    last_hash = chain.get_last_block()['hash']
+    size = os.path.getsize("blockchain.jsonl")
+
+    with monkeypatch.context() as patch:
+        fail_fsync(patch)
+        with pytest.raises(OSError):
+            chain.add_blocks([hash_data("lost-1"), hash_data("lost-2")])
+        assert chain.add_block(hash_data("lost-3")) is None
+
+    # Nothing of the failed appends is left in memory or on disk
+    assert len(chain.blockchain) == length
+    assert chain.get_last_block()['hash'] == last_hash
+    assert not chain.verify_identity(hash_data("lost-1"))
+    assert not chain.verify_identity(hash_data("lost-3"))
+    assert os.path.getsize("blockchain.jsonl") == size
+
+    # The same identities can be added once the disk is back
+    assert chain.add_block(hash_data("lost-1"))['previous_hash'] == last_hash
+    assert chain.is_chain_valid(full=True) == -1
+    chain.close()
+
+    chain = Blockchain(storage=SegmentedStorage("blockchain.jsonl", segment_size=10) if segmented
+                       else JsonLinesStorage("blockchain.jsonl"))
+    assert len(chain.blockchain) == length + 1
+    assert chain.is_chain_valid(full=True) == -1
+    chain.close()
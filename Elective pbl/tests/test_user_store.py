@@ -0,0 +1,25 @@
+import pytest
+from user_store import UserStore
+
+"""
+File: test_user_store.py
+Description: Tests for the SQLite user store and its pending queue.
+"""
+
+@pytest.fixture
+def users(workdir):
+    return UserStore("users.db")
+
+def test_list_pending_pages(users, add_pending):
+    usernames = add_pending(users, 5)
+    first, cursor = users.list_pending(limit=2)
+    assert [application['username'] for application in first] == usernames[:2]
+    second, cursor = users.list_pending(limit=2, after=cursor)
+    last, cursor = users.list_pending(limit=2, after=cursor)
+    assert [application['username'] for application in second + last] == usernames[2:]
+    assert cursor is None
+
+def test_list_pending_empty_page(users, add_pending):
+    add_pending(users, 3)
+    assert users.list_pending(limit=0) == ([], None)
+    assert users.list_pending(limit=10, after=10**6) == ([], None)
@@ -0,0 +1,72 @@
+import asyncio
+import pytest
+from blockchain import Blockchain
+from hasher import hash_data
+from verify_server import ChainCompromised, LookupCoalescer
+
+"""
+File: test_verify_server.py
+Description: Tests for the lookup coalescer of the verification server.
+"""
+
+REGISTERED = [hash_data(f"identity-{n}") for n in range(20)]
+UNKNOWN = [hash_data(f"unknown-{n}") for n in range(5)]
+
+@pytest.fixture
+def chain(workdir):
+    chain = Blockchain()
+    chain.add_blocks(REGISTERED)
+    assert chain.is_chain_valid() == -1
+    yield chain
+    chain.close()
+
+def record_calls(chain, monkeypatch, name):
+    calls = []
+    method = getattr(chain, name)
+    def recording(*args):
+        calls.append(args)
+        return method(*args)
+    monkeypatch.setattr(chain, name, recording)
+    return calls
+
+def test_concurrent_lookups_share_one_round(chain, monkeypatch):
+    lookups = record_calls(chain, monkeypatch, "verify_identity")
+    refreshes = record_calls(chain, monkeypatch, "sync_from_storage")
+    coalescer = LookupCoalescer(chain)
+
+    async def burst():
+        # 100 requests for the same few hashes, all in flight at once
+        requests = [coalescer.lookup_many([REGISTERED[n % 3], UNKNOWN[n % 2]]) for n in range(100)]
+        return await asyncio.gather(*requests)
+
+    results = asyncio.run(burst())
+    assert all(result == [True, False] for result in results)
+    assert sorted(lookups) == sorted((identity_hash,) for identity_hash in REGISTERED[:3] + UNKNOWN[:2])
+    # Nothing changed on disk, so no round had to sync
+    assert refreshes == []
+    assert not coalescer.waiting and not coalescer.running
+
+def test_later_rounds_see_new_blocks(chain):
+    coalescer = LookupCoalescer(chain)
+    assert asyncio.run(coalescer.lookup_many(UNKNOWN[:1])) == [False]
+
+    other = Blockchain()
+    other.add_block(UNKNOWN[0])
+    other.close()
+    assert asyncio.run(coalescer.lookup_many(UNKNOWN[:1])) == [True]
+
+def test_compromised_chain_fails_every_waiting_lookup(chain):
+    with open("blockchain.jsonl") as f:
+        lines = f.read().splitlines()
+    lines[5] = lines[5].replace(REGISTERED[4], hash_data("forged"))
+    with open("blockchain.jsonl", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    coalescer = LookupCoalescer(chain)
+
+    async def burst():
+        return await asyncio.gather(coalescer.lookup_many(REGISTERED[:1]),
+                                    coalescer.lookup_many(UNKNOWN[:1]), return_exceptions=True)
+
+    results = asyncio.run(burst())
+    assert all(isinstance(result, ChainCompromised) for result in results)
+    assert not coalescer.waiting
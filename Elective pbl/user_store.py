@@ -0,0 +1,334 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import metrics
+
+"""
+File: user_store.py
+Description: SQLite-backed repository for user accounts and their Aadhaar
+applications. Replaces reading and rewriting the whole of users.json on
+every request with indexed point reads and writes. Pending applications
+are also kept in their own queue table, in submission order, so listing
+them never has to look at the other users.
+"""
+
+logger = logging.getLogger(__name__)
+
+class UserStore:
+    """
+    Stores user accounts in a local SQLite database (WAL mode).
+    Each thread gets its own connection, so it is safe to use
+    from Flask request threads.
+    """
+
+    # Columns that may be changed through update()
+    FIELDS = ("password", "role", "org", "aadhar", "status", "application_data")
+
+    def __init__(self, db_path="users.db", legacy_file="users.json"):
+        """
+        Constructor for the UserStore.
+
+        Args:
+            db_path (str): The SQLite database file.
+            legacy_file (str): Old users.json to migrate on first start.
+        """
+        self.db_path = db_path
+        self.legacy_file = legacy_file
+        self.local = threading.local()
+        self.create_schema()
+
+        # --- One-time migration from users.json ---
+        if self.count() == 0 and os.path.exists(self.legacy_file):
+            migrated = self.migrate_from_json(self.legacy_file)
+            logger.info("Migrated %d users from %s into %s.", migrated, self.legacy_file, self.db_path)
+
+    def connection(self):
+        """
+        Returns the SQLite connection for the calling thread.
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # WAL lets readers keep going while a write is in progress
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def create_schema(self):
+        """
+        Creates the users table, the pending queue and their indexes
+        if they don't exist.
+        """
+        conn = self.connection()
+        queue_exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pending_queue'"
+        ).fetchone() is not None
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL UNIQUE,
+                    password TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    org TEXT,
+                    aadhar TEXT,
+                    status TEXT NOT NULL DEFAULT 'none',
+                    application_data TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_users_status ON users (status, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_users_aadhar ON users (aadhar)")
+            # One row per pending application. seq only grows, so it is both
+            # the queue order and the cursor for /get_pending and /events.
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pending_queue (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL UNIQUE,
+                    id_number TEXT NOT NULL,
+                    hash TEXT NOT NULL
+                )
+            """)
+
+            # Databases from before the queue existed: queue the
+            # applications that are already pending, oldest first
+            if not queue_exists:
+                rows = conn.execute(
+                    "SELECT username, application_data FROM users "
+                    "WHERE status = 'pending' AND application_data IS NOT NULL ORDER BY id"
+                ).fetchall()
+                for row in rows:
+                    self.enqueue(conn, row["username"], json.loads(row["application_data"]))
+
+    def enqueue(self, conn, username, application_data):
+        """
+        Puts an application at the back of the pending queue (a user who
+        applies again moves to the back). Runs in the caller's transaction.
+        """
+        conn.execute(
+            "INSERT OR REPLACE INTO pending_queue (username, id_number, hash) VALUES (?, ?, ?)",
+            (username, application_data["id_number"], application_data["hash"])
+        )
+
+    def update_queue(self, conn, username, fields):
+        """
+        Keeps the pending queue in step with a change of a user's status:
+        becoming 'pending' enqueues the application, any other status
+        (e.g. 'approved') removes it.
+        """
+        if "status" not in fields:
+            return
+        if fields["status"] == "pending" and fields.get("application_data"):
+            self.enqueue(conn, username, fields["application_data"])
+        else:
+            conn.execute("DELETE FROM pending_queue WHERE username = ?", (username,))
+
+    def row_to_user(self, row):
+        """
+        Converts a database row into the user dict the app works with.
+        """
+        user = {
+            "password": row["password"],
+            "role": row["role"],
+            "aadhar": row["aadhar"],
+            "status": row["status"],
+            "application_data": json.loads(row["application_data"]) if row["application_data"] else None
+        }
+        if row["org"] is not None:
+            user["org"] = row["org"]
+        return user
+
+    @metrics.timed(metrics.USER_STORE_SECONDS, operation="count")
+    def count(self):
+        """
+        Returns the number of stored users.
+        """
+        return self.connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    @metrics.timed(metrics.USER_STORE_SECONDS, operation="get")
+    def get(self, username):
+        """
+        Fetches a single user by username.
+
+        Args:
+            username (str): The user to look up.
+
+        Returns:
+            dict: The user record, or None if the user doesn't exist.
+        """
+        row = self.connection().execute(
+            "SELECT * FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        return self.row_to_user(row) if row else None
+
+    @metrics.timed(metrics.USER_STORE_SECONDS, operation="create")
+    def create(self, username, user):
+        """
+        Inserts a new user.
+
+        Args:
+            username (str): The new username.
+            user (dict): The user record (password, role, ...).
+
+        Returns:
+            bool: True if created, False if the username is taken.
+        """
+        application_data = user.get("application_data")
+        try:
+            with self.connection() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, password, role, org, aadhar, status, application_data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (username, user["password"], user["role"], user.get("org"), user.get("aadhar"),
+                     user.get("status") or "none",
+                     json.dumps(application_data) if application_data else None)
+                )
+                self.update_queue(conn, username, user)
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    @metrics.timed(metrics.USER_STORE_SECONDS, operation="update")
+    def update(self, username, **fields):
+        """
+        Updates some fields of an existing user. A change of status
+        also updates the pending queue, in the same transaction.
+
+        Args:
+            username (str): The user to update.
+            **fields: Column values to set (see FIELDS).
+
+        Returns:
+            bool: True if the user existed and was updated.
+        """
+        columns, values = self.encode_fields(fields)
+        with self.connection() as conn:
+            cursor = conn.execute(
+                f"UPDATE users SET {columns} WHERE username = ?", values + [username]
+            )
+            if cursor.rowcount == 1:
+                self.update_queue(conn, username, fields)
+        return cursor.rowcount == 1
+
+    @metrics.timed(metrics.USER_STORE_SECONDS, operation="get_many")
+    def get_many(self, usernames):
+        """
+        Fetches several users in one query.
+
+        Args:
+            usernames (list): The users to look up.
+
+        Returns:
+            dict: username -> user record, for the users that exist.
+        """
+        found = {}
+        usernames = list(usernames)
+        # Stay below SQLite's limit on the number of query parameters
+        for start in range(0, len(usernames), 500):
+            chunk = usernames[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows = self.connection().execute(
+                f"SELECT * FROM users WHERE username IN ({placeholders})", chunk
+            ).fetchall()
+            for row in rows:
+                found[row["username"]] = self.row_to_user(row)
+        return found
+
+    @metrics.timed(metrics.USER_STORE_SECONDS, operation="update_many")
+    def update_many(self, updates):
+        """
+        Applies several user updates in a single transaction.
+
+        Args:
+            updates (list): (username, fields dict) pairs.
+        """
+        with self.connection() as conn:
+            for username, fields in updates:
+                columns, values = self.encode_fields(fields)
+                cursor = conn.execute(
+                    f"UPDATE users SET {columns} WHERE username = ?", values + [username]
+                )
+                if cursor.rowcount == 1:
+                    self.update_queue(conn, username, fields)
+
+    def encode_fields(self, fields):
+        """
+        Turns keyword fields into an SQL SET clause and its values.
+        """
+        for name in fields:
+            if name not in self.FIELDS:
+                raise ValueError(f"Unknown user field: {name}")
+        values = []
+        for name, value in fields.items():
+            if name == "application_data" and value is not None:
+                value = json.dumps(value)
+            values.append(value)
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        return columns, values
+
+    @metrics.timed(metrics.USER_STORE_SECONDS, operation="list_pending")
+    def list_pending(self, limit=100, after=0):
+        """
+        Returns one page of pending applications, oldest first.
+        Reads the pending queue, so the cost depends on the page
+        size and not on the total number of users.
+
+        Args:
+            limit (int): Maximum number of applications to return.
+            after (int): Cursor returned by the previous page (0 for the first).
+
+        Returns:
+            tuple: (list of pending applications, cursor for the next
+                    page or None if this was the last page)
+        """
+        entries = self.pending_after(after, limit)
+        next_cursor = entries[-1][0] if entries and len(entries) == limit else None
+        return [application for _, application in entries], next_cursor
+
+    def pending_after(self, after, limit):
+        """
+        Returns the applications queued after a queue position.
+
+        Args:
+            after (int): Queue position (seq) to start after.
+            limit (int): Maximum number of applications to return.
+
+        Returns:
+            list: (seq, application) pairs in queue order.
+        """
+        rows = self.connection().execute(
+            "SELECT seq, username, id_number, hash FROM pending_queue "
+            "WHERE seq > ? ORDER BY seq LIMIT ?",
+            (after, limit)
+        ).fetchall()
+        return [(row["seq"], {
+            "username": row["username"],
+            "id_number": row["id_number"],
+            "hash": row["hash"]
+        }) for row in rows]
+
+    def migrate_from_json(self, path):
+        """
+        Copies every user from an old users.json file into the database.
+
+        Args:
+            path (str): The users.json file.
+
+        Returns:
+            int: The number of users migrated.
+        """
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error("Error reading %s for migration: %s", path, e)
+            return 0
+
+        migrated = 0
+        for username, user in data.items():
+            if self.create(username, user):
+                migrated += 1
+        return migrated
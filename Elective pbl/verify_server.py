@@ -0,0 +1,415 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import time
+from urllib.parse import parse_qs, urlsplit
+from blockchain import Blockchain
+from replication import Follower, read_blocks, read_headers
+from segments import SegmentedStorage
+import metrics
+
+"""
+File: verify_server.py
+Description: Read-only verification service for relying parties (banks,
+telecoms, ...) that need to check "is this identity registered?" at a
+high rate. It answers from the chain's in-memory identity index (Bloom
+filter + index, see Blockchain.verify_identity) and never touches the
+user database or re-validates the whole chain per request.
+
+The server runs on asyncio from the standard library, so thousands of
+keep-alive connections can wait on one thread. Lookups that arrive
+together are answered in one round: the chain is synced with storage
+once per round (picking up identities minted by app.py), and identical
+hashes that are already being looked up share the same answer.
+
+Routes:
+    GET  /verify/<identity_hash>    one lookup
+    POST /verify                    {"hashes": [...]}, up to MAX_BATCH hashes
+    GET  /health                    chain length and integrity
+    GET  /metrics                   Prometheus text format
+    GET  /sync/headers, /sync/blocks  replication (see replication.py)
+
+With --peer the server is a read replica: it keeps its own chain file in
+step with another node's chain and answers lookups from it.
+
+Usage: python verify_server.py --port 5001 --workers 4
+       python verify_server.py --port 5002 --chain node2/blockchain.jsonl --peer http://127.0.0.1:5001
+"""
+
+logger = logging.getLogger(__name__)
+
+# Most hashes accepted in one POST /verify
+MAX_BATCH = 10000
+# Largest request body read (a full batch is about 700 KB)
+MAX_BODY = 1024 * 1024
+MAX_HEADERS = 100
+# Identity hashes are SHA-256 hex digests (see hasher.hash_data)
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 503: "Service Unavailable"}
+
+class HTTPError(Exception):
+    """
+    A request that is answered with an error status.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class ChainCompromised(Exception):
+    """
+    Raised to waiting lookups when the chain failed its integrity check.
+    """
+
+class LookupCoalescer:
+    """
+    Answers identity lookups in rounds.
+
+    Every lookup requested while a round is being prepared joins the next
+    round, so a burst of requests costs one storage sync and one integrity
+    check instead of one per request. A hash that is already waiting for an
+    answer isn't looked up again; its callers share the same future.
+    """
+
+    def __init__(self, blockchain):
+        self.blockchain = blockchain
+        # identity hash -> future shared by everyone waiting for it
+        self.waiting = {}
+        # Hashes to look up in the next round, in arrival order
+        self.batch = []
+        self.running = False
+
+    async def lookup_many(self, identity_hashes):
+        """
+        Looks up identity hashes on the chain.
+
+        Args:
+            identity_hashes (list): SHA-256 hex digests to check.
+
+        Returns:
+            list: True/False per hash, in the same order.
+
+        Raises:
+            ChainCompromised: If the chain failed its integrity check.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for identity_hash in identity_hashes:
+            future = self.waiting.get(identity_hash)
+            if future is None:
+                future = self.waiting[identity_hash] = loop.create_future()
+                self.batch.append(identity_hash)
+            else:
+                metrics.VERIFY_COALESCED.inc()
+            futures.append(future)
+
+        if not self.running:
+            self.running = True
+            loop.create_task(self.run_rounds())
+        return [await future for future in futures]
+
+    async def run_rounds(self):
+        """
+        Answers waiting lookups until none are left.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while self.batch:
+                # Let requests that arrived in the same loop iteration join
+                await asyncio.sleep(0)
+                # Usually nothing changed since the last round. Otherwise
+                # syncing can mean reading (or reloading) the chain file,
+                # so it runs off the event loop; lookups arriving
+                # meanwhile wait for the next round.
+                chain_valid = self.blockchain.is_up_to_date() or await loop.run_in_executor(None, self.refresh)
+                batch, self.batch = self.batch, []
+                verify_identity = self.blockchain.verify_identity
+                for identity_hash in batch:
+                    future = self.waiting.pop(identity_hash)
+                    if future.done():
+                        continue
+                    if chain_valid:
+                        future.set_result(verify_identity(identity_hash))
+                    else:
+                        future.set_exception(ChainCompromised())
+                metrics.VERIFY_LOOKUPS.inc(len(batch))
+        except Exception as e:
+            logger.exception("Lookup round failed")
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(e)
+            self.waiting.clear()
+            self.batch.clear()
+        finally:
+            self.running = False
+
+    def refresh(self):
+        """
+        Brings the chain up to date with storage and checks its integrity.
+        Both are cheap when nothing changed: one stat() call and the
+        cached validation result (only new blocks get hashed).
+
+        Returns:
+            bool: True if the chain is intact.
+        """
+        self.blockchain.sync_from_storage()
+        return self.blockchain.is_chain_valid() == -1
+
+def parse_hashes(body):
+    """
+    Reads the hashes of a POST /verify body.
+    """
+    try:
+        data = json.loads(body or b"{}")
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPError(400, "Request body must be JSON.")
+    hashes = data.get('hashes') if isinstance(data, dict) else None
+    if not isinstance(hashes, list) or not hashes:
+        raise HTTPError(400, 'Expected {"hashes": [...]}.')
+    if len(hashes) > MAX_BATCH:
+        raise HTTPError(413, f"At most {MAX_BATCH} hashes per request.")
+    for identity_hash in hashes:
+        check_hash(identity_hash)
+    return hashes
+
+def query_int(query, name, default):
+    """
+    Reads an integer query parameter.
+    """
+    try:
+        return int(query[name][0]) if name in query else default
+    except ValueError:
+        raise HTTPError(400, f"Query parameter '{name}' must be an integer.")
+
+def check_hash(identity_hash):
+    if not isinstance(identity_hash, str) or not HASH_PATTERN.match(identity_hash):
+        raise HTTPError(400, "Identity hashes must be 64 lowercase hex characters.")
+
+async def read_request(reader):
+    """
+    Reads one HTTP/1.1 request from a connection.
+
+    Returns:
+        tuple: (method, path, query, headers, body), or None if the
+               client closed the connection.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line.")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n"):
+            break
+        if not line or len(headers) >= MAX_HEADERS:
+            raise HTTPError(400, "Malformed headers.")
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length.")
+    if length > MAX_BODY:
+        raise HTTPError(413, "Request body too large.")
+    body = await reader.readexactly(length) if length > 0 else b""
+
+    # HTTP/1.0 clients have to ask for keep-alive
+    connection = headers.get('connection', '').lower()
+    headers['keep-alive'] = (connection != 'close' if version == "HTTP/1.1"
+                             else connection == 'keep-alive')
+    url = urlsplit(target)
+    return method, url.path, parse_qs(url.query), headers, body
+
+def format_response(status, payload, content_type="application/json", keep_alive=True):
+    """
+    Encodes an HTTP response.
+    """
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+class VerifyServer:
+    """
+    The HTTP side of the verification service.
+    """
+
+    def __init__(self, blockchain):
+        self.blockchain = blockchain
+        self.coalescer = LookupCoalescer(blockchain)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves the requests of one (keep-alive) connection in order.
+        """
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    writer.write(format_response(e.status, {"status": "error", "message": e.message},
+                                                 keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+
+                start = time.perf_counter()
+                route, status, payload, content_type = await self.dispatch(method, path, query, body)
+                writer.write(format_response(status, payload, content_type, headers['keep-alive']))
+                metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route=route,
+                                                     method=method, status=status)
+                await writer.drain()
+                if not headers['keep-alive']:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, query, body):
+        """
+        Routes one request.
+
+        Returns:
+            tuple: (route pattern, status, payload, content type)
+        """
+        route = "unmatched"
+        try:
+            if path.startswith("/verify/"):
+                route = "/verify/<identity_hash>"
+                if method != "GET":
+                    raise HTTPError(405, "Use GET.")
+                identity_hash = path[len("/verify/"):]
+                check_hash(identity_hash)
+                registered, = await self.coalescer.lookup_many([identity_hash])
+                return route, 200, {"hash": identity_hash, "registered": registered}, "application/json"
+
+            if path == "/verify":
+                route = "/verify"
+                if method != "POST":
+                    raise HTTPError(405, "Use POST.")
+                hashes = parse_hashes(body)
+                answers = await self.coalescer.lookup_many(hashes)
+                results = [{"hash": identity_hash, "registered": registered}
+                           for identity_hash, registered in zip(hashes, answers)]
+                return route, 200, {"results": results}, "application/json"
+
+            if path == "/health":
+                route = "/health"
+                valid = await asyncio.get_running_loop().run_in_executor(None, self.coalescer.refresh)
+                chain, length = self.blockchain.snapshot()
+                return route, 200 if valid else 503, {
+                    "status": "ok" if valid else "compromised",
+                    "length": length,
+                    "last_hash": chain[length - 1]['hash'],
+                    "identity_count": len(self.blockchain.identity_index)
+                }, "application/json"
+
+            if path in ("/sync/headers", "/sync/blocks"):
+                route = path
+                if method != "GET":
+                    raise HTTPError(405, "Use GET.")
+                after, limit = query_int(query, 'after', 0), query_int(query, 'limit', 1000)
+                loop = asyncio.get_running_loop()
+                # Never hand out a tampered chain to other nodes
+                if not await loop.run_in_executor(None, self.coalescer.refresh):
+                    raise ChainCompromised()
+                # Sealed blocks may have to be read from disk
+                read = read_headers if path == "/sync/headers" else read_blocks
+                return route, 200, await loop.run_in_executor(None, read, self.blockchain, after, limit), "application/json"
+
+            if path == "/metrics":
+                route = "/metrics"
+                return route, 200, metrics.render().encode(), "text/plain; version=0.0.4"
+
+            raise HTTPError(404, "Not found.")
+        except HTTPError as e:
+            return route, e.status, {"status": "error", "message": e.message}, "application/json"
+        except ChainCompromised:
+            return route, 503, {"status": "error", "message": "SYSTEM HALTED: Blockchain compromised."}, "application/json"
+
+    async def serve(self, host, port, reuse_port=False):
+        server = await asyncio.start_server(self.handle_connection, host, port,
+                                            reuse_port=reuse_port, backlog=1024)
+        logger.info("Verification server listening on %s:%s", host, port)
+        async with server:
+            await server.serve_forever()
+
+def run_worker(host, port, reuse_port, chain_path="blockchain.jsonl", peer=None):
+    """
+    One server process with its own copy of the chain (they all share
+    the same chain file and pick up new blocks from it). With a peer,
+    this process also keeps the chain file in step with the peer's chain.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    # Stop on SIGTERM like on Ctrl+C, so the chain is closed cleanly
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    os.makedirs(os.path.dirname(chain_path) or ".", exist_ok=True)
+    blockchain = Blockchain(storage=SegmentedStorage(chain_path))
+    metrics.CHAIN_BLOCKS.set_function(lambda: len(blockchain.blockchain))
+    metrics.CHAIN_IDENTITIES.set_function(lambda: len(blockchain.identity_index))
+    follower = None
+    if peer:
+        follower = Follower(blockchain, peer)
+        follower.start()
+    try:
+        asyncio.run(VerifyServer(blockchain).serve(host, port, reuse_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if follower is not None:
+            follower.stop()
+        blockchain.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-only identity verification server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server processes sharing the port (SO_REUSEPORT, Linux/BSD)")
+    parser.add_argument("--chain", default="blockchain.jsonl", help="chain file of this node")
+    parser.add_argument("--peer", help="URL of a node to replicate the chain from (read replica)")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        run_worker(args.host, args.port, False, args.chain, args.peer)
+        return
+
+    # Only the first worker follows the peer; the others pick up
+    # the new blocks from the shared chain file
+    processes = [multiprocessing.Process(target=run_worker, args=(args.host, args.port, True, args.chain,
+                                                                  args.peer if n == 0 else None))
+                 for n in range(args.workers)]
+    for process in processes:
+        process.start()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Pass the shutdown on to the workers and wait for them
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+if __name__ == "__main__":
+    main()